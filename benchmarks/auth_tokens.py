@@ -0,0 +1,57 @@
+# benchmarks/auth_tokens.py
+"""Measure per request overhead of token authentication, without the database.
+
+Compares full verification on every request (previous behavior: environment lookup, signature
+check, claim decoding) with the verified-token cache of auth.dependencies:
+    PYTHONPATH=src SECRET_KEY=secret ALGORITHM=HS256 python benchmarks/auth_tokens.py
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from auth.dependencies import get_token_user_id, verified_tokens
+
+
+def create_token(user_id: int) -> str:
+    issued_at = datetime.utcnow()
+    return jwt.encode({"sub": base64.b64encode(str(user_id).encode()).decode(),
+                       "iat": issued_at,
+                       "exp": issued_at + timedelta(minutes=30)},
+                      os.getenv("SECRET_KEY"), algorithm=os.getenv("ALGORITHM"))
+
+
+def verify_uncached(token: str) -> int:
+    payload = jwt.decode(token, key=os.getenv("SECRET_KEY"), algorithms=os.getenv("ALGORITHM"))
+    return int(base64.b64decode(payload.get("sub")).decode('utf-8'))
+
+
+async def run_benchmark(requests: int, users: int) -> None:
+    tokens = [create_token(user_id) for user_id in range(1, users + 1)]
+
+    start = time.perf_counter()
+    for i in range(requests):
+        verify_uncached(tokens[i % users])
+    uncached = (time.perf_counter() - start) / requests * 1_000_000
+
+    verified_tokens.clear()
+    start = time.perf_counter()
+    for i in range(requests):
+        await get_token_user_id(tokens[i % users])
+    cached = (time.perf_counter() - start) / requests * 1_000_000
+
+    print(f"uncached: {uncached:.1f} us/request")
+    print(f"cached:   {cached:.1f} us/request ({users} distinct tokens, "
+          f"{verified_tokens.hits} hits, {verified_tokens.misses} misses)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100, help="Number of distinct tokens")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.requests, args.users))
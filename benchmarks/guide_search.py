@@ -0,0 +1,72 @@
+# benchmarks/guide_search.py
+"""Compare full-text guide search with the previous ilike title search.
+
+Seeds a synthetic corpus into the database configured in .env (use a throwaway local database)
+and times both statements for a few search terms:
+    PYTHONPATH=src python benchmarks/guide_search.py --seed 200000 --repeat 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import desc, func, text
+
+from core.models import Guide
+from database import engine
+from guides.service import get_initial_list_of_guides, search_query
+
+WORDS = ['python', 'docker', 'kubernetes', 'postgres', 'index', 'query', 'cache', 'network',
+         'design', 'frontend', 'backend', 'testing', 'security', 'cloud', 'linux', 'react',
+         'async', 'deploy', 'monitoring', 'pipeline', 'guide', 'tutorial', 'basics', 'advanced']
+TERMS = ['postgres', 'docker deploy', 'monitoring', 'tutorial']
+
+SEED_SQL = """
+INSERT INTO guide (title, content, note, published, user_id)
+SELECT
+    initcap(array_to_string(ARRAY(SELECT (:words)[1 + floor(random() * :count)::int]
+                                  FROM generate_series(1, 4) WHERE i > 0), ' ')),
+    array_to_string(ARRAY(SELECT (:words)[1 + floor(random() * :count)::int]
+                          FROM generate_series(1, 300) WHERE i > 0), ' '),
+    NULL,
+    true,
+    (SELECT min(user_id) FROM user_detail WHERE profession_id IS NOT NULL)
+FROM generate_series(1, :guides) AS i
+"""
+
+
+async def time_statement(connection, statement, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await connection.execute(statement)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def run_benchmark(seed: int, repeat: int) -> None:
+    async with engine.begin() as connection:
+        if seed:
+            await connection.execute(text(SEED_SQL),
+                                     {"words": WORDS, "count": len(WORDS), "guides": seed})
+            await connection.execute(text("ANALYZE guide"))
+        feed = await get_initial_list_of_guides(None)
+        for term in TERMS:
+            ilike = feed.where(Guide.published,
+                               func.coalesce(Guide.title, '').ilike(f"%{term}%")) \
+                .order_by(desc(Guide.last_modified)).limit(50)
+            full_text = feed.where(Guide.published,
+                                   Guide.search_vector.op('@@')(search_query(term))) \
+                .order_by(desc(func.ts_rank_cd(Guide.search_vector, search_query(term)))) \
+                .limit(50)
+            ilike_ms = await time_statement(connection, ilike, repeat)
+            full_text_ms = await time_statement(connection, full_text, repeat)
+            print(f"{term!r}: ilike {ilike_ms:.2f} ms, full-text {full_text_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0, help="Number of synthetic guides to insert")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.seed, args.repeat))
@@ -0,0 +1,45 @@
+# benchmarks/guides_throughput.py
+"""Measure concurrent throughput of GET /guides against a running instance.
+
+Run the API (`poetry run guidio`) and execute:
+    python benchmarks/guides_throughput.py --url http://127.0.0.1:8000 --concurrency 50
+Run it once on the old (sync session) build and once on the current one to compare.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+
+def fetch(url: str) -> float:
+    start = time.perf_counter()
+    try:
+        with urlopen(url) as response:
+            response.read()
+    except HTTPError:
+        pass
+    return time.perf_counter() - start
+
+
+def run_benchmark(url: str, requests: int, concurrency: int) -> None:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(fetch, [url] * requests))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"{requests} requests, concurrency {concurrency}")
+    print(f"throughput: {requests / elapsed:.1f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/guides?page=1&page_size=50")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    run_benchmark(args.url + args.path, args.requests, args.concurrency)
@@ -0,0 +1,78 @@
+# benchmarks/media_serving.py
+"""Measure throughput of media downloads and CPU time the API worker spends on them.
+
+Run the API with a single worker (`poetry run guidio`), upload an image and execute:
+    python benchmarks/media_serving.py --path /media/store/ab/cd/<sha256>.jpg --pid <worker pid>
+Run it once on the build with the StaticFiles mount and once on the current one to compare.
+Add --range 0-65535 for partial requests or --revalidate to send the ETag of the first
+response back in If-None-Match. Worker CPU is read from /proc, so it's only reported on Linux.
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+def worker_cpu_seconds(pid: int | None) -> float | None:
+    """User and system CPU time of the process"""
+    if pid is None or not os.path.exists(f"/proc/{pid}/stat"):
+        return None
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def fetch(request: Request) -> tuple[float, int]:
+    start = time.perf_counter()
+    received = 0
+    try:
+        with urlopen(request) as response:
+            while chunk := response.read(256 * 1024):
+                received += len(chunk)
+    except HTTPError as e:
+        if e.code != 304:
+            raise
+    return time.perf_counter() - start, received
+
+
+def run_benchmark(url: str, requests: int, concurrency: int, pid: int | None,
+                  byte_range: str | None, revalidate: bool) -> None:
+    headers = {"Range": f"bytes={byte_range}"} if byte_range else {}
+    if revalidate:
+        with urlopen(url) as response:
+            headers["If-None-Match"] = response.headers["ETag"]
+    request = Request(url, headers=headers)
+
+    cpu_before = worker_cpu_seconds(pid)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, [request] * requests))
+    elapsed = time.perf_counter() - started
+    cpu_after = worker_cpu_seconds(pid)
+
+    latencies = sorted(latency for latency, _ in results)
+    received = sum(size for _, size in results)
+    print(f"{requests} requests, concurrency {concurrency}")
+    print(f"throughput: {requests / elapsed:.1f} req/s, {received / elapsed / 1024 ** 2:.1f} MiB/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    if cpu_before is not None and cpu_after is not None:
+        cpu = cpu_after - cpu_before
+        print(f"worker CPU: {cpu:.2f} s, {cpu / requests * 1_000_000:.0f} us per request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", required=True, help="Media URL path, e.g. /media/store/...")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pid", type=int, help="API worker process to measure CPU time of")
+    parser.add_argument("--range", dest="byte_range", help="Byte range, e.g. 0-65535")
+    parser.add_argument("--revalidate", action="store_true")
+    args = parser.parse_args()
+    run_benchmark(args.url + args.path, args.requests, args.concurrency, args.pid,
+                  args.byte_range, args.revalidate)
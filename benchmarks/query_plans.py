@@ -0,0 +1,111 @@
+# benchmarks/query_plans.py
+"""Check that hot guide feed queries don't fall back to sequential scans.
+
+Runs EXPLAIN on the statements built by guides.service against the database configured in .env
+and exits with status 1 if a sequential scan on a checked table shows up. The planner prefers
+sequential scans on tiny tables, --seed inserts synthetic rows first. Everything runs in one
+transaction which is rolled back, seeded rows are never committed.
+    PYTHONPATH=src python benchmarks/query_plans.py --seed 100000
+
+tests/test_query_plans.py runs the same check under pytest.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from sqlalchemy import desc, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from core.models import Guide, GuideFeed
+from database import engine
+from guides.service import get_initial_list_of_guides, get_initial_feed_of_guides
+
+CHECKED_RELATIONS = {'guide', 'guide_feed', 'user_detail'}
+
+SEED_SQL = [
+    """INSERT INTO "user" (first_name, last_name, email, password, is_active)
+       SELECT 'First' || i, 'Last' || i, 'seed' || i || '@guidio.com', 'x', true
+       FROM generate_series(1, :users) AS i
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO user_detail (user_id, profession_id, is_instructor)
+       SELECT u.user_id, (SELECT min(profession_id) FROM profession), u.user_id % 10 = 0
+       FROM "user" u
+       WHERE u.email LIKE 'seed%' AND NOT EXISTS
+           (SELECT 1 FROM user_detail d WHERE d.user_id = u.user_id)""",
+    """INSERT INTO guide (title, content, published, user_id, last_modified)
+       SELECT 'Guide ' || i, repeat('content ', 50), i % 3 <> 0,
+              (SELECT min(user_id) FROM "user" WHERE email LIKE 'seed%') + i % :users,
+              now() - i * interval '1 minute'
+       FROM generate_series(1, :guides) AS i""",
+    """INSERT INTO guide_feed (guide_id, title, created_at, last_modified, user_id,
+                               first_name, last_name)
+       SELECT g.guide_id, g.title, g.created_at, g.last_modified, u.user_id,
+              u.first_name, u.last_name
+       FROM guide g JOIN "user" u ON u.user_id = g.user_id
+       WHERE g.published AND u.email LIKE 'seed%'
+       ON CONFLICT DO NOTHING""",
+    "ANALYZE",
+]
+
+
+async def build_statements() -> dict:
+    feed = await get_initial_feed_of_guides(None)
+    published_feed = feed.order_by(desc(GuideFeed.last_modified), desc(GuideFeed.guide_id))
+    author_feed = feed.where(GuideFeed.user_id == 1) \
+        .order_by(desc(GuideFeed.last_modified), desc(GuideFeed.guide_id))
+    own_guides = (await get_initial_list_of_guides(None)).where(Guide.user_id == 1) \
+        .order_by(desc(Guide.last_modified), desc(Guide.guide_id))
+    return {
+        "published feed, first page": published_feed.limit(50),
+        "published feed, deep page": published_feed.offset(5000).limit(50),
+        "author feed": author_feed.limit(50),
+        "own guides": own_guides.limit(50),
+    }
+
+
+def find_sequential_scans(plan: dict) -> list[str]:
+    scans = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in CHECKED_RELATIONS:
+        scans.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        scans.extend(find_sequential_scans(child))
+    return scans
+
+
+async def seed_rows(connection: AsyncConnection, guides: int) -> None:
+    for sql in SEED_SQL:
+        await connection.execute(text(sql), {"users": max(guides // 10, 1), "guides": guides})
+
+
+async def explain_sequential_scans(connection: AsyncConnection) -> dict[str, list[str]]:
+    """Checked relations scanned sequentially by each statement, by statement name"""
+    scans = {}
+    for name, statement in (await build_statements()).items():
+        sql = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+        plan = await connection.scalar(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans[name] = find_sequential_scans(plan[0]["Plan"])
+    return scans
+
+
+async def check_plans(seed: int) -> bool:
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        try:
+            if seed:
+                await seed_rows(connection, seed)
+            results = await explain_sequential_scans(connection)
+        finally:
+            await transaction.rollback()
+    for name, scans in results.items():
+        print(f"{'FAIL' if scans else 'OK'}: {name}" + (f" (seq scan on {scans})" if scans else ""))
+    return not any(results.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0, help="Number of synthetic guides to insert")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(check_plans(args.seed)) else 1)
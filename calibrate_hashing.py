@@ -0,0 +1,76 @@
+# calibrate_hashing.py
+"""Benchmark password hashing on this host and recommend cost settings for a target verify time.
+
+    poetry run calibrate-hashing --target-ms 250
+    poetry run calibrate-hashing --scheme argon2 --memory-kib 65536 --target-ms 250
+
+Run it on the production hardware, the recommendation goes to PASSWORD_BCRYPT_ROUNDS or
+PASSWORD_ARGON2_TIME_COST. Users' hashes are upgraded on their next login.
+"""
+import argparse
+import statistics
+import time
+
+from passlib.context import CryptContext
+
+PASSWORD = "calibration-Password-123"
+
+
+def time_verify(context: CryptContext, repeat: int) -> float:
+    """Median verify time in milliseconds"""
+    hashed = context.hash(PASSWORD)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        context.verify(PASSWORD, hashed)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def calibrate(costs, create_context, target_ms: float, repeat: int) -> int | None:
+    """Return the highest cost whose verify time fits the target"""
+    recommended = None
+    for cost in costs:
+        elapsed = time_verify(create_context(cost), repeat)
+        print(f"  cost {cost:>2}: {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            break
+        recommended = cost
+    return recommended
+
+
+def run_calibration():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt")
+    parser.add_argument("--target-ms", type=float, default=250,
+                        help="Verify time budget of a single login")
+    parser.add_argument("--memory-kib", type=int, default=65536, help="argon2 memory limit")
+    parser.add_argument("--parallelism", type=int, default=4, help="argon2 lanes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.scheme}, target {args.target_ms:.0f} ms per verify")
+    if args.scheme == "bcrypt":
+        recommended = calibrate(range(8, 18),
+                                lambda cost: CryptContext(schemes=["bcrypt"], bcrypt__rounds=cost),
+                                args.target_ms, args.repeat)
+        setting = "PASSWORD_BCRYPT_ROUNDS"
+    else:
+        recommended = calibrate(range(1, 11),
+                                lambda cost: CryptContext(schemes=["argon2"],
+                                                          argon2__time_cost=cost,
+                                                          argon2__memory_cost=args.memory_kib,
+                                                          argon2__parallelism=args.parallelism),
+                                args.target_ms, args.repeat)
+        setting = "PASSWORD_ARGON2_TIME_COST"
+    if recommended is None:
+        print("Even the lowest cost exceeds the target, raise the budget or use faster hardware")
+        return
+    print(f"Recommended: {setting}={recommended}")
+    if args.scheme == "argon2":
+        print(f"             PASSWORD_ARGON2_MEMORY_COST={args.memory_kib}")
+        print(f"             PASSWORD_ARGON2_PARALLELISM={args.parallelism}")
+
+
+if __name__ == "__main__":
+    run_calibration()
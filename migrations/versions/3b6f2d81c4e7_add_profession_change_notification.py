@@ -0,0 +1,37 @@
+"""add profession change notification
+
+Revision ID: 3b6f2d81c4e7
+Revises: e41c0b7d9a2f
+Create Date: 2026-10-18 15:48:12.402913
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3b6f2d81c4e7'
+down_revision = 'e41c0b7d9a2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Workers reload their in-memory profession index when notified, channel and payload match
+    # core.settings.CACHE_INVALIDATION_CHANNEL and users.constants.PROFESSION_CACHE_NAMESPACE
+    op.execute("""
+        CREATE FUNCTION notify_profession_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('cache_invalidation', 'profession');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER profession_change_notification
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON profession
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_profession_change()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER profession_change_notification ON profession")
+    op.execute("DROP FUNCTION notify_profession_change()")
@@ -0,0 +1,54 @@
+"""add media_file table
+
+Revision ID: 4f9e1c6a8b20
+Revises: 7c2a95e0d3b1
+Create Date: 2026-10-18 17:12:05.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4f9e1c6a8b20'
+down_revision = '7c2a95e0d3b1'
+branch_labels = None
+depends_on = None
+
+IMAGE_COLUMNS = (
+    ('user_detail', 'avatar'),
+    ('user_detail', 'cover_image'),
+    ('guide', 'cover_image'),
+)
+
+
+def upgrade() -> None:
+    op.create_table('media_file',
+                    sa.Column('path', sa.String(length=255), nullable=False),
+                    sa.Column('sha256', sa.String(length=64), nullable=True),
+                    sa.Column('content_type', sa.String(length=50), nullable=True),
+                    sa.Column('size', sa.Integer(), nullable=True),
+                    sa.Column('ref_count', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(timezone=True),
+                              server_default=sa.text('now()'), nullable=False),
+                    sa.Column('released_at', sa.DateTime(timezone=True), nullable=True),
+                    sa.PrimaryKeyConstraint('path'),
+                    sa.UniqueConstraint('sha256'))
+    op.create_index('ix_media_file_unreferenced_released_at', 'media_file',
+                    ['released_at'], unique=False,
+                    postgresql_where=sa.text('ref_count = 0'))
+    # Files uploaded before the store keep their paths, without a hash
+    references = " UNION ALL ".join(
+        f"SELECT {column} AS path FROM {table} WHERE {column} IS NOT NULL"
+        for table, column in IMAGE_COLUMNS)
+    op.execute(f"INSERT INTO media_file (path, ref_count) "
+               f"SELECT path, count(*) FROM ({references}) AS refs GROUP BY path")
+    for table, column in IMAGE_COLUMNS:
+        op.create_foreign_key(f'{table}_{column}_fkey', table, 'media_file',
+                              [column], ['path'])
+
+
+def downgrade() -> None:
+    for table, column in IMAGE_COLUMNS:
+        op.drop_constraint(f'{table}_{column}_fkey', table, type_='foreignkey')
+    op.drop_index('ix_media_file_unreferenced_released_at', table_name='media_file')
+    op.drop_table('media_file')
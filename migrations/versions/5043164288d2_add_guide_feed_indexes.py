@@ -0,0 +1,32 @@
+"""add guide feed indexes
+
+Revision ID: 5043164288d2
+Revises: 87bdaebd4785
+Create Date: 2026-10-18 10:12:41.530226
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5043164288d2'
+down_revision = '87bdaebd4785'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_guide_published_last_modified', 'guide',
+                    ['last_modified', 'guide_id'], unique=False,
+                    postgresql_where=sa.text('published'))
+    op.create_index('ix_guide_user_id_last_modified', 'guide',
+                    ['user_id', 'last_modified', 'guide_id'], unique=False)
+    op.create_index('ix_user_detail_instructor_user_id', 'user_detail',
+                    ['user_id'], unique=False,
+                    postgresql_where=sa.text('is_instructor'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_detail_instructor_user_id', table_name='user_detail')
+    op.drop_index('ix_guide_user_id_last_modified', table_name='guide')
+    op.drop_index('ix_guide_published_last_modified', table_name='guide')
@@ -0,0 +1,47 @@
+"""add mail outbox table
+
+Revision ID: 7c2a95e0d3b1
+Revises: 3b6f2d81c4e7
+Create Date: 2026-10-18 16:37:50.128344
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '7c2a95e0d3b1'
+down_revision = '3b6f2d81c4e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('mail_outbox',
+                    sa.Column('mail_id', sa.Integer(), nullable=False),
+                    sa.Column('recipient', sa.String(length=120), nullable=False),
+                    sa.Column('subject', sa.String(length=255), nullable=False),
+                    sa.Column('template_name', sa.String(length=100), nullable=False),
+                    sa.Column('body', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+                    sa.Column('dedup_key', sa.String(length=255), nullable=True),
+                    sa.Column('status', sa.String(length=20), nullable=False),
+                    sa.Column('attempts', sa.Integer(), nullable=False),
+                    sa.Column('next_attempt_at', sa.DateTime(timezone=True),
+                              server_default=sa.text('now()'), nullable=False),
+                    sa.Column('last_error', sa.Text(), nullable=True),
+                    sa.Column('created_at', sa.DateTime(timezone=True),
+                              server_default=sa.text('now()'), nullable=False),
+                    sa.Column('sent_at', sa.DateTime(timezone=True), nullable=True),
+                    sa.PrimaryKeyConstraint('mail_id'))
+    op.create_index('ix_mail_outbox_pending_next_attempt_at', 'mail_outbox',
+                    ['next_attempt_at'], unique=False,
+                    postgresql_where=sa.text("status = 'pending'"))
+    op.create_index('ix_mail_outbox_pending_dedup_key', 'mail_outbox',
+                    ['dedup_key'], unique=True,
+                    postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_mail_outbox_pending_dedup_key', table_name='mail_outbox')
+    op.drop_index('ix_mail_outbox_pending_next_attempt_at', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,34 @@
+"""add guide search vector
+
+Revision ID: 9dbdf0e55cd0
+Revises: 5043164288d2
+Create Date: 2026-10-18 11:02:17.845120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '9dbdf0e55cd0'
+down_revision = '5043164288d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('guide', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed("setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                    "setweight(to_tsvector('english', coalesce(note, '')), 'B') || "
+                    "setweight(to_tsvector('english', coalesce(content, '')), 'C')",
+                    persisted=True),
+        nullable=True))
+    op.create_index('ix_guide_search_vector', 'guide', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_guide_search_vector', table_name='guide', postgresql_using='gin')
+    op.drop_column('guide', 'search_vector')
@@ -0,0 +1,55 @@
+"""add guide feed table
+
+Revision ID: a5083184a9df
+Revises: cc319197b929
+Create Date: 2026-10-18 13:21:06.718403
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a5083184a9df'
+down_revision = 'cc319197b929'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('guide_feed',
+                    sa.Column('guide_id', sa.Integer(), nullable=False),
+                    sa.Column('title', sa.String(length=70), nullable=False),
+                    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+                    sa.Column('last_modified', sa.DateTime(timezone=True), nullable=False),
+                    sa.Column('cover_image', sa.String(length=255), nullable=True),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('first_name', sa.String(length=100), nullable=False),
+                    sa.Column('last_name', sa.String(length=150), nullable=False),
+                    sa.Column('avatar', sa.String(length=255), nullable=True),
+                    sa.Column('profession', sa.String(length=100), nullable=True),
+                    sa.ForeignKeyConstraint(['guide_id'], ['guide.guide_id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('guide_id')
+                    )
+    op.create_index('ix_guide_feed_last_modified', 'guide_feed',
+                    ['last_modified', 'guide_id'], unique=False)
+    op.create_index('ix_guide_feed_user_id_last_modified', 'guide_feed',
+                    ['user_id', 'last_modified', 'guide_id'], unique=False)
+    # Backfill from existing published guides
+    op.execute("""
+        INSERT INTO guide_feed (guide_id, title, created_at, last_modified, cover_image, user_id,
+                                first_name, last_name, avatar, profession)
+        SELECT g.guide_id, g.title, g.created_at, g.last_modified, g.cover_image, u.user_id,
+               u.first_name, u.last_name, d.avatar, p.name
+        FROM guide g
+        JOIN "user" u ON u.user_id = g.user_id
+        LEFT JOIN user_detail d ON d.user_id = u.user_id
+        LEFT JOIN profession p ON p.profession_id = d.profession_id
+        WHERE g.published
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_guide_feed_user_id_last_modified', table_name='guide_feed')
+    op.drop_index('ix_guide_feed_last_modified', table_name='guide_feed')
+    op.drop_table('guide_feed')
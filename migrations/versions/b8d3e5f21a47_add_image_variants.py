@@ -0,0 +1,38 @@
+"""add image variants
+
+Revision ID: b8d3e5f21a47
+Revises: 4f9e1c6a8b20
+Create Date: 2026-10-18 17:48:21.903164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3e5f21a47'
+down_revision = '4f9e1c6a8b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing files get NULL and are picked up by the variant worker
+    op.add_column('media_file', sa.Column('variants', postgresql.JSONB(astext_type=sa.Text()),
+                                          nullable=True))
+    op.create_index('ix_media_file_pending_variants_created_at', 'media_file',
+                    ['created_at'], unique=False,
+                    postgresql_where=sa.text('variants IS NULL'))
+    op.add_column('guide_feed', sa.Column('cover_image_variants',
+                                          postgresql.JSONB(astext_type=sa.Text()),
+                                          nullable=True))
+    op.add_column('guide_feed', sa.Column('avatar_variants',
+                                          postgresql.JSONB(astext_type=sa.Text()),
+                                          nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('guide_feed', 'avatar_variants')
+    op.drop_column('guide_feed', 'cover_image_variants')
+    op.drop_index('ix_media_file_pending_variants_created_at', table_name='media_file')
+    op.drop_column('media_file', 'variants')
@@ -0,0 +1,24 @@
+"""add media file variants lease
+
+Revision ID: c4a7e92b1f60
+Revises: b8d3e5f21a47
+Create Date: 2026-10-18 21:12:40.318527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e92b1f60'
+down_revision = 'b8d3e5f21a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('media_file', sa.Column('variants_claimed_until', sa.DateTime(timezone=True),
+                                          nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('media_file', 'variants_claimed_until')
@@ -0,0 +1,30 @@
+"""add trigram search indexes
+
+Revision ID: cc319197b929
+Revises: 9dbdf0e55cd0
+Create Date: 2026-10-18 11:48:55.204317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'cc319197b929'
+down_revision = '9dbdf0e55cd0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Expression index isn't reflected by autogenerate, it's defined only here
+    op.create_index('ix_user_full_name_trgm', 'user',
+                    [sa.text("(first_name || ' ' || last_name) gin_trgm_ops")],
+                    unique=False, postgresql_using='gin')
+    op.create_index('ix_profession_name_trgm', 'profession', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_profession_name_trgm', table_name='profession')
+    op.drop_index('ix_user_full_name_trgm', table_name='user')
@@ -0,0 +1,25 @@
+"""add last_modified to user
+
+Revision ID: e41c0b7d9a2f
+Revises: a5083184a9df
+Create Date: 2026-10-18 15:02:37.184520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e41c0b7d9a2f'
+down_revision = 'a5083184a9df'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows get the current timestamp from the server default
+    op.add_column('user', sa.Column('last_modified', sa.DateTime(timezone=True),
+                                    server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'last_modified')
@@ -1,17 +1,57 @@
-import os
+import base64
+import binascii
+import hashlib
+import time
 
 from fastapi import HTTPException, status, Depends
 from jose import jwt, JOSEError
 
+from auth.exceptions import invalid_credentials_exception
+from config import SECRET_KEY, ALGORITHM, TOKEN_CACHE_MAX_ENTRIES
+from core.cache import LRUCache
+
+# Key material resolved once on import instead of reading the environment on every request
+TOKEN_KEY = SECRET_KEY
+TOKEN_ALGORITHMS = [ALGORITHM]
+
+# SHA-256 of verified token -> user id, each entry expires together with its token
+verified_tokens = LRUCache(max_entries=TOKEN_CACHE_MAX_ENTRIES)
+
+
+def check_token_settings() -> None:
+    """Fail on startup instead of on the first authenticated request"""
+    if not TOKEN_KEY or not ALGORITHM:
+        raise RuntimeError("SECRET_KEY and ALGORITHM have to be set")
+
 
 async def is_valid_token(token: str) -> dict:
     if not isinstance(token, str):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
     try:
-        payload = jwt.decode(token, key=os.getenv("SECRET_KEY"), algorithms=os.getenv("ALGORITHM"))
+        payload = jwt.decode(token, key=TOKEN_KEY, algorithms=TOKEN_ALGORITHMS)
         return payload
     except JOSEError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
 
+async def get_token_user_id(token: str) -> int:
+    """Get user id from a valid token. Verified tokens are cached until they expire, so repeated
+    requests with the same token skip signature verification and claim decoding."""
+    if not isinstance(token, str):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    key = hashlib.sha256(token.encode()).digest()
+    user_id = verified_tokens.get(key)
+    if user_id is not None:
+        return user_id
+    payload = await is_valid_token(token)
+    try:
+        user_id = int(base64.b64decode(payload.get("sub")).decode('utf-8'))
+    except (TypeError, ValueError, binascii.Error):
+        raise await invalid_credentials_exception()
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        verified_tokens.set(key, user_id, ttl=expires_in)
+    return user_id
+
+
 ValidToken = Depends(is_valid_token)
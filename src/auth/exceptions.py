@@ -29,3 +29,13 @@ async def token_exception():
         headers={"WWW-Authenticate": "Bearer"},
     )
     return token_exception_response
+
+
+async def hashing_unavailable_exception():
+    """Return HTTPException 503 as all password hashing workers are busy"""
+    response = HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, try again later",
+        headers={"Retry-After": "1"},
+    )
+    return response
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+from auth.exceptions import hashing_unavailable_exception
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_SCHEME, \
+    PASSWORD_BCRYPT_ROUNDS, PASSWORD_ARGON2_TIME_COST, PASSWORD_ARGON2_MEMORY_COST, \
+    PASSWORD_ARGON2_PARALLELISM
+
+
+def create_password_context() -> CryptContext:
+    """Hashing policy from config. New hashes use PASSWORD_HASH_SCHEME, hashes of the other
+    scheme or with different cost parameters are still verified and reported as needing an
+    update. Run calibrate_hashing.py to pick the cost for the host."""
+    schemes = ["argon2", "bcrypt"] if PASSWORD_HASH_SCHEME == "argon2" else ["bcrypt"]
+    # Hashes below min_rounds need an update, so raising the cost upgrades existing users
+    settings = {"bcrypt__rounds": PASSWORD_BCRYPT_ROUNDS,
+                "bcrypt__min_rounds": PASSWORD_BCRYPT_ROUNDS}
+    if PASSWORD_HASH_SCHEME == "argon2":
+        # Requires argon2-cffi, install it with `poetry install -E argon2`
+        settings.update({"argon2__time_cost": PASSWORD_ARGON2_TIME_COST,
+                         "argon2__memory_cost": PASSWORD_ARGON2_MEMORY_COST,
+                         "argon2__parallelism": PASSWORD_ARGON2_PARALLELISM})
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+password_context = create_password_context()
+
+
+# Executed in the pool processes, module level so they can be pickled
+def hash_password(password: str) -> str:
+    return password_context.hash(password)
+
+
+def verify_hash(plain_password: str, hashed_password: str) -> bool:
+    return password_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update_hash(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify password and return new hash if the stored one doesn't match the current policy"""
+    return password_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHashingPool:
+    """Process pool for password hashing, keeps CPU heavy bcrypt rounds off the event loop.
+
+    At most max_queue jobs wait for a free worker, further jobs are rejected with 503 straight
+    away instead of piling up behind a burst of logins.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor: ProcessPoolExecutor | None = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # Latencies of recent jobs in seconds, including time spent in the queue
+        self.latencies: deque[float] = deque(maxlen=1000)
+
+    async def start(self) -> None:
+        """Start worker processes up front, before the application opens sockets they would
+        inherit"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.workers)))
+
+    async def run(self, function, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise await hashing_unavailable_exception()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        job = self.executor.submit(function, *args)
+        self.pending += 1
+        # A cancelled request doesn't stop a job a process already runs, the job stays pending
+        # until the process is done with it
+        job.add_done_callback(lambda _: self._call_on_loop(loop, self._job_done, start))
+        return await asyncio.wrap_future(job)
+
+    @staticmethod
+    def _call_on_loop(loop: asyncio.AbstractEventLoop, callback, *args) -> None:
+        # Done callbacks run in the executor's thread
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Loop closed on shutdown, nobody reads the counters anymore
+            pass
+
+    def _job_done(self, start: float) -> None:
+        self.pending -= 1
+        self.completed += 1
+        self.latencies.append(time.perf_counter() - start)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "pid": os.getpid(),
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(self.pending - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_ms": {
+                "p50": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 2)
+                if latencies else None,
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
+
+
+password_hashing_pool = PasswordHashingPool(workers=PASSWORD_HASH_WORKERS,
+                                            max_queue=PASSWORD_HASH_MAX_QUEUE)
@@ -19,7 +19,8 @@ async def send_verification_email(request: Request, email: EmailStr, db=DBDepend
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="User with specified email doesn't exists")
-    await service.send_activation_email_to_user(request, user)
+    await service.send_activation_email_to_user(request, user, db)
+    await db.commit()
     return JSONResponse(content={"detail": "Activation email sent"})
 
 
@@ -29,3 +29,12 @@ class LoginSchema(BaseModelSchema):
                 "password": "examplePassword123!",
             }
         }
+
+
+class CurrentUserSchema(BaseModelSchema):
+    """Snapshot of the authenticated user for handlers which don't modify the user"""
+    user_id: int
+    is_active: bool
+    is_instructor: bool
+    first_name: str
+    last_name: str
@@ -3,22 +3,26 @@ import re
 from datetime import datetime, timedelta
 from typing import Match
 
-from fastapi import Request, HTTPException
-from jose import jwt, ExpiredSignatureError, JWTError
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from fastapi import Depends, Request, HTTPException
+from jose import jwt
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from auth import schemas
-from auth.dependencies import is_valid_token
+from auth.dependencies import get_token_user_id
+from auth.hashing import password_hashing_pool, hash_password, verify_hash, \
+    verify_and_update_hash
 from auth.exceptions import invalid_credentials_exception, token_exception, user_inactive_exception
+from config import CURRENT_USER_CACHE_TTL
+from core.cache import cache_backend, invalidate_on_commit
+from core.constants import ACTIVATE_ACCOUNT_SUBJECT, ACTIVATE_ACCOUNT_TEMPLATE
 from core.dependencies import DBDependency
-from core.models import User, UserDetail
+from core.models import User, UserDetail, user_profile_options
 from core.settings import AUTH_TOKEN
 from src.config import SECRET_KEY, ALGORITHM, TOKEN_EXP_MINUTES
-
-# CONSTANTS
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from users.constants import USER_CACHE_NAMESPACE, CURRENT_USER_CACHE_NAMESPACE
+from utils.mail.outbox import enqueue_mail
 
 
 # Intermediate function helpers
@@ -31,7 +35,7 @@ async def get_password_hash(password: str) -> str:
     Returns:
         string value as password hash
     """
-    return bcrypt_context.hash(password)
+    return await password_hashing_pool.run(hash_password, password)
 
 
 async def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -44,7 +48,7 @@ async def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         boolean value as result of verification
     """
-    return bcrypt_context.verify(plain_password, hashed_password)
+    return await password_hashing_pool.run(verify_hash, plain_password, hashed_password)
 
 
 def find_detail_in_error(substring: str, message: str) -> Match[str] | None:
@@ -78,30 +82,57 @@ async def create_auth_token(user_id: int) -> str:
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(token: str, db: Session):
+async def get_current_user(token: str, db: AsyncSession):
     """Get current user object if jwt is valid
 
     Args:
         token (str): JWT encoded token
-        db (Session): database session
+        db (AsyncSession): database session
 
     Returns:
         User object or exception
     """
-    try:
-        payload = await is_valid_token(token)
-        user_id_base64 = payload.get("sub")
-        user_id = int(base64.b64decode(user_id_base64).decode('utf-8'))
-        if user_id is None:
-            raise await invalid_credentials_exception()
-        user: User = db.query(User).get(user_id)
-        if user is None:
-            raise await invalid_credentials_exception()
-        return user
-    except ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Token expired")
-    except JWTError:
-        raise await token_exception()
+    user_id = await get_token_user_id(token)
+    user: User = await db.get(User, user_id, options=user_profile_options)
+    if user is None:
+        raise await invalid_credentials_exception()
+    return user
+
+
+async def get_current_user_snapshot(token: str, db: AsyncSession) -> schemas.CurrentUserSchema:
+    """Get snapshot of the current user if jwt is valid, served from the cache backend when
+    possible. Cache hits don't touch the database.
+
+    Args:
+        token (str): JWT encoded token
+        db (AsyncSession): database session, used on cache miss only
+
+    Returns:
+        CurrentUserSchema or exception
+    """
+    user_id = await get_token_user_id(token)
+    cached = await cache_backend.get(CURRENT_USER_CACHE_NAMESPACE, str(user_id))
+    if cached is not None:
+        return schemas.CurrentUserSchema.model_validate_json(cached)
+    generation = await cache_backend.generation(CURRENT_USER_CACHE_NAMESPACE)
+    user = (await db.execute(select(User.user_id,
+                                    User.is_active,
+                                    func.coalesce(UserDetail.is_instructor, False)
+                                    .label('is_instructor'),
+                                    User.first_name,
+                                    User.last_name)
+                             .outerjoin(UserDetail, User.user_id == UserDetail.user_id)
+                             .where(User.user_id == user_id))).first()
+    if user is None:
+        raise await invalid_credentials_exception()
+    snapshot = schemas.CurrentUserSchema(user_id=user.user_id,
+                                         is_active=bool(user.is_active),
+                                         is_instructor=user.is_instructor,
+                                         first_name=user.first_name,
+                                         last_name=user.last_name)
+    await cache_backend.set(CURRENT_USER_CACHE_NAMESPACE, str(user_id), snapshot.model_dump_json(),
+                            generation, CURRENT_USER_CACHE_TTL)
+    return snapshot
 
 
 async def get_current_active_user(request: Request, db=DBDependency):
@@ -111,48 +142,77 @@ async def get_current_active_user(request: Request, db=DBDependency):
     return current_user
 
 
+async def get_current_active_user_snapshot(request: Request,
+                                           db=DBDependency) -> schemas.CurrentUserSchema:
+    """Use instead of get_current_active_user in handlers which don't modify the user"""
+    current_user = await get_current_user_snapshot(request.cookies.get(AUTH_TOKEN), db)
+    if not current_user.is_active:
+        raise await user_inactive_exception()
+    return current_user
+
+
+CurrentUserSnapshot = Depends(get_current_active_user_snapshot)
+
+
 # Database interactive functions
-async def authenticate_user(email: str, password: str, db: Session) -> User | bool:
+async def authenticate_user(email: str, password: str, db: AsyncSession) -> User | bool:
     """Search for user in database and return user object. If user doesn't exist return False
 
     Args:
         email (str): user's provided email
         password (str): plain password
-        db (Session): database Session
+        db (AsyncSession): database Session
 
     Returns:
         object: User's object if user exist
         bool: False if user doesn't exist in database
     """
-    user = db.query(User).filter(User.email == email).first()
+    user = (await db.execute(select(User)
+                             .options(*user_profile_options)
+                             .where(User.email == email))).scalars().first()
     if not user:
         return False
-    if not await verify_password(password, user.password):
+    verified, new_hash = await password_hashing_pool.run(verify_and_update_hash,
+                                                         password, user.password)
+    if not verified:
         return False
+    if new_hash:
+        # Hash made under an older policy (scheme or cost), upgrade it while the plain password
+        # is at hand
+        user.password = new_hash
+        await db.commit()
     return user
 
 
-async def get_user_by_email(db: Session, email: str) -> User | None:
+async def get_user_by_email(db: AsyncSession, email: str) -> User | None:
     """Check if user exist based on provided email
 
     Args:
-        db (Session): database session
+        db (AsyncSession): database session
         email (str): provided email
     Returns:
         bool: True if user object exist in the database or None
     """
-    return db.query(User).filter(User.email == email).first()
+    return (await db.execute(select(User).where(User.email == email))).scalars().first()
 
 
-async def send_activation_email_to_user(request: Request, user: User):
-    token = create_auth_token(user.user_id)
+async def send_activation_email_to_user(request: Request, user: User, db: AsyncSession):
+    """Queue activation email in the current transaction, repeated requests are deduplicated
+    while an activation email for the user is still pending"""
+    token = await create_auth_token(user.user_id)
     base_url = str(request.base_url)
     verification_url: str = f"{base_url}auth/verify_email?token={token}"
     expiration_time: datetime = datetime.utcnow() + timedelta(minutes=int(TOKEN_EXP_MINUTES))
-    await user.send_activation_email(verification_url, expiration_time)
+    await enqueue_mail(db,
+                       recipient=user.email,
+                       subject=ACTIVATE_ACCOUNT_SUBJECT,
+                       body={"first_name": user.first_name, "url": verification_url,
+                             "expire_at": expiration_time.strftime("%Y-%m-%d %H:%M:%S")},
+                       template_name=ACTIVATE_ACCOUNT_TEMPLATE,
+                       dedup_key=f"activation:{user.user_id}")
 
 
-async def create_user(request: Request, db: Session,
+async def create_user(request: Request, db: AsyncSession,
                       data: schemas.RegistrationSchemaUser) -> User.user_id | None:
     """ If user doesn't already exist, create user in database, send verification email and
     return created object id.
@@ -161,7 +221,7 @@ async def create_user(request: Request, db: Session,
 
     Args:
         request (Request): request object to construct verification url
-        db (Session): database Session
+        db (AsyncSession): database Session
         data (schema): fields provided based on schema
             email (str): provided email for the registration
             first_name (str): user's first name
@@ -178,20 +238,22 @@ async def create_user(request: Request, db: Session,
     db_user.email = data.email
     db_user.first_name = data.first_name
     db_user.last_name = data.last_name
-    hashed_password = get_password_hash(data.password)
+    hashed_password = await get_password_hash(data.password)
     db_user.password = hashed_password
     db.add(db_user)
-    db.commit()
+    await db.flush()
     # create user details
     user_detail = UserDetail(user_id=db_user.user_id)
     db.add(user_detail)
-    db.commit()
-    db.refresh(db_user)
-    await send_activation_email_to_user(request, db_user)
+    # User, details and the activation email are committed together
+    await send_activation_email_to_user(request, db_user, db)
+    await db.commit()
     return db_user.user_id
 
 
-async def activate_user(user: User, db: Session) -> None:
+async def activate_user(user: User, db: AsyncSession) -> None:
     user.is_active = True
-    db.commit()
+    await invalidate_on_commit(db, USER_CACHE_NAMESPACE, user.user_id)
+    await invalidate_on_commit(db, CURRENT_USER_CACHE_NAMESPACE, user.user_id)
+    await db.commit()
     return
@@ -2,11 +2,33 @@ import os
 
 from dotenv import load_dotenv
 
+load_dotenv()
+
+
+def getenv(key: str, default=None):
+    """os.getenv treating empty values as unset. python-dotenv reads a `# comment` right after
+    `=` as the value, so the placeholders of .env.example are unset too."""
+    value = os.getenv(key)
+    if value is None or not value.strip() or value.lstrip().startswith('#'):
+        return default
+    return value
+
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 TOKEN_EXP_MINUTES = os.getenv("TOKEN_EXP_MINUTES")
+# Number of verified tokens cached per worker
+TOKEN_CACHE_MAX_ENTRIES = int(getenv('TOKEN_CACHE_MAX_ENTRIES', 10000))
+# Password hashing process pool per worker, requests beyond workers + queue get 503
+PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_QUEUE = int(getenv('PASSWORD_HASH_MAX_QUEUE', 16))
+# Password hashing policy, existing hashes are upgraded on login when it changes
+PASSWORD_HASH_SCHEME = getenv('PASSWORD_HASH_SCHEME', 'bcrypt')
+PASSWORD_BCRYPT_ROUNDS = int(getenv('PASSWORD_BCRYPT_ROUNDS', 12))
+PASSWORD_ARGON2_TIME_COST = int(getenv('PASSWORD_ARGON2_TIME_COST', 3))
+PASSWORD_ARGON2_MEMORY_COST = int(getenv('PASSWORD_ARGON2_MEMORY_COST', 65536))
+PASSWORD_ARGON2_PARALLELISM = int(getenv('PASSWORD_ARGON2_PARALLELISM', 4))
 
-load_dotenv()
 DB_USER = os.getenv('DB_USER')
 DB_PASS = os.getenv('DB_PASS')
 DB_HOST = os.getenv('DB_HOST')
@@ -16,6 +38,74 @@ ENVIRONMENT = os.getenv('ENVIRONMENT')
 
 SHOW_DOCS_ENVIRONMENT = ('dev',)
 
+# Connection pool variables
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', -1))
+DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', 'True') == 'True'
+# DB_HOST points to PgBouncer in transaction mode, prepared statements don't outlive a
+# transaction. LISTEN needs a session, the cache invalidation listener connects to
+# DB_DIRECT_HOST:DB_DIRECT_PORT, the database server itself.
+DB_PGBOUNCER = getenv('DB_PGBOUNCER', 'False') == 'True'
+DB_DIRECT_HOST = getenv('DB_DIRECT_HOST', DB_HOST)
+DB_DIRECT_PORT = getenv('DB_DIRECT_PORT', DB_PORT)
+DB_POOL_LOG_INTERVAL = int(getenv('DB_POOL_LOG_INTERVAL', 0))
+EXPOSE_INTERNAL_METRICS = getenv('EXPOSE_INTERNAL_METRICS', 'False') == 'True'
+
+# Read replica variables, replica is used only if DB_REPLICA_HOST is set
+DB_REPLICA_HOST = getenv('DB_REPLICA_HOST')
+DB_REPLICA_PORT = getenv('DB_REPLICA_PORT', DB_PORT)
+DB_REPLICA_NAME = getenv('DB_REPLICA_NAME', DB_NAME)
+READ_YOUR_WRITES_SECONDS = int(getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+# Pagination variables
+COUNT_CACHE_TTL = int(getenv('COUNT_CACHE_TTL', 30))
+COUNT_CACHE_MAX_ENTRIES = int(getenv('COUNT_CACHE_MAX_ENTRIES', 1024))
+
+# Read cache variables
+CACHE_BACKEND = getenv('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_MAX_BYTES = int(getenv('CACHE_MAX_BYTES', 16 * 1024 * 1024))
+# Broadcast invalidations to the other workers with Postgres LISTEN/NOTIFY
+CACHE_BUS_ENABLED = getenv('CACHE_BUS_ENABLED', 'True') == 'True'
+FEED_CACHE_TTL = int(getenv('FEED_CACHE_TTL', 60))
+FEED_CACHE_PREWARM_PAGES = int(getenv('FEED_CACHE_PREWARM_PAGES', 0))
+DETAIL_CACHE_TTL = int(getenv('DETAIL_CACHE_TTL', 300))
+CURRENT_USER_CACHE_TTL = int(getenv('CURRENT_USER_CACHE_TTL', 30))
+# Profession index is reloaded on change notifications, the TTL covers CACHE_BUS_ENABLED=False
+PROFESSION_INDEX_TTL = int(getenv('PROFESSION_INDEX_TTL', 3600))
+
+# Upload variables
+UPLOAD_MAX_BYTES = int(getenv('UPLOAD_MAX_BYTES', 5 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(getenv('UPLOAD_CHUNK_SIZE', 64 * 1024))
+# Unreferenced media files are kept for the grace period, then deleted by a background task
+MEDIA_GC_INTERVAL = int(getenv('MEDIA_GC_INTERVAL', 600))
+MEDIA_GC_GRACE_SECONDS = int(getenv('MEDIA_GC_GRACE_SECONDS', 3600))
+MEDIA_GC_BATCH_SIZE = int(getenv('MEDIA_GC_BATCH_SIZE', 100))
+# Storage of uploaded media: local (MEDIA_ROOT) or s3 (any S3-compatible service)
+STORAGE_BACKEND = getenv('STORAGE_BACKEND', 'local')
+S3_BUCKET = getenv('S3_BUCKET')
+S3_ENDPOINT_URL = getenv('S3_ENDPOINT_URL')
+S3_REGION = getenv('S3_REGION')
+S3_ACCESS_KEY_ID = getenv('S3_ACCESS_KEY_ID')
+S3_SECRET_ACCESS_KEY = getenv('S3_SECRET_ACCESS_KEY')
+S3_PUBLIC_URL = getenv('S3_PUBLIC_URL')
+# Seconds a signed direct upload URL stays valid
+DIRECT_UPLOAD_EXPIRES = int(getenv('DIRECT_UPLOAD_EXPIRES', 900))
+# Legacy media paths aren't content-addressed, clients revalidate them after this many seconds
+MEDIA_CACHE_MAX_AGE = int(getenv('MEDIA_CACHE_MAX_AGE', 3600))
+# Internal location of MEDIA_ROOT in the reverse proxy, e.g. /protected-media/. When set, media
+# responses carry X-Accel-Redirect and the proxy sends the file
+MEDIA_ACCEL_REDIRECT_PREFIX = getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+# Thumbnails and WebP/AVIF variants of uploaded images, built by a background task
+IMAGE_VARIANTS_ENABLED = getenv('IMAGE_VARIANTS_ENABLED', 'True') == 'True'
+IMAGE_VARIANT_WORKERS = int(getenv('IMAGE_VARIANT_WORKERS', 1))
+IMAGE_VARIANT_BATCH_SIZE = int(getenv('IMAGE_VARIANT_BATCH_SIZE', 10))
+IMAGE_VARIANT_POLL_INTERVAL = float(getenv('IMAGE_VARIANT_POLL_INTERVAL', 30))
+IMAGE_VARIANT_QUALITY = int(getenv('IMAGE_VARIANT_QUALITY', 80))
+IMAGE_VARIANT_LEASE_SECONDS = int(getenv('IMAGE_VARIANT_LEASE_SECONDS', 300))
+
 # Mail variables
 MAIL_USERNAME = os.getenv('MAIL_USERNAME')
 MAIL_FROM = os.getenv('MAIL_FROM')
@@ -27,3 +117,12 @@ MAIL_SSL_TLS = os.getenv('MAIL_SSL_TLS')
 USE_CREDENTIALS = os.getenv('USE_CREDENTIALS')
 VALIDATE_CERTS = os.getenv('VALIDATE_CERTS')
 SUPPRESS_SEND = os.getenv('SUPPRESS_SEND')
+
+# Mail outbox variables
+MAIL_OUTBOX_ENABLED = getenv('MAIL_OUTBOX_ENABLED', 'True') == 'True'
+MAIL_OUTBOX_BATCH_SIZE = int(getenv('MAIL_OUTBOX_BATCH_SIZE', 50))
+MAIL_OUTBOX_POLL_INTERVAL = float(getenv('MAIL_OUTBOX_POLL_INTERVAL', 5))
+MAIL_OUTBOX_LEASE_SECONDS = int(getenv('MAIL_OUTBOX_LEASE_SECONDS', 300))
+MAIL_MAX_ATTEMPTS = int(getenv('MAIL_MAX_ATTEMPTS', 8))
+MAIL_RETRY_BASE_SECONDS = int(getenv('MAIL_RETRY_BASE_SECONDS', 30))
+MAIL_RETRY_MAX_SECONDS = int(getenv('MAIL_RETRY_MAX_SECONDS', 3600))
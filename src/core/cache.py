@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Hashable
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import CACHE_BACKEND, CACHE_REDIS_URL, CACHE_MAX_BYTES, CACHE_BUS_ENABLED
+from core.settings import CACHE_INVALIDATION_CHANNEL, REPLICA_SESSION
+
+# Key of the session info set of (namespace, key) pairs to invalidate once the transaction commits
+PENDING_INVALIDATIONS = 'pending_cache_invalidations'
+
+# Strong references to running shared invalidations, the event loop keeps only weak ones
+invalidation_tasks: set[asyncio.Task] = set()
+
+# Shared invalidations started by the current request, see CacheInvalidationMiddleware
+request_invalidations: ContextVar[list[asyncio.Task] | None] = ContextVar('request_invalidations',
+                                                                           default=None)
+
+# Namespaces held outside of the cache backend, e.g. preloaded indexes: namespace -> handler
+invalidation_handlers: dict[str, Callable[[str | None], None]] = {}
+
+
+class LRUCache:
+    """In-process LRU cache with TTL, bounded by total size of stored values in bytes
+    (max_bytes, sizes given by sizeof), by number of entries (max_entries) or by both. Without
+    a ttl, entries are kept until evicted unless set passes one.
+
+    Every invalidation bumps the generation. Callers read the generation before loading a value
+    from the database and pass it to set, so a value loaded before a concurrent invalidation
+    isn't stored afterwards.
+    """
+
+    def __init__(self, max_bytes: int | None = None, ttl: float | None = None,
+                 sizeof: Callable[[Any], int] | None = None, max_entries: int | None = None):
+        if max_bytes is None and max_entries is None:
+            raise ValueError("LRUCache needs max_bytes, max_entries or both")
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("LRUCache with max_bytes needs sizeof")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.generation = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # key -> (expires at, size, value)
+        self._entries: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key: Hashable, value: Any, generation: int | None = None,
+            ttl: float | None = None) -> None:
+        size = self.sizeof(value) if self.sizeof else 0
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float('inf')
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self.size += size
+            while (self.max_bytes is not None and self.size > self.max_bytes) \
+                    or (self.max_entries is not None and len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self.generation += 1
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.generation += 1
+            self.invalidations += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class CacheBackend(ABC):
+    """Cache of serialized read models, grouped into namespaces such as "feed" or "guide".
+
+    Values are strings, read paths store JSON of their response schema. Invalidating a key or a
+    whole namespace bumps the namespace generation, see LRUCache.
+    """
+    # True if all workers share the stored values, so one invalidation is enough
+    shared = False
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def generation(self, namespace: str) -> int:
+        ...
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, value: str, generation: int,
+                  ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def invalidate(self, namespace: str, key: str | None = None) -> None:
+        """Invalidate single key, or the whole namespace if key is None"""
+
+    def invalidate_local(self, namespace: str, key: str | None = None) -> None:
+        """Invalidate values held by this process only"""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per process backend, other workers learn about invalidations from the invalidation bus"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.namespaces: dict[str, LRUCache] = {}
+
+    def _namespace(self, namespace: str) -> LRUCache:
+        if namespace not in self.namespaces:
+            # Every set passes its TTL, sizes are of the UTF-8 encoded values
+            self.namespaces[namespace] = LRUCache(max_bytes=self.max_bytes,
+                                                  sizeof=lambda value: len(value.encode()))
+        return self.namespaces[namespace]
+
+    async def get(self, namespace: str, key: str) -> str | None:
+        return self._namespace(namespace).get(key)
+
+    async def generation(self, namespace: str) -> int:
+        return self._namespace(namespace).generation
+
+    async def set(self, namespace: str, key: str, value: str, generation: int,
+                  ttl: int) -> None:
+        self._namespace(namespace).set(key, value, generation=generation, ttl=ttl)
+
+    async def invalidate(self, namespace: str, key: str | None = None) -> None:
+        self.invalidate_local(namespace, key)
+
+    def invalidate_local(self, namespace: str, key: str | None = None) -> None:
+        if key is None:
+            self._namespace(namespace).clear()
+        else:
+            self._namespace(namespace).delete(key)
+
+    def stats(self) -> dict:
+        return {namespace: cache.stats() for namespace, cache in self.namespaces.items()}
+
+
+# Store value only if namespace generation didn't change since the value was loaded
+REDIS_SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1]) or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+redis.call('SADD', KEYS[3], KEYS[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return 1
+"""
+
+# Bump namespace generation and delete the key, or every key of the namespace
+REDIS_INVALIDATE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+if ARGV[1] ~= '' then
+    redis.call('DEL', ARGV[1])
+    redis.call('SREM', KEYS[2], ARGV[1])
+else
+    for _, key in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+        redis.call('DEL', key)
+    end
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+class RedisCacheBackend(CacheBackend):
+    """Backend shared by all workers, works with any server speaking the Redis protocol"""
+    shared = True
+
+    def __init__(self, url: str, prefix: str = 'guidio'):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package, "
+                               "install it with `poetry install -E redis`")
+        self.prefix = prefix
+        self.client = redis.from_url(url, decode_responses=True)
+        self.set_script = self.client.register_script(REDIS_SET_SCRIPT)
+        self.invalidate_script = self.client.register_script(REDIS_INVALIDATE_SCRIPT)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _generation_key(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}:__generation__"
+
+    def _members_key(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}:__members__"
+
+    async def get(self, namespace: str, key: str) -> str | None:
+        value = await self.client.get(self._key(namespace, key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def generation(self, namespace: str) -> int:
+        return int(await self.client.get(self._generation_key(namespace)) or 0)
+
+    async def set(self, namespace: str, key: str, value: str, generation: int,
+                  ttl: int) -> None:
+        await self.set_script(keys=[self._generation_key(namespace),
+                                    self._key(namespace, key),
+                                    self._members_key(namespace)],
+                              args=[generation, value, ttl])
+
+    async def invalidate(self, namespace: str, key: str | None = None) -> None:
+        await self.invalidate_script(keys=[self._generation_key(namespace),
+                                           self._members_key(namespace)],
+                                     args=[self._key(namespace, key) if key else ''])
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_cache_backend() -> CacheBackend:
+    if CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(CACHE_REDIS_URL)
+    return MemoryCacheBackend(CACHE_MAX_BYTES)
+
+
+cache_backend = create_cache_backend()
+
+
+def register_invalidation_handler(namespace: str, handler: Callable[[str | None], None]) -> None:
+    """Route invalidations of the namespace to the handler instead of the cache backend"""
+    invalidation_handlers[namespace] = handler
+
+
+def invalidate_local(namespace: str, key: str | None = None) -> None:
+    handler = invalidation_handlers.get(namespace)
+    if handler:
+        handler(key)
+    else:
+        cache_backend.invalidate_local(namespace, key)
+
+
+def can_fill_cache(db: AsyncSession) -> bool:
+    """Values read from the replica aren't cached. Invalidations are sent when the primary
+    commits, a lagging replica would put the old value back for the rest of its TTL."""
+    return not db.sync_session.info.get(REPLICA_SESSION, False)
+
+
+async def invalidate_on_commit(db: AsyncSession, namespace: str, key: str | int | None = None):
+    """Invalidate cached values once the current transaction commits.
+
+    Notification to the other workers is sent in the same transaction, Postgres delivers it only
+    if the transaction commits.
+    """
+    key = str(key) if key is not None else None
+    db.sync_session.info.setdefault(PENDING_INVALIDATIONS, set()).add((namespace, key))
+    if CACHE_BUS_ENABLED:
+        payload = f"{namespace}:{key}" if key else namespace
+        await db.execute(select(func.pg_notify(CACHE_INVALIDATION_CHANNEL, payload)))
+
+
+def shared_invalidation_done(task: asyncio.Task) -> None:
+    invalidation_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # The stale value stays in the shared cache until its TTL runs out
+        logging.error(f"Shared cache invalidation failed: {str(task.exception())}")
+
+
+async def wait_for_invalidations(tasks: list[asyncio.Task]) -> None:
+    """Wait until the shared invalidations are done, failures are logged by
+    shared_invalidation_done"""
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+@event.listens_for(Session, "after_commit")
+def apply_pending_invalidations(session: Session) -> None:
+    """Invalidate local values right away and start the shared invalidations. A request waits
+    for its shared invalidations before the response is sent, see CacheInvalidationMiddleware."""
+    for namespace, key in session.info.pop(PENDING_INVALIDATIONS, ()):
+        invalidate_local(namespace, key)
+        if cache_backend.shared and namespace not in invalidation_handlers:
+            task = asyncio.get_running_loop().create_task(cache_backend.invalidate(namespace, key))
+            invalidation_tasks.add(task)
+            task.add_done_callback(shared_invalidation_done)
+            pending = request_invalidations.get()
+            if pending is not None:
+                pending.append(task)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_invalidations(session: Session) -> None:
+    session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+def on_invalidation_notification(connection, pid, channel, payload: str) -> None:
+    namespace, _, key = payload.partition(':')
+    invalidate_local(namespace, key or None)
+
+
+async def listen_for_invalidations(dsn: str, retry_interval: int = 5) -> None:
+    """Apply invalidations sent by other workers, meant to run as a background task.
+
+    Needs a direct connection to Postgres (DB_DIRECT_HOST), LISTEN doesn't work through
+    PgBouncer in transaction mode.
+    """
+    import asyncpg
+
+    while True:
+        # Any error reconnects, only cancellation ends the listener
+        try:
+            connection = await asyncpg.connect(dsn)
+            try:
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(CACHE_INVALIDATION_CHANNEL,
+                                              on_invalidation_notification)
+                await closed.wait()
+            finally:
+                await connection.close()
+        except Exception as e:
+            logging.error(f"Cache invalidation listener error: {str(e)}")
+        # Notifications sent while disconnected are lost, start from scratch
+        try:
+            namespaces = list(getattr(cache_backend, 'namespaces', ())) \
+                + list(invalidation_handlers)
+            for namespace in namespaces:
+                invalidate_local(namespace)
+        except Exception as e:
+            logging.error(f"Cache invalidation listener error: {str(e)}")
+        await asyncio.sleep(retry_interval)
@@ -1,8 +1,29 @@
 import os
+from enum import Enum
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Content-addressed uploads, media/store/<sha256[:2]>/<sha256[2:4]>/<sha256>.<extension>
+MEDIA_STORE_ROOT = os.path.join(MEDIA_ROOT, 'store')
+# Uploads in progress, on the same filesystem as the store so they can be renamed into it
+MEDIA_UPLOAD_DIR = os.path.join(MEDIA_STORE_ROOT, 'incoming')
+# Variants of uploaded images: name -> longest side in pixels, originals are never scaled up
+IMAGE_VARIANT_SIZES = {"thumbnail": 160, "medium": 640}
 
 # Email constants
 ACTIVATE_ACCOUNT_SUBJECT = 'Activate your account'
+ACTIVATE_ACCOUNT_TEMPLATE = 'activation_email.html'
 
+
+class MailStatus(str, Enum):
+    pending = "pending"  # waiting for delivery or for the next retry
+    sent = "sent"
+    failed = "failed"  # gave up after MAIL_MAX_ATTEMPTS
+
+
+class CountStrategy(str, Enum):
+    """How paginated endpoints find out the total number of rows"""
+    exact = "exact"  # separate COUNT(*) query
+    window = "window"  # COUNT(*) OVER () in the same round trip as the page
+    cached = "cached"  # exact count cached per filter for COUNT_CACHE_TTL seconds
+    estimated = "estimated"  # planner row estimate, only meant for unfiltered feeds
@@ -1,15 +1,30 @@
-from fastapi import Depends
-from sqlalchemy.orm import Session
+import time
 
-from database import SessionLocal
+from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.settings import READ_PRIMARY_COOKIE
+from database import SessionLocal, ReplicaSessionLocal
 
 
 async def get_db():
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
+        yield db
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Return True if client wrote recently and must read its own writes from the primary"""
+    read_primary_until = request.cookies.get(READ_PRIMARY_COOKIE)
+    if not read_primary_until or not read_primary_until.isdigit():
+        return False
+    return int(read_primary_until) > time.time()
+
+
+async def get_read_db(request: Request):
+    session_factory = SessionLocal if reads_from_primary(request) else ReplicaSessionLocal
+    async with session_factory() as db:
         yield db
-    finally:
-        db.close()
 
 
-DBDependency: Session = Depends(get_db)
+DBDependency: AsyncSession = Depends(get_db)
+ReadDBDependency: AsyncSession = Depends(get_read_db)
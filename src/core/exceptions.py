@@ -5,3 +5,40 @@ def non_existent_page_exception():
     return HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="Requested a non-existent page", )
+
+
+def invalid_cursor_exception():
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid pagination cursor", )
+
+
+def file_too_large_exception(max_bytes: int):
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File is larger than {max_bytes} bytes", )
+
+
+def unsupported_file_type_exception():
+    return HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail="Only JPEG, PNG, GIF and WebP images are accepted", )
+
+
+def range_not_satisfiable_exception(size: int):
+    return HTTPException(
+        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        detail="Requested range not satisfiable",
+        headers={"Content-Range": f"bytes */{size}"}, )
+
+
+def invalid_upload_exception():
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid or expired upload", )
+
+
+def upload_not_found_exception():
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Uploaded file not found, upload it before confirming", )
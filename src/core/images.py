@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from PIL import Image, ImageOps
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from config import IMAGE_VARIANT_WORKERS, IMAGE_VARIANT_BATCH_SIZE, IMAGE_VARIANT_POLL_INTERVAL, \
+    IMAGE_VARIANT_QUALITY, IMAGE_VARIANT_LEASE_SECONDS
+from core.constants import IMAGE_VARIANT_SIZES, MEDIA_UPLOAD_DIR
+from core.media import media_stored
+from core.models import MediaFile
+from core.storage import storage
+
+try:
+    # Registers the AVIF codec with Pillow, install it with `poetry install -E avif`
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Variants are always produced as WebP, as AVIF as well when Pillow can write it
+VARIANT_FORMATS = ("webp", "avif") if ".avif" in Image.registered_extensions() else ("webp",)
+
+# Called in the transaction recording new variants of a media path, e.g. to refresh read models
+variants_listeners: list[Callable[[AsyncSession, str], Awaitable[None]]] = []
+
+
+def register_variants_listener(listener: Callable[[AsyncSession, str], Awaitable[None]]) -> None:
+    variants_listeners.append(listener)
+
+
+def variant_path(path: str, name: str, extension: str) -> str:
+    """media/store/ab/cd/<sha256>.jpg -> media/store/ab/cd/<sha256>_thumbnail.webp"""
+    return f"{os.path.splitext(path)[0]}_{name}.{extension}"
+
+
+# Executed in the pool processes, module level so it can be pickled
+def build_variants(source: str, output_dir: str, sizes: dict[str, int] = IMAGE_VARIANT_SIZES,
+                   formats: tuple[str, ...] = VARIANT_FORMATS,
+                   quality: int = IMAGE_VARIANT_QUALITY) -> dict[str, str]:
+    """Write size-bounded variants of the image file source into output_dir, return
+    {"<size name>.<format>": file name}. Images are only scaled down."""
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info
+                                  or image.mode in ("LA", "PA") else "RGB")
+        for name, size in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for extension in formats:
+                filename = f"{name}.{extension}"
+                resized.save(os.path.join(output_dir, filename), format=extension.upper(),
+                             quality=quality)
+                variants[filename] = filename
+    return variants
+
+
+class ImageVariantPool:
+    """Process pool for image decoding and encoding, keeps CPU heavy resizing off the event loop
+    and out of the request"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor: ProcessPoolExecutor | None = None
+
+    async def start(self) -> None:
+        """Start worker processes up front, before the application opens sockets they would
+        inherit"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.workers)))
+
+    async def run(self, function, *args):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+image_variant_pool = ImageVariantPool(workers=IMAGE_VARIANT_WORKERS)
+
+
+async def store_variants(path: str) -> dict[str, str]:
+    """Build the variants of a stored image in a scratch directory and save them next to it in
+    the storage, return {"<size name>.<format>": media path}"""
+    await run_in_threadpool(os.makedirs, MEDIA_UPLOAD_DIR, exist_ok=True)
+    output_dir = await run_in_threadpool(tempfile.mkdtemp, dir=MEDIA_UPLOAD_DIR,
+                                         prefix="variants-")
+    try:
+        async with storage.local_file(path) as source:
+            files = await image_variant_pool.run(build_variants, source, output_dir)
+        variants = {}
+        try:
+            for variant, filename in files.items():
+                name, extension = variant.split(".")
+                key = variant_path(path, name, extension)
+                await storage.save(key, os.path.join(output_dir, filename), f"image/{extension}")
+                variants[variant] = key
+        except BaseException:
+            # Variants are only deleted together with a recorded original, don't leave any behind
+            for key in variants.values():
+                await storage.delete(key)
+            raise
+        return variants
+    finally:
+        await run_in_threadpool(shutil.rmtree, output_dir, ignore_errors=True)
+
+
+async def claim_pending_variants(db: AsyncSession, batch_size: int) -> list[str]:
+    """Lease a batch of media files without variants and commit, other workers skip them until
+    the lease runs out. No row stays locked while the images are processed, the lease keeps a
+    file from being lost if this worker dies before recording its variants."""
+    pending = select(MediaFile.path) \
+        .where(MediaFile.variants.is_(None),
+               MediaFile.ref_count > 0,
+               or_(MediaFile.variants_claimed_until.is_(None),
+                   MediaFile.variants_claimed_until <= func.now())) \
+        .order_by(MediaFile.created_at) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True)
+    claimed = await db.execute(update(MediaFile)
+                               .where(MediaFile.path.in_(pending.scalar_subquery()))
+                               .values(variants_claimed_until=func.now()
+                                       + timedelta(seconds=IMAGE_VARIANT_LEASE_SECONDS))
+                               .returning(MediaFile.path)
+                               .execution_options(synchronize_session=False))
+    paths = claimed.scalars().all()
+    await db.commit()
+    return paths
+
+
+async def record_variants(db: AsyncSession, path: str, variants: dict[str, str]) -> bool:
+    """Record built variants and notify the listeners, False if the file was collected in the
+    meantime"""
+    recorded = await db.execute(update(MediaFile)
+                                .where(MediaFile.path == path)
+                                .values(variants=variants, variants_claimed_until=None)
+                                .returning(MediaFile.path)
+                                .execution_options(synchronize_session=False))
+    if recorded.first() is None:
+        await db.rollback()
+        return False
+    for listener in variants_listeners:
+        await listener(db, path)
+    await db.commit()
+    return True
+
+
+async def build_pending_variants(db: AsyncSession,
+                                 batch_size: int = IMAGE_VARIANT_BATCH_SIZE) -> int:
+    """Build variants of one batch of media files which don't have them yet, return the number
+    of processed files. Files that can't be decoded get no variants, clients fall back to the
+    original. Variants of each file are recorded in a transaction of their own."""
+    paths = await claim_pending_variants(db, batch_size)
+    for path in paths:
+        try:
+            variants = await store_variants(path)
+        except Exception as e:
+            logging.error(f"Error building variants of {path}: {str(e)}")
+            variants = {}
+        if not await record_variants(db, path, variants):
+            # Collected while the variants were built, nothing would delete them later
+            for key in variants.values():
+                await storage.delete(key)
+    return len(paths)
+
+
+async def build_variants_continuously(session_factory,
+                                      poll_interval: float = IMAGE_VARIANT_POLL_INTERVAL) -> None:
+    """Build variants until cancelled, meant to run as a background task. Uploads committed by
+    this process are picked up immediately, the poll interval covers other processes."""
+    while True:
+        media_stored.clear()
+        try:
+            async with session_factory() as db:
+                while await build_pending_variants(db) == IMAGE_VARIANT_BATCH_SIZE:
+                    pass
+        except Exception as e:
+            logging.error(f"Image variant worker error: {str(e)}")
+        try:
+            await asyncio.wait_for(media_stored.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from typing import AsyncIterator
+
+from fastapi import UploadFile
+from jose import jwt, JOSEError
+from sqlalchemy import update, delete, select, func, event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import MEDIA_GC_INTERVAL, MEDIA_GC_GRACE_SECONDS, MEDIA_GC_BATCH_SIZE, SECRET_KEY, \
+    ALGORITHM, UPLOAD_MAX_BYTES, DIRECT_UPLOAD_EXPIRES
+from core.constants import MEDIA_STORE_ROOT, MEDIA_UPLOAD_DIR
+from core.exceptions import file_too_large_exception, unsupported_file_type_exception, \
+    invalid_upload_exception, upload_not_found_exception
+from core.models import MediaFile
+from core.schemas import DirectUploadCreateSchema, DirectUploadSchema
+from core.storage import storage
+from core.uploads import receive_upload, receive_stream, discard_upload, media_path, \
+    sniff_image_type, IMAGE_CONTENT_TYPES, SNIFF_BYTES
+
+# Key of the session info flag set when a transaction stores media files
+MEDIA_STORED = 'media_stored'
+
+# Claim telling upload tokens apart from access tokens signed with the same key
+UPLOAD_TOKEN_TYPE = 'media-upload'
+CONTENT_TYPE_EXTENSIONS = {content_type: extension
+                           for extension, content_type in IMAGE_CONTENT_TYPES.items()}
+
+# Wakes the variant worker of this process up once stored media files are committed
+media_stored = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def wake_up_variant_worker(session: Session) -> None:
+    if session.info.pop(MEDIA_STORED, False):
+        media_stored.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_stored(session: Session) -> None:
+    session.info.pop(MEDIA_STORED, None)
+
+
+def store_key(sha256: str, extension: str) -> str:
+    """Sharded key of a file in the store, two directory levels keep directories small"""
+    return media_path(os.path.join(MEDIA_STORE_ROOT, sha256[:2], sha256[2:4],
+                                   f"{sha256}.{extension}"))
+
+
+async def reference_media(db: AsyncSession, key: str, sha256: str, content_type: str,
+                          size: int) -> int:
+    """Take a reference to a stored file in the caller's transaction, return the new reference
+    count. The media_file row stays locked until commit, so collect_unreferenced_media can't
+    delete the file in the meantime."""
+    statement = insert(MediaFile).values(path=key,
+                                         sha256=sha256,
+                                         content_type=content_type,
+                                         size=size,
+                                         ref_count=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[MediaFile.path],
+        set_={"ref_count": MediaFile.ref_count + 1, "released_at": None})
+    return await db.scalar(statement.returning(MediaFile.ref_count))
+
+
+async def store_upload(db: AsyncSession, file: UploadFile) -> str:
+    """Save an uploaded image to the content-addressed store and take a reference to it in the
+    caller's transaction. Return the media path to store in the referencing column.
+
+    The file is handed to the storage backend only after the row is locked. Content referenced
+    before is already in the storage and isn't sent again.
+    """
+    upload = await receive_upload(file, MEDIA_UPLOAD_DIR)
+    key = store_key(upload.sha256, upload.extension)
+    try:
+        ref_count = await reference_media(db, key, upload.sha256, upload.content_type,
+                                          upload.size)
+        if ref_count > 1 and await storage.size(key) == upload.size:
+            await discard_upload(upload)
+        else:
+            await storage.save(key, upload.temp_path, upload.content_type)
+        db.sync_session.info[MEDIA_STORED] = True
+    except BaseException:
+        await discard_upload(upload)
+        raise
+    return key
+
+
+def sign_upload_token(payload: dict) -> str:
+    claims = {**payload, "typ": UPLOAD_TOKEN_TYPE, "exp": int(time.time()) + DIRECT_UPLOAD_EXPIRES}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def read_upload_token(token: str) -> dict:
+    """Claims of a valid upload token: upload key, sha256, content type, size and user id"""
+    try:
+        payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
+    except JOSEError:
+        raise invalid_upload_exception()
+    if payload.get("typ") != UPLOAD_TOKEN_TYPE \
+            or payload.get("content_type") not in CONTENT_TYPE_EXTENSIONS:
+        raise invalid_upload_exception()
+    return payload
+
+
+async def create_direct_upload(db: AsyncSession, data: DirectUploadCreateSchema,
+                               user_id: int) -> DirectUploadSchema:
+    """Signed request the client uploads the file with straight to the storage, and the token it
+    confirms the upload with. Nothing is uploaded when the storage already has the content."""
+    if data.content_type not in CONTENT_TYPE_EXTENSIONS:
+        raise unsupported_file_type_exception()
+    if data.size > UPLOAD_MAX_BYTES:
+        raise file_too_large_exception(UPLOAD_MAX_BYTES)
+    key = store_key(data.sha256, CONTENT_TYPE_EXTENSIONS[data.content_type])
+    # Unreferenced files may be collected before the token is confirmed
+    referenced = await db.scalar(select(MediaFile.ref_count > 0).where(MediaFile.path == key))
+    upload_key = media_path(os.path.join(MEDIA_UPLOAD_DIR, uuid.uuid4().hex))
+    token = sign_upload_token({"upload_key": upload_key,
+                               "sha256": data.sha256,
+                               "content_type": data.content_type,
+                               "size": data.size,
+                               "user_id": user_id})
+    if referenced:
+        return DirectUploadSchema(upload_token=token, upload_required=False,
+                                  expires_in=DIRECT_UPLOAD_EXPIRES)
+    return DirectUploadSchema(upload_token=token, upload_required=True,
+                              expires_in=DIRECT_UPLOAD_EXPIRES,
+                              **storage.create_upload(upload_key, data.content_type, data.size,
+                                                      data.sha256, token))
+
+
+async def receive_direct_upload(token: str, chunks: AsyncIterator[bytes]) -> None:
+    """Signed upload endpoint of storages without one of their own (LocalStorage). The body has
+    to match what the token was issued for."""
+    upload = read_upload_token(token)
+    received = await receive_stream(chunks, MEDIA_UPLOAD_DIR,
+                                    max_bytes=min(upload["size"], UPLOAD_MAX_BYTES))
+    if received.sha256 != upload["sha256"] or received.size != upload["size"] \
+            or received.content_type != upload["content_type"]:
+        await discard_upload(received)
+        raise invalid_upload_exception()
+    await storage.save(upload["upload_key"], received.temp_path, received.content_type)
+
+
+async def confirm_direct_upload(db: AsyncSession, token: str, user_id: int) -> str:
+    """Move a direct upload into the content-addressed store and take a reference to it in the
+    caller's transaction, return the media path. The uploaded bytes are checked against the
+    token, the client's word isn't trusted."""
+    upload = read_upload_token(token)
+    if upload.get("user_id") != user_id:
+        raise invalid_upload_exception()
+    content_type = upload["content_type"]
+    key = store_key(upload["sha256"], CONTENT_TYPE_EXTENSIONS[content_type])
+    await reference_media(db, key, upload["sha256"], content_type, upload["size"])
+    upload_key = upload["upload_key"]
+    size = await storage.size(upload_key)
+    if size is None:
+        # Nothing uploaded, fine only if the content was stored already
+        if await storage.size(key) is None:
+            raise upload_not_found_exception()
+        return key
+    try:
+        if size != upload["size"]:
+            raise invalid_upload_exception()
+        head = await storage.read_head(upload_key, SNIFF_BYTES)
+        if IMAGE_CONTENT_TYPES.get(sniff_image_type(head)) != content_type:
+            raise unsupported_file_type_exception()
+        # Uploads without a checksum kept by the storage are rejected as well
+        if await storage.sha256(upload_key) != upload["sha256"]:
+            raise invalid_upload_exception()
+    except BaseException:
+        await storage.delete(upload_key)
+        raise
+    await storage.move(upload_key, key, content_type)
+    db.sync_session.info[MEDIA_STORED] = True
+    return key
+
+
+async def release_media(db: AsyncSession, *paths: str | None) -> None:
+    """Drop references to media files in the caller's transaction. Files aren't deleted here,
+    a rolled back transaction would otherwise leave rows pointing to missing files."""
+    for path, count in Counter(path for path in paths if path).items():
+        await db.execute(update(MediaFile)
+                         .where(MediaFile.path == path)
+                         .values(ref_count=func.greatest(MediaFile.ref_count - count, 0),
+                                 released_at=func.now())
+                         .execution_options(synchronize_session=False))
+
+
+async def collect_unreferenced_media(db: AsyncSession, batch_size: int = MEDIA_GC_BATCH_SIZE,
+                                     grace_seconds: int = MEDIA_GC_GRACE_SECONDS) -> int:
+    """Delete one batch of files unreferenced for longer than the grace period, return the
+    number of deleted files. Variants go together with the original. Rows are locked until the
+    files are gone, so a concurrent upload of the same content waits and then stores the file
+    again."""
+    unreferenced = select(MediaFile.path) \
+        .where(MediaFile.ref_count == 0,
+               MediaFile.released_at < func.now() - timedelta(seconds=grace_seconds)) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True)
+    deleted = await db.execute(delete(MediaFile)
+                               .where(MediaFile.path.in_(unreferenced.scalar_subquery()))
+                               .returning(MediaFile.path, MediaFile.variants)
+                               .execution_options(synchronize_session=False))
+    files = deleted.all()
+    for path, variants in files:
+        for variant in (variants or {}).values():
+            await storage.delete(variant)
+        await storage.delete(path)
+    await db.commit()
+    return len(files)
+
+
+async def collect_media_garbage(session_factory, interval: int = MEDIA_GC_INTERVAL) -> None:
+    """Remove unreferenced media files until cancelled, meant to run as a background task.
+    Every worker may run it, workers skip each other's rows."""
+    while True:
+        try:
+            async with session_factory() as db:
+                while await collect_unreferenced_media(db) == MEDIA_GC_BATCH_SIZE:
+                    pass
+        except Exception as e:
+            logging.error(f"Media garbage collection error: {str(e)}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import stat
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+
+from auth.schemas import CurrentUserSchema
+from auth.service import CurrentUserSnapshot
+from config import MEDIA_CACHE_MAX_AGE, MEDIA_ACCEL_REDIRECT_PREFIX
+from core.conditional import make_etag, is_not_modified
+from core.constants import MEDIA_ROOT, MEDIA_STORE_ROOT, MEDIA_UPLOAD_DIR
+from core.dependencies import DBDependency
+from core.exceptions import range_not_satisfiable_exception
+from core.media import create_direct_upload, receive_direct_upload
+from core.responses import MediaFileResponse
+from core.schemas import DirectUploadCreateSchema, DirectUploadSchema
+from core.uploads import media_path
+from core.storage import storage, IMMUTABLE_CACHE_CONTROL, STORE_PREFIX
+
+router = APIRouter()
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+MEDIA_ROOT_REAL = os.path.realpath(MEDIA_ROOT)
+MEDIA_STORE_REAL = os.path.realpath(MEDIA_STORE_ROOT)
+MEDIA_UPLOAD_REAL = os.path.realpath(MEDIA_UPLOAD_DIR)
+INCOMING_PREFIX = media_path(MEDIA_UPLOAD_DIR) + "/"
+
+MEDIA_CACHE_CONTROL = f"public, max-age={MEDIA_CACHE_MAX_AGE}"
+
+# Smaller encodings of the same image variant stored next to it, e.g. <sha256>_medium.avif for
+# <sha256>_medium.webp: extension -> (media type, extension), preferred first. Served to clients
+# listing the media type in Accept.
+VARIANT_ALTERNATIVES = {".webp": (("image/avif", ".avif"),)}
+
+
+def resolve_media_file(path: str) -> tuple[str, os.stat_result] | None:
+    """Absolute path and stat of a regular file under MEDIA_ROOT, uploads in progress and
+    anything outside of MEDIA_ROOT are not served"""
+    full_path = os.path.realpath(os.path.join(MEDIA_ROOT_REAL, path))
+    if not full_path.startswith(MEDIA_ROOT_REAL + os.sep) \
+            or full_path.startswith(MEDIA_UPLOAD_REAL + os.sep):
+        return None
+    try:
+        stat_result = os.stat(full_path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    return full_path, stat_result
+
+
+def find_alternative(full_path: str,
+                     accepted: set[str]) -> tuple[str, str, os.stat_result] | None:
+    root, extension = os.path.splitext(full_path)
+    for media_type, alternative_extension in VARIANT_ALTERNATIVES.get(extension, ()):
+        if media_type in accepted:
+            try:
+                stat_result = os.stat(root + alternative_extension)
+            except OSError:
+                continue
+            return media_type, root + alternative_extension, stat_result
+    return None
+
+
+def accepted_media_types(request: Request) -> set[str]:
+    """Media types listed in Accept, wildcards aren't expanded"""
+    accepted = set()
+    for item in request.headers.get("accept", "").split(","):
+        media_type, *params = item.split(";")
+        quality = next((param.strip()[2:] for param in params if param.strip().startswith("q=")),
+                       "1")
+        try:
+            if float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(media_type.strip().lower())
+    return accepted
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """First and last byte of a single range request. Malformed and multi-range headers return
+    None and the whole file is served, ranges outside of the file raise 416."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise range_not_satisfiable_exception(size)
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0:
+        return None
+    # Before the end check, an open range starting past the last byte would end before its start
+    if start >= size:
+        raise range_not_satisfiable_exception(size)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    """Range applies only if the client's copy is current, otherwise the whole file is sent"""
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+@router.post(path="/uploads",
+             description="Create a signed upload, send the file with the returned method, url "
+                         "and headers, then confirm the upload token at the endpoint of the "
+                         "image. Nothing has to be sent when uploadRequired is false.",
+             response_model=DirectUploadSchema,
+             status_code=status.HTTP_201_CREATED)
+async def create_upload(data: DirectUploadCreateSchema,
+                        db=DBDependency,
+                        user: CurrentUserSchema = CurrentUserSnapshot):
+    return await create_direct_upload(db, data, user.user_id)
+
+
+@router.put(path="/uploads/{token}",
+            description="Signed upload URL of the local storage",
+            include_in_schema=False,
+            status_code=status.HTTP_204_NO_CONTENT)
+async def put_upload(token: str, request: Request):
+    if storage.remote:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    await receive_direct_upload(token, request.stream())
+
+
+@router.api_route(path="/{path:path}",
+                  methods=["GET", "HEAD"],
+                  description="Get uploaded media file",
+                  include_in_schema=False,
+                  status_code=status.HTTP_200_OK)
+async def get_media_file(path: str, request: Request):
+    if storage.remote:
+        key = f"media/{path}"
+        if key.startswith(INCOMING_PREFIX) or ".." in key.split("/"):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+        if key.startswith(STORE_PREFIX):
+            # Stored keys never change, the redirect can be cached as long as the file
+            return RedirectResponse(storage.url(key),
+                                    status_code=status.HTTP_301_MOVED_PERMANENTLY,
+                                    headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+        return RedirectResponse(storage.url(key), status_code=status.HTTP_302_FOUND)
+    resolved = await run_in_threadpool(resolve_media_file, path)
+    if resolved is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    full_path, stat_result = resolved
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    stored = full_path.startswith(MEDIA_STORE_REAL + os.sep)
+    headers = {"Accept-Ranges": "bytes",
+               "Cache-Control": IMMUTABLE_CACHE_CONTROL if stored else MEDIA_CACHE_CONTROL}
+
+    if stored and os.path.splitext(full_path)[1] in VARIANT_ALTERNATIVES:
+        headers["Vary"] = "Accept"
+        alternative = await run_in_threadpool(find_alternative, full_path,
+                                              accepted_media_types(request))
+        if alternative is not None:
+            media_type, full_path, stat_result = alternative
+
+    if MEDIA_ACCEL_REDIRECT_PREFIX:
+        # The proxy sends the file with sendfile and handles Range and conditional requests on
+        # its own
+        relative_path = os.path.relpath(full_path, MEDIA_ROOT_REAL)
+        headers["X-Accel-Redirect"] = MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" \
+            + quote(relative_path)
+        return Response(headers=headers, media_type=media_type)
+
+    last_modified = datetime.fromtimestamp(stat_result.st_mtime, timezone.utc)
+    etag = make_etag(path, media_type, stat_result.st_size, stat_result.st_mtime_ns)
+    headers["ETag"] = etag
+    headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = stat_result.st_size
+    range_header = request.headers.get("range")
+    byte_range = None
+    if range_header and if_range_matches(request, etag, headers["Last-Modified"]):
+        byte_range = parse_byte_range(range_header, size)
+    if byte_range is None:
+        return MediaFileResponse(full_path, size, headers=headers, media_type=media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return MediaFileResponse(full_path, size, offset=start, count=end - start + 1,
+                             status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers,
+                             media_type=media_type)
@@ -0,0 +1,70 @@
+import time
+
+from fastapi import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from config import READ_YOUR_WRITES_SECONDS
+from core.cache import request_invalidations, wait_for_invalidations
+from core.settings import READ_PRIMARY_COOKIE
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReadYourWritesMiddleware:
+    """Pin client to the primary database for a short window after a successful write, so
+    replica lag doesn't hide changes the client has just made.
+
+    Plain ASGI middleware, response messages pass through untouched apart from the cookie header,
+    so streamed and zero-copy media responses keep working.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                read_primary_until = int(time.time()) + READ_YOUR_WRITES_SECONDS
+                cookie = Response()
+                cookie.set_cookie(key=READ_PRIMARY_COOKIE,
+                                  value=str(read_primary_until),
+                                  max_age=READ_YOUR_WRITES_SECONDS,
+                                  httponly=True)
+                MutableHeaders(scope=message).append("set-cookie", cookie.headers["set-cookie"])
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class CacheInvalidationMiddleware:
+    """Hold the response until the shared cache invalidations of the request's commits are done,
+    so the client's next request doesn't read the value it has just changed from the cache.
+
+    Plain ASGI middleware for the same reason as ReadYourWritesMiddleware.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        tasks = []
+
+        async def send_after_invalidations(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                await wait_for_invalidations(tasks)
+            await send(message)
+
+        token = request_invalidations.set(tasks)
+        try:
+            await self.app(scope, receive, send_after_invalidations)
+        finally:
+            request_invalidations.reset(token)
@@ -1,14 +1,20 @@
-from datetime import datetime
 from typing import Any, Dict
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, Text, ForeignKey, Index, \
+    Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, deferred, joinedload
 
-from core.constants import ACTIVATE_ACCOUNT_SUBJECT
+from core.constants import MailStatus
 from src.database import Base
 from utils.mail.send_mail import send_mail
 
 
+# Relationships never load lazily, lazy loading would block the event loop or fail outside of
+# the async session. Queries state what they need with the loader options at the end of the module.
+
+
 # CODEBOOKS
 class Profession(Base):
     __tablename__ = "profession"
@@ -16,7 +22,40 @@ class Profession(Base):
     profession_id = Column(Integer, primary_key=True)
     name = Column(String(100), unique=True, nullable=False)
 
-    user_details = relationship("UserDetail", back_populates="profession")
+    user_details = relationship("UserDetail", back_populates="profession", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index('ix_profession_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
+
+
+# MEDIA
+class MediaFile(Base):
+    """Uploaded file stored once per content and shared by every row referencing it. ref_count
+    is maintained by core.media, unreferenced files are removed by collect_unreferenced_media."""
+    __tablename__ = "media_file"
+
+    # Media path, also the public URL under /media
+    path = Column(String(255), primary_key=True)
+    # NULL for files uploaded before the content-addressed store
+    sha256 = Column(String(64), unique=True, nullable=True)
+    content_type = Column(String(50), nullable=True)
+    size = Column(Integer, nullable=True)
+    ref_count = Column(Integer, default=0, nullable=False)
+    # Variant name (thumbnail.webp) -> media path, NULL until built by core.images
+    variants = Column(JSONB(none_as_null=True), nullable=True)
+    # Lease of the variant worker building the variants, see core.images.claim_pending_variants
+    variants_claimed_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    released_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_media_file_unreferenced_released_at', 'released_at',
+              postgresql_where=ref_count == 0),
+        Index('ix_media_file_pending_variants_created_at', 'created_at',
+              postgresql_where=variants.is_(None)),
+    )
 
 
 # USERS
@@ -30,33 +69,40 @@ class User(Base):
     password = Column(String, nullable=False)
     is_active = Column(Boolean, default=False, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Version of the whole profile including user_details, bumped by users.service on changes
+    # of the details as well, used as HTTP validator
+    last_modified = Column(DateTime(timezone=True), server_default=func.now(),
+                           onupdate=func.current_timestamp(), nullable=False)
 
     user_details = relationship("UserDetail",
                                 back_populates="user",
                                 uselist=False,
                                 cascade="all, delete",
-                                passive_deletes=True)
+                                passive_deletes=True,
+                                lazy="raise_on_sql")
     guides = relationship("Guide",
                           back_populates="user",
                           cascade="all, delete",
-                          passive_deletes=True)
+                          passive_deletes=True,
+                          lazy="raise_on_sql")
 
     def __str__(self):
+        return self.full_name
+
+    @hybrid_property
+    def full_name(self) -> str:
         return f'{self.first_name} {self.last_name}'
 
+    @full_name.expression
+    def full_name(cls):
+        # Same expression as the ix_user_full_name_trgm index, keep them in sync
+        return cls.first_name + ' ' + cls.last_name
+
     async def email_user(self, subject: str, body: Dict[str, Any], template_name: str):
         """Send email to this user."""
         await send_mail(subject=subject, recipients=[self.email], body=body,
                         template_name=template_name)
 
-    async def send_activation_email(self, verification_url: str, expiration_time: datetime):
-        """Send account activation email to this user."""
-        await send_mail(subject=ACTIVATE_ACCOUNT_SUBJECT,
-                        recipients=[self.email],
-                        body={"first_name": self.first_name, "url": verification_url,
-                              "expire_at": expiration_time.strftime("%Y-%m-%d %H:%M:%S")},
-                        template_name="activation_email.html")
-
 
 class UserDetail(Base):
     __tablename__ = "user_detail"
@@ -82,12 +128,17 @@ class UserDetail(Base):
     github = Column(String(255))
     website = Column(String(255))
     is_instructor = Column(Boolean, default=False, nullable=False)
-    avatar = Column(String(255), nullable=True)
-    cover_image = Column(String(255), nullable=True)
+    avatar = Column(String(255), ForeignKey('media_file.path'), nullable=True)
+    cover_image = Column(String(255), ForeignKey('media_file.path'), nullable=True)
 
     user_id = Column(Integer, ForeignKey('user.user_id', ondelete="CASCADE"), unique=True)
-    user = relationship("User", back_populates="user_details")
-    profession = relationship("Profession", back_populates="user_details")
+    user = relationship("User", back_populates="user_details", lazy="raise_on_sql")
+    profession = relationship("Profession", back_populates="user_details", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index('ix_user_detail_instructor_user_id', 'user_id',
+              postgresql_where=is_instructor),
+    )
 
 
 # GUIDES
@@ -102,11 +153,91 @@ class Guide(Base):
                            onupdate=func.current_timestamp(), nullable=False)
     published = Column(Boolean, default=False, nullable=False)
     note = Column(String(255), nullable=True)
-    cover_image = Column(String(255), nullable=True)
+    cover_image = Column(String(255), ForeignKey('media_file.path'), nullable=True)
+    # Maintained by the database, weighted title > note > content
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(note, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(content, '')), 'C')",
+        persisted=True)))
 
     user_id = Column(Integer, ForeignKey("user.user_id", ondelete="CASCADE"))
 
-    user = relationship("User", back_populates="guides")
+    user = relationship("User", back_populates="guides", lazy="raise_on_sql")
+
+    __table_args__ = (
+        # Published feed ordered by last_modified with guide_id as tiebreaker
+        Index('ix_guide_published_last_modified', 'last_modified', 'guide_id',
+              postgresql_where=published),
+        # Per-author listings
+        Index('ix_guide_user_id_last_modified', 'user_id', 'last_modified', 'guide_id'),
+        Index('ix_guide_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     def __str__(self):
         return self.title
+
+
+class GuideFeed(Base):
+    """Read model of published guides with a snapshot of the author, so feed queries don't join
+    four tables. Rows are rebuilt by guides.service.refresh_guide_feed whenever a guide or its
+    author changes."""
+    __tablename__ = "guide_feed"
+
+    guide_id = Column(Integer, ForeignKey("guide.guide_id", ondelete="CASCADE"), primary_key=True)
+    title = Column(String(70), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    last_modified = Column(DateTime(timezone=True), nullable=False)
+    cover_image = Column(String(255), nullable=True)
+    user_id = Column(Integer, ForeignKey("user.user_id", ondelete="CASCADE"), nullable=False)
+    first_name = Column(String(100), nullable=False)
+    last_name = Column(String(150), nullable=False)
+    avatar = Column(String(255), nullable=True)
+    profession = Column(String(100), nullable=True)
+    cover_image_variants = Column(JSONB, nullable=True)
+    avatar_variants = Column(JSONB, nullable=True)
+
+    __table_args__ = (
+        Index('ix_guide_feed_last_modified', 'last_modified', 'guide_id'),
+        Index('ix_guide_feed_user_id_last_modified', 'user_id', 'last_modified', 'guide_id'),
+    )
+
+
+# MAIL
+class MailOutbox(Base):
+    """Emails waiting for delivery. Rows are written in the transaction of the change which
+    triggered the email and delivered by utils.mail.outbox.deliver_outbox."""
+    __tablename__ = "mail_outbox"
+
+    mail_id = Column(Integer, primary_key=True)
+    recipient = Column(String(120), nullable=False)
+    subject = Column(String(255), nullable=False)
+    template_name = Column(String(100), nullable=False)
+    body = Column(JSONB, nullable=False)
+    # Only one pending email per key, e.g. activation:<user_id>
+    dedup_key = Column(String(255), nullable=True)
+    status = Column(String(20), default=MailStatus.pending.value, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_mail_outbox_pending_next_attempt_at', 'next_attempt_at',
+              postgresql_where=status == MailStatus.pending.value),
+        Index('ix_mail_outbox_pending_dedup_key', 'dedup_key', unique=True,
+              postgresql_where=status == MailStatus.pending.value),
+    )
+
+
+# LOADER OPTIONS
+# User with details and profession, everything UserReadSchema serializes. All relationships are
+# to-one, so they're joined into the same statement without multiplying rows.
+user_profile_options = (
+    joinedload(User.user_details).joinedload(UserDetail.profession),
+)
+# Guide with its author, everything GuideReadSchema serializes
+guide_author_options = (
+    joinedload(Guide.user).joinedload(User.user_details).joinedload(UserDetail.profession),
+)
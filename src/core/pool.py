@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+
+import asyncpg
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+@dataclass
+class PoolWaitStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    invalidations: int = 0
+
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class PgBouncerConnection(asyncpg.Connection):
+    """asyncpg connection naming prepared statements uniquely across processes.
+
+    Behind PgBouncer in transaction mode every transaction may run on another server connection.
+    asyncpg's names come from a per process counter, so other workers reuse the names of
+    statements left on the server connection.
+    """
+
+    def _get_unique_id(self, prefix: str) -> str:
+        return f"__asyncpg_{prefix}_{uuid.uuid4().hex}__"
+
+
+class MonitoredQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool which records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.wait_stats.timeouts += 1
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+    def _invalidate(self, connection, exception=None, _checkin=True):
+        self.wait_stats.invalidations += 1
+        return super()._invalidate(connection, exception, _checkin)
+
+
+def get_pool_status(pool) -> dict:
+    """Return connection pool usage for the current worker process"""
+    status = {
+        "pid": os.getpid(),
+        "pool_class": type(pool).__name__,
+    }
+    stats: PoolWaitStats | None = getattr(pool, 'wait_stats', None)
+    if stats is None:
+        return status
+    status.update({
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "invalidations": stats.invalidations,
+        "avg_wait_ms": round(stats.total_wait / stats.checkouts * 1000, 3)
+        if stats.checkouts else 0.0,
+        "max_wait_ms": round(stats.max_wait * 1000, 3),
+    })
+    return status
+
+
+async def log_pool_status(pool, interval: int) -> None:
+    """Periodically log connection pool usage, meant to run as a background task"""
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"Database pool status: {get_pool_status(pool)}")
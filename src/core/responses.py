@@ -0,0 +1,61 @@
+from fastapi import Response, status
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Scope, Receive, Send
+
+# ASGI extensions which hand the file over to the server, no bytes pass through Python
+ZERO_COPY_SEND = "http.response.zerocopysend"
+PATH_SEND = "http.response.pathsend"
+
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+class MediaFileResponse(Response):
+    """Response with a file or a byte range of it as the body.
+
+    The body is sent with the zero-copy extension of the ASGI server when available (sendfile),
+    whole files with the path send extension, otherwise it is read in chunks in the threadpool.
+    """
+
+    def __init__(self, path: str, size: int, offset: int = 0, count: int | None = None,
+                 status_code: int = status.HTTP_200_OK, headers: dict[str, str] | None = None,
+                 media_type: str | None = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.count = size - offset if count is None else count
+        self.whole_file = offset == 0 and self.count == size
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers})
+        extensions = scope.get("extensions") or {}
+        if scope["method"] == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif ZERO_COPY_SEND in extensions:
+            with await run_in_threadpool(open, self.path, "rb") as file:
+                await send({"type": ZERO_COPY_SEND, "file": file, "offset": self.offset,
+                            "count": self.count, "more_body": False})
+        elif PATH_SEND in extensions and self.whole_file:
+            await send({"type": PATH_SEND, "path": self.path})
+        else:
+            await self.send_chunks(send)
+
+    async def send_chunks(self, send: Send) -> None:
+        file = await run_in_threadpool(open, self.path, "rb")
+        try:
+            await run_in_threadpool(file.seek, self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await run_in_threadpool(file.read, min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank while sending, end the body so the client sees a short response
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await run_in_threadpool(file.close)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, status
+
+from auth.hashing import password_hashing_pool
+from core.cache import cache_backend
+from core.pool import get_pool_status
+from database import engine, replica_engine
+
+router = APIRouter()
+
+
+@router.get(path="/pool",
+            description="Get database connection pool status of the current worker",
+            status_code=status.HTTP_200_OK)
+async def get_database_pool_status():
+    pool_status = {"primary": get_pool_status(engine.pool)}
+    if replica_engine:
+        pool_status["replica"] = get_pool_status(replica_engine.pool)
+    return pool_status
+
+
+@router.get(path="/cache",
+            description="Get read cache statistics of the current worker",
+            status_code=status.HTTP_200_OK)
+async def get_cache_status():
+    return {"backend": type(cache_backend).__name__, "stats": cache_backend.stats()}
+
+
+@router.get(path="/hashing",
+            description="Get password hashing pool statistics of the current worker",
+            status_code=status.HTTP_200_OK)
+async def get_hashing_status():
+    return password_hashing_pool.stats()
@@ -29,3 +29,23 @@ class UserPasswordSchema(BaseModelSchema):
 class EmailSchema(BaseModelSchema):
     email: list[EmailStr]
     body: Dict[str, Any]
+
+
+class DirectUploadCreateSchema(BaseModelSchema):
+    content_type: str
+    size: int = Field(gt=0)
+    sha256: str = Field(pattern='^[0-9a-f]{64}$', description="Hex SHA-256 of the file")
+
+
+class DirectUploadSchema(BaseModelSchema):
+    upload_token: str
+    # False when the storage already has the content, the token can be confirmed right away
+    upload_required: bool
+    method: str | None = None
+    url: str | None = None
+    headers: Dict[str, str] | None = None
+    expires_in: int
+
+
+class DirectUploadConfirmSchema(BaseModelSchema):
+    upload_token: str
@@ -1,6 +1,22 @@
+import base64
+import binascii
+import json
 import os
+from datetime import datetime
+from typing import Any
 
-from core.constants import MEDIA_ROOT
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from config import COUNT_CACHE_TTL, COUNT_CACHE_MAX_ENTRIES
+from core.cache import LRUCache, cache_backend, can_fill_cache
+from core.constants import MEDIA_ROOT, CountStrategy
+from core.exceptions import invalid_cursor_exception
+
+# (cache namespace, namespace generation, statement) -> exact count
+count_cache = LRUCache(max_entries=COUNT_CACHE_MAX_ENTRIES, ttl=COUNT_CACHE_TTL)
 
 
 def create_media_root():
@@ -12,3 +28,97 @@ async def count_number_of_pages(num_of_objects: int, page_size: int):
     division: tuple[int, int] = divmod(num_of_objects, page_size)
     pages: int = division[0] + 1 if division[1] else division[0]
     return pages
+
+
+async def count_exact(db: AsyncSession, statement: Select) -> int:
+    return await db.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+
+
+def get_count_cache_key(statement: Select) -> str:
+    compiled = statement.order_by(None).compile()
+    return f"{compiled}|{sorted(compiled.params.items())}"
+
+
+async def count_cached(db: AsyncSession, statement: Select, namespace: str | None = None) -> int:
+    """Exact count kept for COUNT_CACHE_TTL seconds. With a cache namespace, the count is
+    recounted as soon as the namespace is invalidated, e.g. the feed namespace on every change
+    of guide_feed, and isn't stored when read from the replica, see can_fill_cache."""
+    # Read before counting, a count started before an invalidation is stored under the old
+    # generation. Counts of old generations aren't read again and age out of the cache.
+    generation = await cache_backend.generation(namespace) if namespace else None
+    key = (namespace, generation, get_count_cache_key(statement))
+    count = count_cache.get(key)
+    if count is not None:
+        return count
+    cache_generation = count_cache.generation
+    count = await count_exact(db, statement)
+    if namespace is None or can_fill_cache(db):
+        count_cache.set(key, count, generation=cache_generation)
+    return count
+
+
+async def count_estimated(db: AsyncSession, statement: Select) -> int:
+    """Return planner row estimate of the statement, falls back to exact count if the statement
+    can't be rendered with literal values"""
+    try:
+        sql = statement.order_by(None).compile(dialect=db.bind.dialect,
+                                               compile_kwargs={"literal_binds": True})
+    except (CompileError, NotImplementedError):
+        return await count_exact(db, statement)
+    plan = await db.scalar(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def fetch_page(db: AsyncSession,
+                     statement: Select,
+                     offset: int,
+                     limit: int,
+                     count_strategy: CountStrategy = CountStrategy.exact,
+                     count_namespace: str | None = None) -> tuple[list[Any], int]:
+    """Fetch page of rows from the ordered statement together with the total number of rows,
+    which is obtained using the requested count strategy
+
+    Args:
+        db (AsyncSession): database session
+        statement (Select): ordered select statement
+        offset (int): number of rows to skip
+        limit (int): page size
+        count_strategy (CountStrategy): how to count total number of rows
+        count_namespace (str | None): cache namespace whose invalidation drops the cached count
+
+    Returns:
+        tuple of rows on the page and total number of rows
+    """
+    if count_strategy == CountStrategy.window:
+        rows = (await db.execute(statement.add_columns(func.count().over())
+                                 .offset(offset).limit(limit))).all()
+        if not rows:
+            # Window count is not available past the last page
+            return [], await count_exact(db, statement)
+        return [row[:-1] for row in rows], rows[0][-1]
+
+    if count_strategy == CountStrategy.cached:
+        count = await count_cached(db, statement, count_namespace)
+    elif count_strategy == CountStrategy.estimated:
+        count = await count_estimated(db, statement)
+    else:
+        count = await count_exact(db, statement)
+    rows = (await db.execute(statement.offset(offset).limit(limit))).all()
+    return rows, count
+
+
+def encode_cursor(last_modified: datetime, object_id: int) -> str:
+    """Encode position of the last returned row into an opaque cursor"""
+    raw = json.dumps([last_modified.isoformat(), object_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('utf-8')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode cursor created by encode_cursor, raise HTTPException 400 if it's malformed"""
+    try:
+        last_modified, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        return datetime.fromisoformat(last_modified), int(object_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise invalid_cursor_exception()
@@ -2,6 +2,14 @@
 # TOKENS
 AUTH_TOKEN = "auth_token"
 
+# DATABASE ROUTING
+READ_PRIMARY_COOKIE = "read_primary_until"
+# Session info key marking sessions of the read replica
+REPLICA_SESSION = "replica"
+
+# CACHE
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
 
 # MAIL
 DEFAULT_FROM_EMAIL = "webmaster@localhost.com"
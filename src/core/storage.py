@@ -0,0 +1,264 @@
+import base64
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from starlette.concurrency import run_in_threadpool
+
+from config import STORAGE_BACKEND, S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, \
+    S3_SECRET_ACCESS_KEY, S3_PUBLIC_URL, DIRECT_UPLOAD_EXPIRES
+from core.constants import BASE_DIR, MEDIA_UPLOAD_DIR
+
+# Content-addressed keys never change, caches may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STORE_PREFIX = "media/store/"
+
+
+def cache_control_for(key: str) -> str | None:
+    return IMMUTABLE_CACHE_CONTROL if key.startswith(STORE_PREFIX) else None
+
+
+class StorageBackend(ABC):
+    """Where media files live. Keys are media paths (media/store/ab/cd/<sha256>.jpg), the values
+    stored in the database and requested by clients under /media.
+
+    Local files handed to save are consumed, they have to be in MEDIA_UPLOAD_DIR.
+    """
+    # Files aren't on the local disk, /media redirects to url(key)
+    remote = False
+
+    @abstractmethod
+    async def save(self, key: str, source: str, content_type: str) -> None:
+        ...
+
+    @abstractmethod
+    async def move(self, source_key: str, key: str, content_type: str) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Delete the file, missing files are ignored"""
+
+    @abstractmethod
+    async def size(self, key: str) -> int | None:
+        """Size of the file in bytes, None if it doesn't exist"""
+
+    @abstractmethod
+    async def read_head(self, key: str, length: int) -> bytes:
+        ...
+
+    @abstractmethod
+    async def sha256(self, key: str) -> str | None:
+        """Hex SHA-256 of the file, None if the storage has no checksum of it"""
+
+    @abstractmethod
+    def local_file(self, key: str):
+        """Async context manager yielding a local path with the content of the file"""
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        ...
+
+    @abstractmethod
+    def create_upload(self, key: str, content_type: str, size: int, sha256: str,
+                      token: str) -> dict:
+        """Signed request the client sends the file with: method, url and headers"""
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_head(path: str, length: int) -> bytes:
+    with open(path, "rb") as file:
+        return file.read(length)
+
+
+def _move_file(source: str, target: str) -> None:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(source, target)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class LocalStorage(StorageBackend):
+    """Files under MEDIA_ROOT, served by core.media_router. Direct uploads go to the API's own
+    signed upload endpoint, so clients use the same flow as with S3."""
+
+    def path(self, key: str) -> str:
+        return os.path.join(BASE_DIR, key)
+
+    async def save(self, key: str, source: str, content_type: str) -> None:
+        await run_in_threadpool(_move_file, source, self.path(key))
+
+    async def move(self, source_key: str, key: str, content_type: str) -> None:
+        await run_in_threadpool(_move_file, self.path(source_key), self.path(key))
+
+    async def delete(self, key: str) -> None:
+        await run_in_threadpool(_remove_file, self.path(key))
+
+    async def size(self, key: str) -> int | None:
+        try:
+            return (await run_in_threadpool(os.stat, self.path(key))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        return await run_in_threadpool(_read_head, self.path(key), length)
+
+    async def sha256(self, key: str) -> str | None:
+        return await run_in_threadpool(_hash_file, self.path(key))
+
+    @asynccontextmanager
+    async def local_file(self, key: str) -> AsyncIterator[str]:
+        yield self.path(key)
+
+    def url(self, key: str) -> str:
+        return key
+
+    def create_upload(self, key: str, content_type: str, size: int, sha256: str,
+                      token: str) -> dict:
+        return {"method": "PUT",
+                "url": f"/media/uploads/{token}",
+                "headers": {"Content-Type": content_type}}
+
+
+class S3Storage(StorageBackend):
+    """Bucket of an S3-compatible service (AWS S3, MinIO, Ceph, R2). Clients fetch files from
+    S3_PUBLIC_URL (bucket website or CDN) and upload them with presigned PUT requests, no file
+    bytes pass through the API."""
+    remote = True
+
+    def __init__(self, bucket: str, endpoint_url: str | None, region: str | None,
+                 access_key_id: str | None, secret_access_key: str | None,
+                 public_url: str | None):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package, "
+                               "install it with `poetry install -E s3`")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.client_error = ClientError
+        # Path style addressing works with every S3-compatible server
+        self.client = boto3.client("s3",
+                                   endpoint_url=endpoint_url or None,
+                                   region_name=region or None,
+                                   aws_access_key_id=access_key_id or None,
+                                   aws_secret_access_key=secret_access_key or None,
+                                   config=Config(signature_version="s3v4",
+                                                 s3={"addressing_style": "path"}))
+        self.public_url = (public_url or f"{self.client.meta.endpoint_url}/{bucket}").rstrip("/")
+
+    def _object_args(self, key: str, content_type: str) -> dict:
+        args = {"ContentType": content_type}
+        if cache_control_for(key):
+            args["CacheControl"] = cache_control_for(key)
+        return args
+
+    async def save(self, key: str, source: str, content_type: str) -> None:
+        try:
+            await run_in_threadpool(self.client.upload_file, source, self.bucket, key,
+                                    ExtraArgs=self._object_args(key, content_type))
+        finally:
+            await run_in_threadpool(_remove_file, source)
+
+    async def move(self, source_key: str, key: str, content_type: str) -> None:
+        # Server side copy, the bytes don't leave the storage
+        await run_in_threadpool(self.client.copy_object,
+                                Bucket=self.bucket,
+                                Key=key,
+                                CopySource={"Bucket": self.bucket, "Key": source_key},
+                                MetadataDirective="REPLACE",
+                                **self._object_args(key, content_type))
+        await self.delete(source_key)
+
+    async def delete(self, key: str) -> None:
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def _head(self, key: str, **kwargs) -> dict | None:
+        try:
+            return await run_in_threadpool(self.client.head_object, Bucket=self.bucket, Key=key,
+                                           **kwargs)
+        except self.client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    async def size(self, key: str) -> int | None:
+        head = await self._head(key)
+        return head["ContentLength"] if head else None
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        response = await run_in_threadpool(self.client.get_object, Bucket=self.bucket, Key=key,
+                                           Range=f"bytes=0-{length - 1}")
+        return await run_in_threadpool(response["Body"].read)
+
+    async def sha256(self, key: str) -> str | None:
+        """Checksum verified by the storage on upload. The object isn't downloaded to hash it,
+        direct uploads are signed with their checksum and objects without one are rejected."""
+        head = await self._head(key, ChecksumMode="ENABLED")
+        checksum = (head or {}).get("ChecksumSHA256")
+        # Multipart checksums are checksums of the parts
+        if not checksum or "-" in checksum:
+            return None
+        return base64.b64decode(checksum).hex()
+
+    @asynccontextmanager
+    async def local_file(self, key: str) -> AsyncIterator[str]:
+        await run_in_threadpool(os.makedirs, MEDIA_UPLOAD_DIR, exist_ok=True)
+        fd, path = await run_in_threadpool(tempfile.mkstemp, dir=MEDIA_UPLOAD_DIR,
+                                           prefix="download-")
+        os.close(fd)
+        try:
+            await run_in_threadpool(self.client.download_file, self.bucket, key, path)
+            yield path
+        finally:
+            await run_in_threadpool(_remove_file, path)
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def create_upload(self, key: str, content_type: str, size: int, sha256: str,
+                      token: str) -> dict:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url("put_object",
+                                                 Params={"Bucket": self.bucket,
+                                                         "Key": key,
+                                                         "ContentType": content_type,
+                                                         "ContentLength": size,
+                                                         "ChecksumSHA256": checksum,
+                                                         "ChecksumAlgorithm": "SHA256"},
+                                                 ExpiresIn=DIRECT_UPLOAD_EXPIRES)
+        # The storage rejects a body that doesn't match the signed checksum and keeps the
+        # checksum, confirm_direct_upload reads it back
+        return {"method": "PUT",
+                "url": url,
+                "headers": {"Content-Type": content_type,
+                            "x-amz-checksum-sha256": checksum,
+                            "x-amz-sdk-checksum-algorithm": "SHA256"}}
+
+
+def create_storage_backend() -> StorageBackend:
+    if STORAGE_BACKEND == 's3':
+        return S3Storage(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID,
+                         S3_SECRET_ACCESS_KEY, S3_PUBLIC_URL)
+    return LocalStorage()
+
+
+storage = create_storage_backend()
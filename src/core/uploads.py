@@ -0,0 +1,146 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from config import UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE
+from core.constants import BASE_DIR
+from core.exceptions import file_too_large_exception, unsupported_file_type_exception
+
+# Leading bytes of the accepted image formats -> file extension
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+# Enough leading bytes to recognise every format above, WebP needs 12
+SNIFF_BYTES = 16
+IMAGE_CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+
+
+@dataclass
+class ReceivedUpload:
+    """Upload copied into a temporary file, waiting to be moved to its final path"""
+    temp_path: str
+    sha256: str
+    extension: str
+    size: int
+
+    @property
+    def content_type(self) -> str:
+        return IMAGE_CONTENT_TYPES[self.extension]
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """Extension of the image format recognised from the first bytes of the file, the client's
+    filename and content type are not trusted"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def media_path(path: str) -> str:
+    """Path stored in the database and served under /media, relative to the project root"""
+    return os.path.relpath(path, BASE_DIR)
+
+
+def _write_chunk(fd: int, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    view = memoryview(chunk)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _close_file(fd: int, temp_path: str, keep: bool) -> None:
+    try:
+        if keep:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+        if not keep:
+            os.remove(temp_path)
+
+
+async def upload_file_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await file.close()
+
+
+async def receive_upload(file: UploadFile, directory: str,
+                         max_bytes: int = UPLOAD_MAX_BYTES) -> ReceivedUpload:
+    """Copy a multipart upload into a temporary file in directory, see receive_stream"""
+    if file.size is not None and file.size > max_bytes:
+        await file.close()
+        raise file_too_large_exception(max_bytes)
+    chunks = upload_file_chunks(file)
+    try:
+        return await receive_stream(chunks, directory, max_bytes)
+    finally:
+        await chunks.aclose()
+
+
+async def receive_stream(chunks: AsyncIterator[bytes], directory: str,
+                         max_bytes: int = UPLOAD_MAX_BYTES) -> ReceivedUpload:
+    """Copy an uploaded image into a temporary file in directory, hashing it on the way.
+
+    All disk IO and hashing run in the threadpool, so a large upload doesn't block the event
+    loop. The format is sniffed from the first bytes and the size is checked on every chunk, a
+    rejected upload raises 415 or 413 and leaves nothing behind. The caller hands the file over
+    to the storage backend or removes it with discard_upload.
+    """
+    chunks = aiter(chunks)
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+    extension = sniff_image_type(head)
+    if extension is None:
+        raise unsupported_file_type_exception()
+
+    await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+    fd, temp_path = await run_in_threadpool(tempfile.mkstemp, dir=directory,
+                                            prefix="upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    complete = False
+    try:
+        chunk = head
+        while chunk is not None:
+            size += len(chunk)
+            if size > max_bytes:
+                raise file_too_large_exception(max_bytes)
+            await run_in_threadpool(_write_chunk, fd, digest, chunk)
+            chunk = await anext(chunks, None)
+        complete = True
+    finally:
+        await run_in_threadpool(_close_file, fd, temp_path, complete)
+    return ReceivedUpload(temp_path=temp_path, sha256=digest.hexdigest(), extension=extension,
+                          size=size)
+
+
+async def discard_upload(upload: ReceivedUpload) -> None:
+    await run_in_threadpool(_remove_file, upload.temp_path)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(os.path.join(BASE_DIR, path))
+    except FileNotFoundError:
+        pass
@@ -1,12 +1,48 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from src.config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+from src.config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, DB_POOL_SIZE, \
+    DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_PGBOUNCER, \
+    DB_DIRECT_HOST, DB_DIRECT_PORT, DB_REPLICA_HOST, DB_REPLICA_PORT, DB_REPLICA_NAME
+from src.core.pool import MonitoredQueuePool, PgBouncerConnection
+from src.core.settings import REPLICA_SESSION
 
 
-SQLALCHEMY_DATABASE_URL = f'postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+SQLALCHEMY_DATABASE_URL = f'postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+SQLALCHEMY_REPLICA_DATABASE_URL = f'postgresql+asyncpg://{DB_USER}:{DB_PASS}@' \
+                                  f'{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_REPLICA_NAME}'
+# Bypasses PgBouncer, for session features such as LISTEN
+DIRECT_DATABASE_DSN = f'postgresql://{DB_USER}:{DB_PASS}@' \
+                      f'{DB_DIRECT_HOST}:{DB_DIRECT_PORT}/{DB_NAME}'
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def create_engine_from_config(url: str):
+    connect_args = {}
+    if DB_PGBOUNCER:
+        # SQLAlchemy prepares every statement in the transaction running it. Without the caches
+        # no statement is reused in a later transaction, which may get another server
+        # connection, and unique names keep statements of other clients apart.
+        connect_args = {"statement_cache_size": 0,
+                        "prepared_statement_cache_size": 0,
+                        "connection_class": PgBouncerConnection}
+    return create_async_engine(url,
+                               poolclass=MonitoredQueuePool,
+                               pool_size=DB_POOL_SIZE,
+                               max_overflow=DB_MAX_OVERFLOW,
+                               pool_timeout=DB_POOL_TIMEOUT,
+                               pool_recycle=DB_POOL_RECYCLE,
+                               pool_pre_ping=DB_POOL_PRE_PING,
+                               connect_args=connect_args)
+
+
+engine = create_engine_from_config(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Falls back to the primary when no replica is configured
+replica_engine = create_engine_from_config(SQLALCHEMY_REPLICA_DATABASE_URL) \
+    if DB_REPLICA_HOST else None
+ReplicaSessionLocal = sessionmaker(replica_engine, class_=AsyncSession, autoflush=False,
+                                   expire_on_commit=False, info={REPLICA_SESSION: True}) \
+    if replica_engine else SessionLocal
 
 Base = declarative_base()
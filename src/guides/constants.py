@@ -1,6 +1,27 @@
 from enum import Enum
 
+from core.constants import CountStrategy
+
 
 class RetrieveOrder(str, Enum):
     ascending = "asc"
     descending = "desc"
+
+
+class PaginationMode(str, Enum):
+    page = "page"
+    cursor = "cursor"
+
+
+# Count strategies per endpoint
+FEED_COUNT_STRATEGY = CountStrategy.cached
+SEARCH_COUNT_STRATEGY = CountStrategy.window
+USER_GUIDES_COUNT_STRATEGY = CountStrategy.window
+
+# Full-text search
+SEARCH_LANGUAGE = 'english'
+SNIPPET_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5'
+
+# Cache namespaces
+FEED_CACHE_NAMESPACE = 'feed'
+GUIDE_CACHE_NAMESPACE = 'guide'
@@ -1,38 +1,59 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Query, UploadFile
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response, UploadFile
 
 from auth.exceptions import invalid_credentials_exception
-from auth.service import get_current_active_user
-from core.dependencies import DBDependency
+from auth.schemas import CurrentUserSchema
+from auth.service import CurrentUserSnapshot
+from core.conditional import make_etag, conditional_response, PRIVATE_CACHE_CONTROL
+from core.dependencies import DBDependency, ReadDBDependency
 from core.exceptions import non_existent_page_exception
-from core.models import User
+from core.schemas import DirectUploadConfirmSchema
 from guides import schemas
 from guides import service
-from guides.constants import RetrieveOrder
+from guides.constants import RetrieveOrder, PaginationMode, FEED_COUNT_STRATEGY
 from guides.exceptions import not_instructor_exception, guides_not_found_exception
 
 router = APIRouter()
 
+PAGINATION_QUERY = Query(default=PaginationMode.page,
+                         description="Pagination mode: page/cursor. Cursor mode ignores page and "
+                                     "returns hasNext and nextCursor instead of pages")
+CURSOR_QUERY = Query(default=None, description="Cursor returned as nextCursor, cursor mode only")
+
 
 @router.get("",
             description="Get list of guides",
             status_code=status.HTTP_200_OK,
             response_model=schemas.GuideListReadSchema)
-async def get_list_of_guides(db=DBDependency,
+async def get_list_of_guides(request: Request,
+                             response: Response,
+                             db=ReadDBDependency,
                              order: RetrieveOrder = Query(default=RetrieveOrder.descending,
                                                           description="Retrieve order: asc/desc"),
                              page: int = Query(default=1, ge=1, description="Page to request"),
                              page_size: int = Query(default=50, ge=1, le=100,
-                                                    description="Page size")):
-    guides = await service.get_list_of_guides(db,
-                                              page=page - 1,
-                                              page_size=page_size,
-                                              sort_order=order,
-                                              published_only=True)
+                                                    description="Page size"),
+                             pagination: PaginationMode = PAGINATION_QUERY,
+                             cursor: str | None = CURSOR_QUERY):
+    if pagination == PaginationMode.page:
+        guides = await service.get_feed_page(db, page=page - 1, page_size=page_size,
+                                             sort_order=order)
+    else:
+        guides = await service.get_list_of_guides(db,
+                                                  page=page - 1,
+                                                  page_size=page_size,
+                                                  sort_order=order,
+                                                  published_only=True,
+                                                  pagination=pagination,
+                                                  cursor=cursor,
+                                                  count_strategy=FEED_COUNT_STRATEGY)
     if not guides.guides:
         raise await guides_not_found_exception()
-    if page > guides.pages:
-        raise await non_existent_page_exception()
-    return schemas.GuideListReadSchema(pages=guides.pages, guides=guides.guides)
+    if pagination == PaginationMode.page and page > guides.pages:
+        raise non_existent_page_exception()
+    not_modified = conditional_response(request, response, make_etag(guides.model_dump_json()))
+    if not_modified:
+        return not_modified
+    return guides
 
 
 @router.post(path="",
@@ -41,10 +62,10 @@ async def get_list_of_guides(db=DBDependency,
              response_model=schemas.GuideReadSchema)
 async def create_guide(data: schemas.GuideCreateUpdateSchema,
                        db=DBDependency,
-                       user: User = Depends(get_current_active_user)):
+                       user: CurrentUserSchema = CurrentUserSnapshot):
     if not user:
         raise await invalid_credentials_exception()
-    if not user.user_details.is_instructor:
+    if not user.is_instructor:
         raise await not_instructor_exception()
     prepared_data = await service.prepare_guide_data(data)
     guide = await service.save_guide(db, prepared_data, user_id=user.user_id)
@@ -56,7 +77,7 @@ async def create_guide(data: schemas.GuideCreateUpdateSchema,
             response_model=schemas.GuideCoverImageSchema,
             status_code=status.HTTP_200_OK)
 async def get_cover_image(guide_id: int,
-                          user: User = Depends(get_current_active_user),
+                          user: CurrentUserSchema = CurrentUserSnapshot,
                           db=DBDependency):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
@@ -75,7 +96,7 @@ async def get_cover_image(guide_id: int,
 async def create_cover_image(guide_id: int,
                              file: UploadFile,
                              db=DBDependency,
-                             user: User = Depends(get_current_active_user)):
+                             user: CurrentUserSchema = CurrentUserSnapshot):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
@@ -92,7 +113,7 @@ async def create_cover_image(guide_id: int,
 async def update_cover_image(guide_id: int,
                              file: UploadFile,
                              db=DBDependency,
-                             user: User = Depends(get_current_active_user)):
+                             user: CurrentUserSchema = CurrentUserSnapshot):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
@@ -102,12 +123,30 @@ async def update_cover_image(guide_id: int,
     return updated
 
 
+@router.put(path="/cover_image/upload",
+            description="Set guide cover image to a file uploaded with a signed upload from "
+                        "POST /media/uploads",
+            response_model=schemas.GuideCoverImageSchema,
+            status_code=status.HTTP_200_OK)
+async def confirm_cover_image_upload(guide_id: int,
+                                     data: DirectUploadConfirmSchema,
+                                     db=DBDependency,
+                                     user: CurrentUserSchema = CurrentUserSnapshot):
+    guide = await service.get_guide_by_id(db, guide_id, user)
+    if not guide:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    if user.user_id != guide.user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    updated = await service.confirm_cover_image_upload(data.upload_token, db, guide)
+    return updated
+
+
 @router.delete(path="/cover_image",
                description="Delete user cover image",
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_cover_image(guide_id: int,
                              db=DBDependency,
-                             user: User = Depends(get_current_active_user)):
+                             user: CurrentUserSchema = CurrentUserSnapshot):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
@@ -122,19 +161,31 @@ async def delete_cover_image(guide_id: int,
 
 
 @router.get(path="/search",
-            description="Search guides by title",
+            description="Full-text search of guides by title, note and content",
             status_code=status.HTTP_200_OK,
             response_model=schemas.GuideListReadSchema)
 async def get_guides_by_title(title: str,
+                              request: Request,
+                              response: Response,
                               page: int = Query(default=1, ge=1, description="Page to request"),
                               page_size: int = Query(default=50, ge=1, le=100,
                                                      description="Page size"),
-                              db=DBDependency):
-    guides = await service.search_guides(db, title, page=page - 1, page_size=page_size)
+                              pagination: PaginationMode = PAGINATION_QUERY,
+                              cursor: str | None = CURSOR_QUERY,
+                              highlight: bool = Query(default=False,
+                                                      description="Include content snippets "
+                                                                  "with highlighted matches"),
+                              db=ReadDBDependency):
+    guides = await service.search_guides(db, title, page=page - 1, page_size=page_size,
+                                         pagination=pagination, cursor=cursor,
+                                         highlight=highlight)
     if not guides.guides:
         raise await guides_not_found_exception()
-    if page > guides.pages:
-        raise await non_existent_page_exception()
+    if pagination == PaginationMode.page and page > guides.pages:
+        raise non_existent_page_exception()
+    not_modified = conditional_response(request, response, make_etag(guides.model_dump_json()))
+    if not_modified:
+        return not_modified
     return guides
 
 
@@ -143,21 +194,31 @@ async def get_guides_by_title(title: str,
             status_code=status.HTTP_200_OK,
             response_model=schemas.GuideListReadSchema)
 async def get_guides_by_user_id(user_id: int,
+                                request: Request,
+                                response: Response,
                                 page: int = Query(default=1, ge=1, description="Page to request"),
                                 page_size: int = Query(default=50, ge=1, le=100,
                                                        description="Page size"),
-                                db=DBDependency,
-                                user: User = Depends(get_current_active_user)):
+                                pagination: PaginationMode = PAGINATION_QUERY,
+                                cursor: str | None = CURSOR_QUERY,
+                                db=ReadDBDependency,
+                                user: CurrentUserSchema = CurrentUserSnapshot):
     guides = await service.get_guides_by_user_id(db=db,
                                                  user_id=user_id,
                                                  page=page - 1,
                                                  page_size=page_size,
-                                                 user=user)
+                                                 user=user,
+                                                 pagination=pagination,
+                                                 cursor=cursor)
     if not guides.guides:
         raise await guides_not_found_exception()
-    if page > guides.pages:
-        raise await non_existent_page_exception()
-    return schemas.GuideListReadSchema(pages=guides.pages, guides=guides.guides)
+    if pagination == PaginationMode.page and page > guides.pages:
+        raise non_existent_page_exception()
+    not_modified = conditional_response(request, response, make_etag(guides.model_dump_json()),
+                                        cache_control=PRIVATE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    return guides
 
 
 @router.get("/guide/{guide_id}",
@@ -165,9 +226,21 @@ async def get_guides_by_user_id(user_id: int,
             status_code=status.HTTP_200_OK,
             response_model=schemas.GuideReadSchema)
 async def get_guide_by_id(guide_id: int,
+                          request: Request,
+                          response: Response,
                           db=DBDependency,
-                          user: User = Depends(get_current_active_user)):
-    guide = await service.get_guide_by_id(db, guide_id, user)
+                          user: CurrentUserSchema = CurrentUserSnapshot):
+    version = await service.get_guide_version(db, guide_id)
+    if not version or (version.user_id != user.user_id and not version.published):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
+    etag = make_etag("guide", guide_id, version.last_modified.isoformat(),
+                     version.user_last_modified.isoformat())
+    not_modified = conditional_response(request, response, etag,
+                                        max(version.last_modified, version.user_last_modified),
+                                        cache_control=PRIVATE_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    guide = await service.get_guide_detail(db, guide_id, user, version.last_modified)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
     return guide
@@ -179,11 +252,11 @@ async def get_guide_by_id(guide_id: int,
             response_model=schemas.GuideReadSchema)
 async def update_guide(guide_id: int, data: schemas.GuideCreateUpdateSchema,
                        db=DBDependency,
-                       user: User = Depends(get_current_active_user)):
+                       user: CurrentUserSchema = CurrentUserSnapshot):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
-    if not user.user_details.is_instructor:
+    if not user.is_instructor:
         raise await not_instructor_exception()
     prepared_data = await service.prepare_guide_data(data)
     return await service.save_guide(db, prepared_data, user_id=user.user_id, guide=guide)
@@ -194,7 +267,7 @@ async def update_guide(guide_id: int, data: schemas.GuideCreateUpdateSchema,
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_guide(guide_id: int,
                        db=DBDependency,
-                       user: User = Depends(get_current_active_user)):
+                       user: CurrentUserSchema = CurrentUserSnapshot):
     guide = await service.get_guide_by_id(db, guide_id, user)
     if not guide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Guide not found")
@@ -20,15 +20,20 @@ class GuideListSingleSchema(BaseModelSchema):
     created_at: datetime
     last_modified: datetime
     cover_image: str | None
+    # Variant name (thumbnail.webp, medium.avif) -> URL, missing until the variants are built
+    cover_image_variants: dict[str, str] | None = None
     user: UserListReadSchema
+    snippet: str | None = None
 
     class Config:
         from_attributes = True
 
 
 class GuideListReadSchema(BaseModelSchema):
-    pages: int
+    pages: int | None = None
     guides: list[GuideListSingleSchema]
+    has_next: bool | None = None
+    next_cursor: str | None = None
 
 
 class GuideCreateUpdateSchema(BaseModelSchema):
@@ -1,19 +1,32 @@
-import os
-import shutil
 from datetime import datetime
-from pathlib import Path
 
 from fastapi import UploadFile
-from sqlalchemy import asc, desc, func
-from sqlalchemy.orm import Session, Query
-
-from core.constants import MEDIA_ROOT
-from core.models import Guide, User, Profession, UserDetail
-from core.service import count_number_of_pages
-from guides.constants import RetrieveOrder
-from guides.schemas import GuideCreateUpdateSchema, GuideListSingleSchema, GuideListReadSchema
+from sqlalchemy import asc, desc, func, select, tuple_, true, delete, insert, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
+
+from auth.schemas import CurrentUserSchema
+from config import FEED_CACHE_TTL, DETAIL_CACHE_TTL
+from core.cache import cache_backend, can_fill_cache, invalidate_on_commit
+from core.constants import CountStrategy
+from core.images import register_variants_listener
+from core.media import store_upload, release_media, confirm_direct_upload
+from core.models import Guide, GuideFeed, User, Profession, UserDetail, MediaFile, \
+    guide_author_options
+from core.service import count_number_of_pages, encode_cursor, decode_cursor, fetch_page
+from guides.constants import RetrieveOrder, PaginationMode, SEARCH_COUNT_STRATEGY, \
+    USER_GUIDES_COUNT_STRATEGY, SEARCH_LANGUAGE, SNIPPET_OPTIONS, FEED_COUNT_STRATEGY, \
+    FEED_CACHE_NAMESPACE, GUIDE_CACHE_NAMESPACE
+from guides.schemas import GuideCreateUpdateSchema, GuideListSingleSchema, GuideListReadSchema, \
+    GuideReadSchema
 from users.schemas import UserListReadSchema
 
+# Media files of the cover image and the author's avatar, joined for their variants
+cover_media = aliased(MediaFile)
+avatar_media = aliased(MediaFile)
+
 
 async def prepare_guide_data(data: GuideCreateUpdateSchema) -> GuideCreateUpdateSchema:
     title = data.title.strip()
@@ -23,86 +36,113 @@ async def prepare_guide_data(data: GuideCreateUpdateSchema) -> GuideCreateUpdate
                                    note=note, published=data.published)
 
 
-def create_upload_path(directory: str, filename: str):
-    if not os.path.exists(directory):
-        Path(directory).mkdir(parents=True, exist_ok=True)
-    if not os.path.exists(directory + filename):
-        filename_parts = filename.split(".")
-        timestamp = str(int(datetime.now().timestamp()))
-        filename = "".join(filename_parts[:-1]) + "_" + timestamp + "." + filename_parts[-1]
-    open(f'{directory}{filename}', 'wb').close()
-    return directory + filename
-
-
-def cover_image_upload_path(guide_id: str, filename: str):
-    directory = f"{MEDIA_ROOT}/guides/{guide_id}/cover_image/"
-    path = create_upload_path(directory, filename)
-    path_to_save = 'media' + path.split('media')[1]
-    return path_to_save
-
-
-def count_pages(db: Session, page_size: int):
-    count_of_guides: int = db.query(Guide.guide_id) \
-        .order_by(desc(Guide.last_modified)).count()
-    division: tuple[int, int] = divmod(count_of_guides, page_size)
-    pages: int = division[0] + 1 if division[1] else division[0]
-    return pages
+async def get_initial_list_of_guides(db: AsyncSession,
+                                     search: str = '') -> Select | None:
+    """Guides joined with their authors, used when unpublished guides are listed as well"""
+    guides = select(
+        Guide.guide_id,
+        Guide.title,
+        Guide.published,
+        Guide.created_at,
+        Guide.last_modified,
+        Guide.cover_image,
+        User.first_name,
+        User.last_name,
+        UserDetail.avatar,
+        User.user_id,
+        Profession.name.label('profession'),
+        cover_media.variants.label('cover_image_variants'),
+        avatar_media.variants.label('avatar_variants')) \
+        .select_from(Guide) \
+        .join(User, Guide.user_id == User.user_id) \
+        .outerjoin(UserDetail, User.user_id == UserDetail.user_id) \
+        .outerjoin(Profession, UserDetail.profession_id == Profession.profession_id) \
+        .outerjoin(cover_media, Guide.cover_image == cover_media.path) \
+        .outerjoin(avatar_media, UserDetail.avatar == avatar_media.path)
+    if search:
+        guides = guides.where(Guide.search_vector.op('@@')(search_query(search)))
+    return guides
 
 
-def count_published_guides_pages(db: Session, page_size: int):
-    count_of_guides: int = db.query(Guide.guide_id).filter(Guide.published) \
-        .order_by(desc(Guide.last_modified)).count()
-    division: tuple[int, int] = divmod(count_of_guides, page_size)
-    pages: int = division[0] + 1 if division[1] else division[0]
-    return pages
+async def get_initial_feed_of_guides(db: AsyncSession,
+                                     search: str = '') -> Select | None:
+    """Published guides from the guide_feed read model, same columns as
+    get_initial_list_of_guides"""
+    guides = select(
+        GuideFeed.guide_id,
+        GuideFeed.title,
+        true().label('published'),
+        GuideFeed.created_at,
+        GuideFeed.last_modified,
+        GuideFeed.cover_image,
+        GuideFeed.first_name,
+        GuideFeed.last_name,
+        GuideFeed.avatar,
+        GuideFeed.user_id,
+        GuideFeed.profession,
+        GuideFeed.cover_image_variants,
+        GuideFeed.avatar_variants)
+    if search:
+        guides = guides.join(Guide, Guide.guide_id == GuideFeed.guide_id) \
+            .where(Guide.search_vector.op('@@')(search_query(search)))
+    return guides
 
 
-async def get_initial_list_of_guides(db: Session,
-                                     search: str = '') -> Query | None:
-    guides = db.query(
+async def refresh_guide_feed(db: AsyncSession, condition) -> None:
+    """Rebuild guide_feed rows of guides matching the condition, e.g. Guide.user_id == 1.
+    Runs in the caller's transaction, so the read model is committed together with the change."""
+    await db.flush()
+    deleted = await db.execute(delete(GuideFeed)
+                               .where(GuideFeed.guide_id.in_(select(Guide.guide_id)
+                                                             .where(condition)))
+                               .execution_options(synchronize_session=False))
+    published_guides = select(
         Guide.guide_id,
         Guide.title,
-        Guide.published,
         Guide.created_at,
         Guide.last_modified,
         Guide.cover_image,
+        User.user_id,
         User.first_name,
         User.last_name,
         UserDetail.avatar,
-        User.user_id,
-        Profession.name.label('profession')) \
-        .filter(Guide.user_id == User.user_id, User.user_id == UserDetail.user_id,
-                UserDetail.profession_id == Profession.profession_id,
-                func.coalesce(Guide.title, '').ilike(f"%{search}%"),
-                )
-    return guides
+        Profession.name,
+        cover_media.variants,
+        avatar_media.variants) \
+        .select_from(Guide) \
+        .join(User, Guide.user_id == User.user_id) \
+        .outerjoin(UserDetail, User.user_id == UserDetail.user_id) \
+        .outerjoin(Profession, UserDetail.profession_id == Profession.profession_id) \
+        .outerjoin(cover_media, Guide.cover_image == cover_media.path) \
+        .outerjoin(avatar_media, UserDetail.avatar == avatar_media.path) \
+        .where(Guide.published, condition)
+    inserted = await db.execute(insert(GuideFeed).from_select(
+        ['guide_id', 'title', 'created_at', 'last_modified', 'cover_image', 'user_id',
+         'first_name', 'last_name', 'avatar', 'profession', 'cover_image_variants',
+         'avatar_variants'],
+        published_guides))
+    if deleted.rowcount or inserted.rowcount:
+        await invalidate_on_commit(db, FEED_CACHE_NAMESPACE)
 
 
-async def get_list_of_guides(db: Session,
-                             page: int,
-                             page_size: int,
-                             sort_order: str = RetrieveOrder.descending,
-                             search: str = '',
-                             published_only: bool = True,
-                             user_id: int = None) -> GuideListReadSchema | None:
-    offset: int = page * page_size
+async def refresh_media_references(db: AsyncSession, path: str) -> None:
+    """Copy newly built variants of a media file into the guide_feed rows showing it"""
+    await refresh_guide_feed(db, or_(Guide.cover_image == path,
+                                     Guide.user_id.in_(select(UserDetail.user_id)
+                                                       .where(UserDetail.avatar == path))))
 
-    if sort_order == RetrieveOrder.descending:
-        order_by_clause = desc(Guide.last_modified)
-    else:
-        order_by_clause = asc(Guide.last_modified)
 
-    query = await get_initial_list_of_guides(db, search=search)
-    if published_only:
-        guides = query.filter(Guide.published).order_by(order_by_clause)
-    else:
-        guides = query.order_by(order_by_clause)
-    if user_id:
-        guides = guides.filter(Guide.user_id == user_id)
-    pages: int = await count_number_of_pages(guides.count(), page_size)
-    guides = guides.offset(offset).limit(page_size).all()
+register_variants_listener(refresh_media_references)
+
+
+def search_query(search: str):
+    """Build tsquery from user input, supports quoted phrases, OR and -exclusion"""
+    return func.websearch_to_tsquery(SEARCH_LANGUAGE, search)
+
+
+def guides_records_to_schema(records) -> list[GuideListSingleSchema]:
     guides_list: list[GuideListSingleSchema] = []
-    for record in guides:
+    for record in records:
         guides_list.append(GuideListSingleSchema(
             guide_id=record[0],
             title=record[1],
@@ -110,39 +150,155 @@ async def get_list_of_guides(db: Session,
             created_at=record[3],
             last_modified=record[4],
             cover_image=record[5],
+            cover_image_variants=record[11],
             user=UserListReadSchema(
                 first_name=record[6],
                 last_name=record[7],
                 avatar=record[8],
+                avatar_variants=record[12],
                 user_id=record[9],
                 profession=record[10]
-            )
+            ),
+            snippet=record[13] if len(record) > 13 else None
         ))
-    return GuideListReadSchema(pages=pages, guides=guides_list)
+    return guides_list
+
+
+async def get_guides_page_by_cursor(db: AsyncSession,
+                                    guides: Select,
+                                    page_size: int,
+                                    sort_order: str,
+                                    cursor: str | None,
+                                    source=Guide) -> GuideListReadSchema:
+    """Keyset pagination over (last_modified, guide_id) of the source (Guide or GuideFeed).
+    Instead of counting pages, one extra row is fetched to tell if there is a next page."""
+    position = tuple_(source.last_modified, source.guide_id)
+    if sort_order == RetrieveOrder.descending:
+        guides = guides.order_by(desc(source.last_modified), desc(source.guide_id))
+    else:
+        guides = guides.order_by(asc(source.last_modified), asc(source.guide_id))
+    if cursor:
+        last_modified, guide_id = decode_cursor(cursor)
+        if sort_order == RetrieveOrder.descending:
+            guides = guides.where(position < tuple_(last_modified, guide_id))
+        else:
+            guides = guides.where(position > tuple_(last_modified, guide_id))
+    records = (await db.execute(guides.limit(page_size + 1))).all()
+    has_next: bool = len(records) > page_size
+    guides_list = guides_records_to_schema(records[:page_size])
+    next_cursor = encode_cursor(guides_list[-1].last_modified, guides_list[-1].guide_id) \
+        if has_next else None
+    return GuideListReadSchema(guides=guides_list, has_next=has_next, next_cursor=next_cursor)
+
+
+async def get_list_of_guides(db: AsyncSession,
+                             page: int,
+                             page_size: int,
+                             sort_order: str = RetrieveOrder.descending,
+                             search: str = '',
+                             published_only: bool = True,
+                             user_id: int = None,
+                             pagination: PaginationMode = PaginationMode.page,
+                             cursor: str | None = None,
+                             count_strategy: CountStrategy = CountStrategy.window,
+                             highlight: bool = False) -> GuideListReadSchema | None:
+    offset: int = page * page_size
+
+    if published_only:
+        source = GuideFeed
+        guides = await get_initial_feed_of_guides(db, search=search)
+    else:
+        source = Guide
+        guides = await get_initial_list_of_guides(db, search=search)
+    if user_id:
+        guides = guides.where(source.user_id == user_id)
+    if search and highlight:
+        guides = guides.add_columns(func.ts_headline(SEARCH_LANGUAGE, Guide.content,
+                                                     search_query(search), SNIPPET_OPTIONS)
+                                    .label('snippet'))
+    if pagination == PaginationMode.cursor:
+        return await get_guides_page_by_cursor(db, guides, page_size, sort_order, cursor, source)
+
+    if search:
+        guides = guides.order_by(desc(func.ts_rank_cd(Guide.search_vector, search_query(search))),
+                                 desc(source.guide_id))
+    elif sort_order == RetrieveOrder.descending:
+        guides = guides.order_by(desc(source.last_modified), desc(source.guide_id))
+    else:
+        guides = guides.order_by(asc(source.last_modified), asc(source.guide_id))
+    if count_strategy == CountStrategy.estimated and (search or user_id):
+        # Planner estimates are only close enough for the unfiltered feed
+        count_strategy = CountStrategy.window
+    # guide_feed changes invalidate the feed namespace, cached feed counts go with it
+    count_namespace = FEED_CACHE_NAMESPACE if published_only else None
+    records, count_of_guides = await fetch_page(db, guides, offset, page_size, count_strategy,
+                                                count_namespace)
+    pages: int = await count_number_of_pages(count_of_guides, page_size)
+    guides_list = guides_records_to_schema(records)
+    return GuideListReadSchema(pages=pages, guides=guides_list, has_next=page + 1 < pages)
+
+
+async def get_feed_page(db: AsyncSession,
+                        page: int,
+                        page_size: int,
+                        sort_order: str = RetrieveOrder.descending) -> GuideListReadSchema:
+    """Page of the public feed, served from the cache backend when possible"""
+    key = f"{RetrieveOrder(sort_order).value}:{page}:{page_size}"
+    cached = await cache_backend.get(FEED_CACHE_NAMESPACE, key)
+    if cached is not None:
+        return GuideListReadSchema.model_validate_json(cached)
+    generation = await cache_backend.generation(FEED_CACHE_NAMESPACE)
+    guides = await get_list_of_guides(db, page=page, page_size=page_size, sort_order=sort_order,
+                                      published_only=True, count_strategy=FEED_COUNT_STRATEGY)
+    if can_fill_cache(db):
+        await cache_backend.set(FEED_CACHE_NAMESPACE, key, guides.model_dump_json(), generation,
+                                FEED_CACHE_TTL)
+    return guides
 
 
-async def search_guides(db: Session, title: str, page: int,
-                        page_size: int) -> GuideListReadSchema | None:
-    guides = await get_list_of_guides(db, page=page, page_size=page_size, search=title)
-    return GuideListReadSchema(pages=guides.pages, guides=guides.guides)
+async def prewarm_feed_cache(db: AsyncSession, pages: int, page_size: int = 50) -> None:
+    for page in range(pages):
+        guides = await get_feed_page(db, page=page, page_size=page_size)
+        if not guides.has_next:
+            break
+
+
+async def search_guides(db: AsyncSession, title: str, page: int,
+                        page_size: int,
+                        pagination: PaginationMode = PaginationMode.page,
+                        cursor: str | None = None,
+                        highlight: bool = False) -> GuideListReadSchema | None:
+    """Full-text search over guide title, note and content. Page mode orders results by
+    relevance, cursor mode keeps the last_modified order of the feed."""
+    guides = await get_list_of_guides(db, page=page, page_size=page_size, search=title,
+                                      pagination=pagination, cursor=cursor,
+                                      count_strategy=SEARCH_COUNT_STRATEGY,
+                                      highlight=highlight)
+    return guides
 
 
-async def get_guides_by_user_id(db: Session,
+async def get_guides_by_user_id(db: AsyncSession,
                                 user_id: int,
                                 page: int,
                                 page_size: int,
-                                user: User):
+                                user: CurrentUserSchema,
+                                pagination: PaginationMode = PaginationMode.page,
+                                cursor: str | None = None):
     if user.user_id == user_id:
         guides = await get_list_of_guides(db, page=page, page_size=page_size,
-                                          published_only=False, user_id=user_id)
+                                          published_only=False, user_id=user_id,
+                                          pagination=pagination, cursor=cursor,
+                                          count_strategy=USER_GUIDES_COUNT_STRATEGY)
     else:
         guides = await get_list_of_guides(db, page=page, page_size=page_size,
-                                          published_only=True, user_id=user_id)
+                                          published_only=True, user_id=user_id,
+                                          pagination=pagination, cursor=cursor,
+                                          count_strategy=USER_GUIDES_COUNT_STRATEGY)
     return guides
 
 
-async def get_guide_by_id(db: Session, guide_id: int, user: User) -> Guide | None:
-    guide: Guide = db.query(Guide).get(guide_id)
+async def get_guide_by_id(db: AsyncSession, guide_id: int, user: CurrentUserSchema) -> Guide | None:
+    guide: Guide = await db.get(Guide, guide_id, options=guide_author_options)
     if not guide:
         return None
     if not guide.user_id == user.user_id and not guide.published:
@@ -150,7 +306,40 @@ async def get_guide_by_id(db: Session, guide_id: int, user: User) -> Guide | Non
     return guide
 
 
-async def save_guide(db: Session,
+async def get_guide_version(db: AsyncSession, guide_id: int) -> Row | None:
+    """Versions of the guide and its author used as HTTP validators, together with the columns
+    the visibility check needs. Doesn't load content."""
+    version = await db.execute(select(Guide.published,
+                                      Guide.user_id,
+                                      Guide.last_modified,
+                                      User.last_modified.label('user_last_modified'))
+                               .join(User, Guide.user_id == User.user_id)
+                               .where(Guide.guide_id == guide_id))
+    return version.first()
+
+
+async def get_guide_detail(db: AsyncSession, guide_id: int, user: CurrentUserSchema,
+                           last_modified: datetime | None = None) -> GuideReadSchema | None:
+    """Read-only guide with its author, served from the cache backend when possible.
+    Visibility is checked after the cache, so unpublished guides are cached as well. Cached guide
+    older than last_modified, if given, is reloaded."""
+    cached = await cache_backend.get(GUIDE_CACHE_NAMESPACE, str(guide_id))
+    guide = GuideReadSchema.model_validate_json(cached) if cached is not None else None
+    if guide is None or (last_modified and guide.last_modified != last_modified):
+        generation = await cache_backend.generation(GUIDE_CACHE_NAMESPACE)
+        guide_object: Guide = await db.get(Guide, guide_id, options=guide_author_options)
+        if not guide_object:
+            return None
+        guide = GuideReadSchema.model_validate(guide_object)
+        if can_fill_cache(db):
+            await cache_backend.set(GUIDE_CACHE_NAMESPACE, str(guide_id),
+                                    guide.model_dump_json(), generation, DETAIL_CACHE_TTL)
+    if not guide.user.user_id == user.user_id and not guide.published:
+        return None
+    return guide
+
+
+async def save_guide(db: AsyncSession,
                      data: GuideCreateUpdateSchema,
                      user_id: int,
                      guide=None) -> Guide:
@@ -162,8 +351,16 @@ async def save_guide(db: Session,
     guide.published = data.published
     guide.user_id = user_id
     db.add(guide)
-    db.commit()
-    db.refresh(guide)
+    await db.flush()
+    await refresh_guide_feed(db, Guide.guide_id == guide.guide_id)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE, guide.guide_id)
+    await db.commit()
+    # Server side defaults and the author are reloaded in one go, lazy loading isn't available
+    # once the async session hands the object over to the response serialization
+    guide = (await db.execute(select(Guide)
+                              .options(*guide_author_options)
+                              .where(Guide.guide_id == guide.guide_id)
+                              .execution_options(populate_existing=True))).scalar_one()
     return guide
 
 
@@ -173,42 +370,49 @@ async def get_cover_image(guide: Guide) -> str | None:
     return guide.cover_image
 
 
-async def save_cover_image(file: UploadFile, db: Session, guide: Guide) -> Guide:
+async def save_cover_image(file: UploadFile, db: AsyncSession, guide: Guide) -> Guide:
     """Check if cover image exists and create it if not. If it exists then do the update"""
+    return await set_cover_image(db, guide, await store_upload(db, file))
 
-    old_cover_image = guide.cover_image
 
-    file_path = cover_image_upload_path(str(guide.guide_id), file.filename)
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    finally:
-        file.file.close()
+async def confirm_cover_image_upload(token: str, db: AsyncSession, guide: Guide) -> Guide:
+    """Set the cover image to a file uploaded straight to the storage"""
+    return await set_cover_image(db, guide, await confirm_direct_upload(db, token, guide.user_id))
+
+
+async def set_cover_image(db: AsyncSession, guide: Guide, file_path: str) -> Guide:
+    """Point the cover image to a stored media path, the caller's reference to it is kept"""
+    old_cover_image = guide.cover_image
 
     guide.cover_image = file_path
+    await release_media(db, old_cover_image)
 
     db.add(guide)
-    db.commit()
-
-    if old_cover_image and os.path.exists(old_cover_image):
-        os.remove(old_cover_image)
+    await refresh_guide_feed(db, Guide.guide_id == guide.guide_id)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE, guide.guide_id)
+    await db.commit()
 
     return guide
 
 
-async def delete_cover_image(db: Session, guide: Guide) -> None:
+async def delete_cover_image(db: AsyncSession, guide: Guide) -> None:
     image = guide.cover_image
 
-    if image and os.path.exists(image):
-        os.remove(image)
     guide.cover_image = None
+    await release_media(db, image)
     db.add(guide)
-    db.commit()
+    await refresh_guide_feed(db, Guide.guide_id == guide.guide_id)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE, guide.guide_id)
+    await db.commit()
     return None
 
 
-async def delete_guide(db: Session, guide: Guide) -> None:
-    await delete_cover_image(db, guide)
-    db.delete(guide)
-    db.commit()
+async def delete_guide(db: AsyncSession, guide: Guide) -> None:
+    await release_media(db, guide.cover_image)
+    # guide_feed row is removed by the ON DELETE CASCADE foreign key
+    if guide.published:
+        await invalidate_on_commit(db, FEED_CACHE_NAMESPACE)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE, guide.guide_id)
+    await db.delete(guide)
+    await db.commit()
     return None
@@ -1,16 +1,34 @@
+import asyncio
+
 import uvicorn
 from fastapi import FastAPI
-from starlette.staticfiles import StaticFiles
 
-from config import ENVIRONMENT, SHOW_DOCS_ENVIRONMENT
+from config import ENVIRONMENT, SHOW_DOCS_ENVIRONMENT, DB_POOL_LOG_INTERVAL, \
+    EXPOSE_INTERNAL_METRICS, DB_REPLICA_HOST, FEED_CACHE_PREWARM_PAGES, CACHE_BUS_ENABLED, \
+    MAIL_OUTBOX_ENABLED, MEDIA_GC_INTERVAL, IMAGE_VARIANTS_ENABLED
 import core.service as core_service
 from auth import router as auth_router
-from core.constants import MEDIA_ROOT
+from auth.dependencies import check_token_settings
+from auth.hashing import password_hashing_pool
+from core import router as core_router, media_router
+from core.cache import listen_for_invalidations
+from core.images import image_variant_pool, build_variants_continuously
+from core.media import collect_media_garbage
+from core.middleware import ReadYourWritesMiddleware, CacheInvalidationMiddleware
+from core.pool import log_pool_status
+from database import engine, replica_engine, SessionLocal, ReplicaSessionLocal, \
+    DIRECT_DATABASE_DSN
 from guides import router as guides_router
+from guides.service import prewarm_feed_cache
 from users import router as users_router
+from users.service import profession_index
+from utils.mail.outbox import deliver_outbox
 
 app_configs = {'title': 'Guidio'}
 
+# Started on startup, cancelled on shutdown before the engines and process pools are closed
+background_tasks: list[asyncio.Task] = []
+
 if ENVIRONMENT not in SHOW_DOCS_ENVIRONMENT:
     app_configs['openapi_url'] = None
 
@@ -19,9 +37,20 @@ def is_debug() -> bool:
     return False if ENVIRONMENT != 'dev' else True
 
 
+def start_background_task(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    background_tasks.append(task)
+    return task
+
+
 app = FastAPI(**app_configs)
 core_service.create_media_root()
-app.mount("/media", StaticFiles(directory=MEDIA_ROOT), name="media")
+app.add_middleware(CacheInvalidationMiddleware)
+if DB_REPLICA_HOST:
+    app.add_middleware(ReadYourWritesMiddleware)
+app.include_router(media_router.router,
+                   prefix="/media",
+                   tags=["media"])
 app.include_router(auth_router.router,
                    prefix="/auth",
                    tags=["auth"])
@@ -31,6 +60,79 @@ app.include_router(users_router.router,
 app.include_router(guides_router.router,
                    prefix="/guides",
                    tags=["guides"])
+if EXPOSE_INTERNAL_METRICS:
+    app.include_router(core_router.router,
+                       prefix="/internal",
+                       tags=["internal"],
+                       include_in_schema=False)
+
+
+@app.on_event("startup")
+async def check_settings():
+    check_token_settings()
+
+
+@app.on_event("startup")
+async def start_password_hashing_pool():
+    await password_hashing_pool.start()
+
+
+@app.on_event("startup")
+async def start_pool_logging():
+    if DB_POOL_LOG_INTERVAL > 0:
+        app.state.pool_logger = start_background_task(log_pool_status(engine.pool,
+                                                                      DB_POOL_LOG_INTERVAL))
+
+
+@app.on_event("startup")
+async def start_cache_invalidation_listener():
+    if CACHE_BUS_ENABLED:
+        app.state.cache_listener = start_background_task(
+            listen_for_invalidations(DIRECT_DATABASE_DSN))
+
+
+@app.on_event("startup")
+async def start_mail_delivery():
+    if MAIL_OUTBOX_ENABLED:
+        app.state.mail_delivery = start_background_task(deliver_outbox(SessionLocal))
+
+
+@app.on_event("startup")
+async def start_media_garbage_collection():
+    if MEDIA_GC_INTERVAL > 0:
+        app.state.media_gc = start_background_task(collect_media_garbage(SessionLocal))
+
+
+@app.on_event("startup")
+async def start_image_variants():
+    if IMAGE_VARIANTS_ENABLED:
+        await image_variant_pool.start()
+        app.state.image_variants = start_background_task(
+            build_variants_continuously(SessionLocal))
+
+
+@app.on_event("startup")
+async def prewarm_caches():
+    async with ReplicaSessionLocal() as db:
+        await profession_index.load(db)
+    if FEED_CACHE_PREWARM_PAGES > 0:
+        # Shared cache is filled from the primary only, see can_fill_cache
+        async with SessionLocal() as db:
+            await prewarm_feed_cache(db, FEED_CACHE_PREWARM_PAGES)
+
+
+@app.on_event("shutdown")
+async def dispose_engine():
+    # Unfinished outbox and variant batches are picked up again once their leases run out
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    password_hashing_pool.shutdown()
+    image_variant_pool.shutdown()
+    await engine.dispose()
+    if replica_engine:
+        await replica_engine.dispose()
 
 
 def main():
@@ -0,0 +1,25 @@
+from enum import Enum
+
+from core.constants import CountStrategy
+
+# Count strategies per endpoint
+INSTRUCTORS_COUNT_STRATEGY = CountStrategy.window
+INSTRUCTOR_SEARCH_COUNT_STRATEGY = CountStrategy.window
+
+
+class SearchMode(str, Enum):
+    contains = "contains"
+    similarity = "similarity"
+
+
+# Minimum pg_trgm word similarity for a match in similarity mode
+SIMILARITY_THRESHOLD = 0.3
+
+# Maximum number of professions returned by the autocomplete
+PROFESSION_SEARCH_LIMIT = 20
+
+# Cache namespaces
+USER_CACHE_NAMESPACE = 'user'
+CURRENT_USER_CACHE_NAMESPACE = 'current_user'
+# Sent by the notify_profession_change trigger, keep in sync with migration 3b6f2d81c4e7
+PROFESSION_CACHE_NAMESPACE = 'profession'
@@ -1,34 +1,50 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Response, UploadFile, Query
+from fastapi import APIRouter, Depends, status, HTTPException, Request, Response, UploadFile, Query
 
 from auth.exceptions import invalid_credentials_exception
-from auth.service import get_current_active_user, verify_password
-from core.dependencies import DBDependency
+from auth.schemas import CurrentUserSchema
+from auth.service import get_current_active_user, verify_password, CurrentUserSnapshot
+from core.conditional import make_etag, conditional_response
+from core.dependencies import DBDependency, ReadDBDependency
 from core.exceptions import non_existent_page_exception
 from core.models import User
+from core.schemas import DirectUploadConfirmSchema
 from core.settings import AUTH_TOKEN
 from users import service, schemas
+from users.constants import SearchMode, PROFESSION_SEARCH_LIMIT
 
 router = APIRouter()
 
+SEARCH_MODE_QUERY = Query(default=SearchMode.contains,
+                          description="Search mode: contains/similarity. Similarity mode "
+                                      "tolerates typos and ranks the closest matches first")
+
 
 @router.get(path="/professions",
             description="Get professions based on search by name",
             response_model=list[schemas.ProfessionReadSchema])
 async def get_profession_by_name(name: str,
-                                 db=DBDependency):
-    professions = await service.get_professions_by_name(db, name)
+                                 mode: SearchMode = SEARCH_MODE_QUERY,
+                                 limit: int = Query(default=PROFESSION_SEARCH_LIMIT, ge=1, le=100,
+                                                    description="Maximum number of professions"),
+                                 db=ReadDBDependency):
+    professions = await service.get_professions_by_name(db, name, mode, limit)
     return professions
 
 
 @router.get(path="/instructors",
             description="Get list of users who are instructors",
             response_model=schemas.UserReadSchemaWithPages)
-async def get_instructors(page: int = Query(default=1, ge=1, description="Page to request"),
+async def get_instructors(request: Request,
+                          response: Response,
+                          page: int = Query(default=1, ge=1, description="Page to request"),
                           page_size: int = Query(default=50, ge=1, le=100, description="Page size"),
-                          db=DBDependency) -> schemas.UserReadSchemaWithPages:
+                          db=ReadDBDependency) -> schemas.UserReadSchemaWithPages:
     instructors = await service.get_paginated_instructors(db, page - 1, page_size)
     if page > instructors.pages:
         raise non_existent_page_exception()
+    not_modified = conditional_response(request, response, make_etag(instructors.model_dump_json()))
+    if not_modified:
+        return not_modified
     return instructors
 
 
@@ -37,17 +53,21 @@ async def get_instructors(page: int = Query(default=1, ge=1, description="Page t
             description="Retrieve instructors via search",
             response_model=schemas.UserReadSchemaWithPages)
 async def search_instructors(search: str,
+                             request: Request,
+                             response: Response,
                              page: int = Query(default=1, ge=1, description="Page to request"),
                              page_size: int = Query(default=50, ge=1, le=100,
                                                     description="Page size"),
-                             db=DBDependency):
-    total_pages = await service.get_number_of_instructors_from_search(db, search, page_size)
-    if page > total_pages:
+                             mode: SearchMode = SEARCH_MODE_QUERY,
+                             db=ReadDBDependency):
+    instructors = await service.search_instructors(db, search=search, page=page - 1,
+                                                   page_size=page_size, mode=mode)
+    if page > instructors.pages:
         raise non_existent_page_exception()
-    instructors = await service.get_paginated_instructors_by_search(db, page=page - 1,
-                                                                    page_size=page_size,
-                                                                    search=search)
-    return schemas.UserReadSchemaWithPages(pages=total_pages, users=instructors)
+    not_modified = conditional_response(request, response, make_etag(instructors.model_dump_json()))
+    if not_modified:
+        return not_modified
+    return instructors
 
 
 @router.get(path="/avatar",
@@ -82,6 +102,17 @@ async def update_avatar(file: UploadFile, db=DBDependency,
     return updated
 
 
+@router.put(path="/avatar/upload",
+            description="Set user avatar to a file uploaded with a signed upload from "
+                        "POST /media/uploads",
+            response_model=schemas.UserReadSchema,
+            status_code=status.HTTP_200_OK)
+async def confirm_avatar_upload(data: DirectUploadConfirmSchema, db=DBDependency,
+                              user: User = Depends(get_current_active_user)):
+    updated = await service.confirm_avatar_upload(data.upload_token, db, user)
+    return updated
+
+
 @router.delete(path="/avatar",
                description="Delete user avatar",
                status_code=status.HTTP_204_NO_CONTENT)
@@ -126,6 +157,17 @@ async def update_cover_image(file: UploadFile, db=DBDependency,
     return updated
 
 
+@router.put(path="/cover_image/upload",
+            description="Set user cover image to a file uploaded with a signed upload from "
+                        "POST /media/uploads",
+            response_model=schemas.UserReadSchema,
+            status_code=status.HTTP_200_OK)
+async def confirm_cover_image_upload(data: DirectUploadConfirmSchema, db=DBDependency,
+                                     user: User = Depends(get_current_active_user)):
+    updated = await service.confirm_cover_image_upload(data.upload_token, db, user)
+    return updated
+
+
 @router.delete(path="/cover_image",
                description="Delete user cover image",
                status_code=status.HTTP_204_NO_CONTENT)
@@ -141,8 +183,16 @@ async def delete_cover_image(db=DBDependency, user: User = Depends(get_current_a
 @router.get(path="/{user_id}",
             description="Get user profile by id",
             response_model=schemas.UserReadSchema)
-async def get_user_profile_by_id(user_id: int, db=DBDependency):
-    user = await service.get_user_profile_by_id(user_id, db)
+async def get_user_profile_by_id(user_id: int, request: Request, response: Response,
+                                 db=ReadDBDependency):
+    last_modified = await service.get_user_version(db, user_id)
+    if not last_modified:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    etag = make_etag("user", user_id, last_modified.isoformat())
+    not_modified = conditional_response(request, response, etag, last_modified)
+    if not_modified:
+        return not_modified
+    user = await service.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return user
@@ -160,15 +210,14 @@ async def update_user_profile(user_id: int, data: schemas.UserProfileUpdateSchem
         if not profession:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="Profession doesn't exist")
-    await service.update_user_profile(data, db, user)
-    return user
+    return await service.update_user_profile(data, db, user)
 
 
 @router.delete(path='/{user_id}',
                description="Delete user profile",
                status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user_profile(user_id: int, response: Response, db=DBDependency,
-                              user: User = Depends(get_current_active_user)):
+                              user: CurrentUserSchema = CurrentUserSnapshot):
     if not user or user_id != user.user_id:
         raise await invalid_credentials_exception()
     response.delete_cookie(AUTH_TOKEN)
@@ -89,6 +89,7 @@ class UserListReadSchema(BaseModelSchema):
     first_name: str
     last_name: str
     avatar: str | None
+    avatar_variants: dict[str, str] | None = None
     profession: str | None
 
 
@@ -1,71 +1,144 @@
-import os
-import shutil
+import asyncio
+import bisect
+import time
 from datetime import datetime
-from pathlib import Path
 
 from fastapi import UploadFile
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, func, desc, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
 
 from auth.service import get_password_hash
-from core.constants import MEDIA_ROOT
-from core.models import User, UserDetail, Profession, Guide
-from core.service import count_number_of_pages
+from config import DETAIL_CACHE_TTL, PROFESSION_INDEX_TTL
+from core.cache import cache_backend, can_fill_cache, invalidate_on_commit, \
+    register_invalidation_handler
+from core.media import store_upload, release_media, confirm_direct_upload
+from core.models import User, UserDetail, Profession, Guide, user_profile_options
+from core.service import count_number_of_pages, fetch_page
+from guides.constants import FEED_CACHE_NAMESPACE, GUIDE_CACHE_NAMESPACE
+from guides.service import refresh_guide_feed
+from users.constants import INSTRUCTORS_COUNT_STRATEGY, INSTRUCTOR_SEARCH_COUNT_STRATEGY, \
+    SearchMode, SIMILARITY_THRESHOLD, USER_CACHE_NAMESPACE, PROFESSION_CACHE_NAMESPACE, \
+    PROFESSION_SEARCH_LIMIT, CURRENT_USER_CACHE_NAMESPACE
 from users.schemas import UserProfileUpdateSchema, UserPasswordUpdateSchema, UserDetailUpdateSchema, \
-    UserReadSchemaWithPages
-
-
-async def get_instructors_by_search(db: Session, search: str):
-    return db.query(User).filter(or_(
-        User.first_name.ilike(f"%{search}%"),
-        User.last_name.ilike(f"%{search}%")
-    )).join(UserDetail).filter(UserDetail.is_instructor)
-
-
-async def get_paginated_instructors_by_search(db: Session, page: int, page_size: int, search: str):
+    UserReadSchemaWithPages, UserReadSchema, ProfessionReadSchema
+
+
+class ProfessionIndex:
+    """Profession codebook held in memory for autocomplete and id validation.
+
+    The codebook is small and almost static, so a sorted list of lowercase names answers prefix
+    queries by binary search and substring queries by a scan, without a database round trip.
+    Loaded on startup, reloaded lazily once stale (change notification or TTL).
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.expires = 0.0
+        self.by_id: dict[int, ProfessionReadSchema] = {}
+        # (lowercase name, profession) sorted by name
+        self.names: list[tuple[str, ProfessionReadSchema]] = []
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, key: str | None = None) -> None:
+        self.expires = 0.0
+
+    async def load(self, db: AsyncSession) -> None:
+        professions = (await db.execute(select(Profession))).scalars().all()
+        entries = [ProfessionReadSchema.model_validate(profession) for profession in professions]
+        # Replace both at once, readers never see a partially built index
+        self.by_id, self.names = {entry.profession_id: entry for entry in entries}, \
+            sorted(((entry.name.lower(), entry) for entry in entries), key=lambda entry: entry[0])
+        self.expires = time.monotonic() + self.ttl
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if self.expires > time.monotonic():
+            return
+        async with self._lock:
+            # Another request could have reloaded the index while this one waited
+            if self.expires <= time.monotonic():
+                await self.load(db)
+
+    async def get(self, db: AsyncSession, profession_id: int) -> ProfessionReadSchema | None:
+        await self.ensure_loaded(db)
+        return self.by_id.get(profession_id)
+
+    async def search(self, db: AsyncSession, name: str,
+                     limit: int = PROFESSION_SEARCH_LIMIT) -> list[ProfessionReadSchema]:
+        """Professions containing name, prefix matches first, then matches at the start of a
+        word, then the rest. Alphabetical within each group."""
+        await self.ensure_loaded(db)
+        query = name.strip().lower()
+        start = bisect.bisect_left(self.names, query, key=lambda entry: entry[0])
+        results = []
+        for lowered, entry in self.names[start:]:
+            if not lowered.startswith(query) or len(results) == limit:
+                break
+            results.append(entry)
+        if len(results) == limit:
+            return results
+        word_matches, other_matches = [], []
+        for lowered, entry in self.names:
+            position = lowered.find(query)
+            if position <= 0:
+                continue
+            if lowered[position - 1] in ' -/(':
+                word_matches.append(entry)
+            else:
+                other_matches.append(entry)
+        return (results + word_matches + other_matches)[:limit]
+
+
+profession_index = ProfessionIndex(ttl=PROFESSION_INDEX_TTL)
+register_invalidation_handler(PROFESSION_CACHE_NAMESPACE, profession_index.invalidate)
+
+
+async def mark_user_profile_changed(db: AsyncSession, user_id: int) -> None:
+    """Bump the profile version used as HTTP validator, user_details changes don't update the
+    user row by themselves. Drop cached profile and authenticated user snapshot on commit,
+    together with cached guides which embed the author."""
+    await db.execute(update(User)
+                     .where(User.user_id == user_id)
+                     .values(last_modified=func.current_timestamp())
+                     .execution_options(synchronize_session=False))
+    await invalidate_on_commit(db, USER_CACHE_NAMESPACE, user_id)
+    await invalidate_on_commit(db, CURRENT_USER_CACHE_NAMESPACE, user_id)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE)
+
+
+async def set_similarity_threshold(db: AsyncSession) -> None:
+    """Set word similarity threshold used by the index supported <% operator, for the current
+    transaction only"""
+    await db.execute(select(func.set_config('pg_trgm.word_similarity_threshold',
+                                            str(SIMILARITY_THRESHOLD), True)))
+
+
+async def get_instructors_by_search(db: AsyncSession, search: str,
+                                    mode: SearchMode = SearchMode.contains) -> Select:
+    instructors = select(User).join(UserDetail).where(UserDetail.is_instructor)
+    if mode == SearchMode.similarity:
+        # Trigram matching tolerates typos and full name queries like "john bro"
+        await set_similarity_threshold(db)
+        # <% and || share precedence in Postgres, without parentheses <% binds to first_name
+        return instructors.where(literal(search).op('<%')(User.full_name.self_group())) \
+            .order_by(desc(func.word_similarity(search, User.full_name)), User.user_id)
+    return instructors.where(User.full_name.ilike(f"%{search}%")).order_by(User.user_id)
+
+
+async def search_instructors(db: AsyncSession, search: str, page: int, page_size: int,
+                             mode: SearchMode = SearchMode.contains) -> UserReadSchemaWithPages:
+    """Return page of instructors matching the search together with number of pages. Total is
+    counted by the database in the same statement, so memory use is bound by page size no
+    matter how many instructors match."""
     offset: int = page * page_size
-    instructors_from_search = await get_instructors_by_search(db, search)
-    return instructors_from_search.offset(offset).limit(page_size).all()
-
-
-async def get_number_of_instructors_from_search(db: Session,
-                                                search: str,
-                                                page_size: int):
-    instructors_from_search = await get_instructors_by_search(db, search)
-    count_of_instructors = len(instructors_from_search.all())
-    division: tuple[int, int] = divmod(count_of_instructors, page_size)
-    pages: int = division[0] + 1 if division[1] else division[0]
-    return pages
-
-
-async def create_upload_path(directory: str, filename: str):
-    if not os.path.exists(directory):
-        Path(directory).mkdir(parents=True, exist_ok=True)
-    if not os.path.exists(directory + filename):
-        filename_parts = filename.split(".")
-        timestamp = str(int(datetime.now().timestamp()))
-        filename = "".join(filename_parts[:-1]) + "_" + timestamp + "." + filename_parts[-1]
-    open(f'{directory}{filename}', 'wb').close()
-    return directory + filename
-
-
-async def avatar_upload_path(first_name: str, last_name: str, filename: str):
-    user_name = first_name + "_" + last_name
-    directory = f"{MEDIA_ROOT}/users/{user_name}/avatar/"
-
-    path = await create_upload_path(directory, filename)
-    path_to_save = 'media' + path.split('media')[1]
-
-    return path_to_save
-
-
-async def cover_image_upload_path(first_name: str, last_name: str, filename: str):
-    user_name = first_name + "_" + last_name
-    directory = f"{MEDIA_ROOT}/users/{user_name}/cover_image/"
-
-    path = await create_upload_path(directory, filename)
-    path_to_save = 'media' + path.split('media')[1]
-    return path_to_save
+    instructors_from_search = await get_instructors_by_search(db, search, mode)
+    rows, count_of_instructors = await fetch_page(db,
+                                                  instructors_from_search
+                                                  .options(*user_profile_options),
+                                                  offset, page_size,
+                                                  INSTRUCTOR_SEARCH_COUNT_STRATEGY)
+    pages: int = await count_number_of_pages(count_of_instructors, page_size)
+    return UserReadSchemaWithPages(pages=pages, users=[row[0] for row in rows])
 
 
 async def get_avatar(user: User) -> str | None:
@@ -74,37 +147,40 @@ async def get_avatar(user: User) -> str | None:
     return user.user_details.avatar
 
 
-async def save_avatar(file: UploadFile, db: Session, user: User) -> User:
+async def save_avatar(file: UploadFile, db: AsyncSession, user: User) -> User:
     """Check if avatar exists and create it if not. If it exists then do the update"""
+    return await set_avatar(db, user, await store_upload(db, file))
 
-    old_user_avatar = user.user_details.avatar
 
-    file_path = await avatar_upload_path(user.first_name, user.last_name, file.filename)
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    finally:
-        file.file.close()
+async def confirm_avatar_upload(token: str, db: AsyncSession, user: User) -> User:
+    """Set the avatar to a file uploaded straight to the storage"""
+    return await set_avatar(db, user, await confirm_direct_upload(db, token, user.user_id))
+
+
+async def set_avatar(db: AsyncSession, user: User, file_path: str) -> User:
+    """Point the avatar to a stored media path, the caller's reference to it is kept"""
+    old_user_avatar = user.user_details.avatar
 
     user.user_details.avatar = file_path
+    await release_media(db, old_user_avatar)
 
     db.add(user)
-    db.commit()
-
-    if old_user_avatar and os.path.exists(old_user_avatar):
-        os.remove(old_user_avatar)
+    await refresh_guide_feed(db, Guide.user_id == user.user_id)
+    await mark_user_profile_changed(db, user.user_id)
+    await db.commit()
 
     return user
 
 
-async def delete_avatar(db: Session, user: User):
+async def delete_avatar(db: AsyncSession, user: User):
     avatar = user.user_details.avatar
 
-    if os.path.exists(avatar):
-        os.remove(avatar)
     user.user_details.avatar = None
+    await release_media(db, avatar)
     db.add(user)
-    db.commit()
+    await refresh_guide_feed(db, Guide.user_id == user.user_id)
+    await mark_user_profile_changed(db, user.user_id)
+    await db.commit()
     return None
 
 
@@ -114,68 +190,107 @@ async def get_cover_image(user: User) -> str | None:
     return user.user_details.cover_image
 
 
-async def save_cover_image(file: UploadFile, db: Session, user: User) -> User:
+async def save_cover_image(file: UploadFile, db: AsyncSession, user: User) -> User:
     """Check if cover image exists and create it if not. If it exists then do the update"""
+    return await set_cover_image(db, user, await store_upload(db, file))
 
-    old_cover_image = user.user_details.cover_image
 
-    file_path = await cover_image_upload_path(user.first_name, user.last_name, file.filename)
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    finally:
-        file.file.close()
+async def confirm_cover_image_upload(token: str, db: AsyncSession, user: User) -> User:
+    """Set the cover image to a file uploaded straight to the storage"""
+    return await set_cover_image(db, user, await confirm_direct_upload(db, token, user.user_id))
+
+
+async def set_cover_image(db: AsyncSession, user: User, file_path: str) -> User:
+    """Point the cover image to a stored media path, the caller's reference to it is kept"""
+    old_cover_image = user.user_details.cover_image
 
     user.user_details.cover_image = file_path
+    await release_media(db, old_cover_image)
 
     db.add(user)
-    db.commit()
-
-    if old_cover_image and os.path.exists(old_cover_image):
-        os.remove(old_cover_image)
+    await mark_user_profile_changed(db, user.user_id)
+    await db.commit()
 
     return user
 
 
-async def delete_cover_image(db: Session, user: User):
+async def delete_cover_image(db: AsyncSession, user: User):
     image = user.user_details.cover_image
 
-    if os.path.exists(image):
-        os.remove(image)
     user.user_details.cover_image = None
+    await release_media(db, image)
     db.add(user)
-    db.commit()
+    await mark_user_profile_changed(db, user.user_id)
+    await db.commit()
     return None
 
 
-async def get_paginated_instructors(db: Session, offset, limit) -> UserReadSchemaWithPages:
+async def get_paginated_instructors(db: AsyncSession, offset, limit) -> UserReadSchemaWithPages:
     offset: int = offset * limit
-    all_instructors = db.query(User).join(User.user_details) \
-        .filter(UserDetail.is_instructor)
-    paginated_instructors: list[User] = all_instructors.offset(offset).limit(limit).all()
-    count_of_instructors: int = all_instructors.count()
+    all_instructors = select(User).join(User.user_details) \
+        .where(UserDetail.is_instructor) \
+        .options(*user_profile_options) \
+        .order_by(User.user_id)
+    rows, count_of_instructors = await fetch_page(db, all_instructors, offset, limit,
+                                                  INSTRUCTORS_COUNT_STRATEGY)
+    paginated_instructors: list[User] = [row[0] for row in rows]
     pages: int = await count_number_of_pages(count_of_instructors, limit)
     return UserReadSchemaWithPages(pages=pages, users=paginated_instructors)
 
 
-async def get_profession_by_id(db: Session, profession_id: int) -> Profession | None:
-    profession = db.query(Profession).get(profession_id)
-    return profession
+async def get_profession_by_id(db: AsyncSession,
+                               profession_id: int) -> ProfessionReadSchema | None:
+    return await profession_index.get(db, profession_id)
 
 
-async def get_professions_by_name(db: Session, name: str) -> list[Profession]:
-    professions = db.query(Profession).filter(Profession.name.ilike(f'%{name}%')).all()
-    return professions
+async def get_professions_by_name(db: AsyncSession, name: str,
+                                  mode: SearchMode = SearchMode.contains,
+                                  limit: int = PROFESSION_SEARCH_LIMIT) \
+        -> list[Profession | ProfessionReadSchema]:
+    if mode == SearchMode.similarity:
+        await set_similarity_threshold(db)
+        statement = select(Profession) \
+            .where(literal(name).op('<%')(Profession.name)) \
+            .order_by(desc(func.word_similarity(name, Profession.name)), Profession.name) \
+            .limit(limit)
+        professions = (await db.execute(statement)).scalars().all()
+        return professions
+    return await profession_index.search(db, name, limit)
 
 
-async def get_user_profile_by_id(user_id: int, db: Session) -> User | None:
-    user = db.query(User).get(user_id)
+async def get_user_profile_by_id(user_id: int, db: AsyncSession,
+                                 populate_existing: bool = False) -> User | None:
+    user = await db.get(User, user_id, options=user_profile_options,
+                        populate_existing=populate_existing)
     return user
 
 
-async def update_user_details(data: UserDetailUpdateSchema, db: Session, db_user: User):
-    user_detail: UserDetail = db.query(UserDetail) \
-        .filter(UserDetail.user_id == db_user.user_id).first()
+async def get_user_version(db: AsyncSession, user_id: int) -> datetime | None:
+    """Profile version used as HTTP validator, see mark_user_profile_changed"""
+    return await db.scalar(select(User.last_modified).where(User.user_id == user_id))
+
+
+async def get_user_profile(db: AsyncSession, user_id: int) -> UserReadSchema | None:
+    """Read-only user profile, served from the cache backend when possible"""
+    cached = await cache_backend.get(USER_CACHE_NAMESPACE, str(user_id))
+    if cached is not None:
+        return UserReadSchema.model_validate_json(cached)
+    generation = await cache_backend.generation(USER_CACHE_NAMESPACE)
+    user = await get_user_profile_by_id(user_id, db)
+    if not user:
+        return None
+    profile = UserReadSchema.model_validate(user)
+    if can_fill_cache(db):
+        await cache_backend.set(USER_CACHE_NAMESPACE, str(user_id), profile.model_dump_json(),
+                                generation, DETAIL_CACHE_TTL)
+    return profile
+
+
+async def update_user_details(data: UserDetailUpdateSchema, db: AsyncSession, db_user: User):
+    """Runs in the caller's transaction, see update_user_profile"""
+    user_detail: UserDetail = (await db.execute(select(UserDetail)
+                                                .where(UserDetail.user_id == db_user.user_id))) \
+        .scalars().first()
     if user_detail:
         user_detail.linkedin = data.linkedin
         user_detail.github = data.github
@@ -192,11 +307,10 @@ async def update_user_details(data: UserDetailUpdateSchema, db: Session, db_user
                                      bio=data.bio,
                                      profession_id=data.profession_id)
         db.add(new_user_detail)
-    db.commit()
 
 
 async def update_user_profile(data: UserProfileUpdateSchema,
-                              db: Session, db_user: User) -> User:
+                              db: AsyncSession, db_user: User) -> User:
     db_user.email = data.email
     db_user.first_name = data.first_name
     db_user.last_name = data.last_name
@@ -204,28 +318,42 @@ async def update_user_profile(data: UserProfileUpdateSchema,
     await update_user_details(data.user_details, db, db_user)
     # Update guides if is_instructor is set to false
     if not data.user_details.is_instructor:
-        guides = db.query(Guide).filter(Guide.user_id == db_user.user_id).all()
-        if guides:
-            for guide in guides:
-                guide.published = False
-
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-
-async def delete_user_profile(db: Session, user_id: int) -> None:
-    user: User = db.query(User).get(user_id)
-    db.delete(user)
-    db.commit()
+        await db.execute(update(Guide)
+                         .where(Guide.user_id == db_user.user_id)
+                         .values(published=False)
+                         .execution_options(synchronize_session=False))
+
+    await refresh_guide_feed(db, Guide.user_id == db_user.user_id)
+    await mark_user_profile_changed(db, db_user.user_id)
+    await db.commit()
+    # Reload details as the profession could have changed
+    return await get_user_profile_by_id(db_user.user_id, db, populate_existing=True)
+
+
+async def delete_user_profile(db: AsyncSession, user_id: int) -> None:
+    user: User = await db.get(User, user_id)
+    # Details and guides are removed by ON DELETE CASCADE, release their images first
+    images = await db.execute(select(UserDetail.avatar, UserDetail.cover_image)
+                              .where(UserDetail.user_id == user_id))
+    guide_images = await db.scalars(select(Guide.cover_image)
+                                    .where(Guide.user_id == user_id,
+                                           Guide.cover_image.isnot(None)))
+    await release_media(db, *(images.first() or ()), *guide_images.all())
+    # Author's guide_feed rows are removed by the ON DELETE CASCADE foreign key
+    await invalidate_on_commit(db, FEED_CACHE_NAMESPACE)
+    await invalidate_on_commit(db, GUIDE_CACHE_NAMESPACE)
+    await invalidate_on_commit(db, USER_CACHE_NAMESPACE, user_id)
+    await invalidate_on_commit(db, CURRENT_USER_CACHE_NAMESPACE, user_id)
+    await db.delete(user)
+    await db.commit()
     return None
 
 
-async def update_user_password(db: Session,
+async def update_user_password(db: AsyncSession,
                                data: UserPasswordUpdateSchema,
                                user: User) -> tuple[User, UserDetail]:
     hashed_password = await get_password_hash(data.password)
     user.password = hashed_password
-    db.commit()
-    db.refresh(user)
+    await invalidate_on_commit(db, CURRENT_USER_CACHE_NAMESPACE, user.user_id)
+    await db.commit()
     return user
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import Any, Dict
+
+import aiosmtplib
+from sqlalchemy import select, update, func, event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import MAIL_OUTBOX_BATCH_SIZE, MAIL_OUTBOX_POLL_INTERVAL, MAIL_OUTBOX_LEASE_SECONDS, \
+    MAIL_MAX_ATTEMPTS, MAIL_RETRY_BASE_SECONDS, MAIL_RETRY_MAX_SECONDS
+from core.constants import MailStatus
+from core.models import MailOutbox
+from utils.mail.send_mail import conf
+
+# Key of the session info flag set when a transaction adds emails to the outbox
+MAIL_ENQUEUED = 'mail_enqueued'
+
+# Wakes the delivery worker of this process up once queued emails are committed
+outbox_wakeup = asyncio.Event()
+
+
+@event.listens_for(Session, "after_commit")
+def wake_up_delivery(session: Session) -> None:
+    if session.info.pop(MAIL_ENQUEUED, False):
+        outbox_wakeup.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_enqueued(session: Session) -> None:
+    session.info.pop(MAIL_ENQUEUED, None)
+
+
+async def enqueue_mail(db: AsyncSession, recipient: str, subject: str, body: Dict[str, Any],
+                       template_name: str, dedup_key: str | None = None) -> None:
+    """Add email to the outbox in the caller's transaction, nothing is sent before commit.
+    Email with the same dedup_key as a pending one is dropped."""
+    statement = insert(MailOutbox).values(recipient=recipient,
+                                          subject=subject,
+                                          body=body,
+                                          template_name=template_name,
+                                          dedup_key=dedup_key,
+                                          status=MailStatus.pending.value,
+                                          attempts=0)
+    if dedup_key:
+        statement = statement.on_conflict_do_nothing(
+            index_elements=[MailOutbox.dedup_key],
+            index_where=MailOutbox.status == MailStatus.pending.value)
+    await db.execute(statement)
+    db.sync_session.info[MAIL_ENQUEUED] = True
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with jitter, capped at MAIL_RETRY_MAX_SECONDS"""
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def render_message(mail: Row) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = conf.MAIL_FROM
+    message["To"] = mail.recipient
+    message["Subject"] = mail.subject
+    html = conf.template_engine().get_template(mail.template_name).render(**mail.body)
+    message.set_content(html, subtype="html")
+    return message
+
+
+class SMTPDelivery:
+    """SMTP connection reused by consecutive emails, reopened after errors"""
+
+    def __init__(self):
+        self.client: aiosmtplib.SMTP | None = None
+
+    async def connect(self) -> aiosmtplib.SMTP:
+        if self.client is not None and self.client.is_connected:
+            return self.client
+        self.client = aiosmtplib.SMTP(hostname=conf.MAIL_SERVER,
+                                      port=int(conf.MAIL_PORT),
+                                      use_tls=bool(conf.MAIL_SSL_TLS),
+                                      start_tls=bool(conf.MAIL_STARTTLS),
+                                      validate_certs=bool(conf.VALIDATE_CERTS))
+        await self.client.connect()
+        if conf.USE_CREDENTIALS:
+            await self.client.login(conf.MAIL_USERNAME, conf.MAIL_PASSWORD.get_secret_value())
+        return self.client
+
+    async def send(self, message: EmailMessage) -> None:
+        if conf.SUPPRESS_SEND:
+            return
+        client = await self.connect()
+        try:
+            await client.send_message(message)
+        except (aiosmtplib.SMTPServerDisconnected, OSError):
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        if self.client is not None and self.client.is_connected:
+            try:
+                await self.client.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                self.client.close()
+        self.client = None
+
+
+async def claim_batch(db: AsyncSession, batch_size: int) -> list[Row]:
+    """Lease due emails, other workers skip them until the lease runs out. The lease keeps
+    an email from being lost if this worker dies between sending and recording the result."""
+    due = select(MailOutbox.mail_id) \
+        .where(MailOutbox.status == MailStatus.pending.value,
+               MailOutbox.next_attempt_at <= func.now()) \
+        .order_by(MailOutbox.next_attempt_at) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True)
+    claimed = await db.execute(update(MailOutbox)
+                               .where(MailOutbox.mail_id.in_(due.scalar_subquery()))
+                               .values(next_attempt_at=func.now()
+                                       + timedelta(seconds=MAIL_OUTBOX_LEASE_SECONDS),
+                                       attempts=MailOutbox.attempts + 1)
+                               .returning(MailOutbox.mail_id,
+                                          MailOutbox.recipient,
+                                          MailOutbox.subject,
+                                          MailOutbox.template_name,
+                                          MailOutbox.body,
+                                          MailOutbox.attempts)
+                               .execution_options(synchronize_session=False))
+    mails = claimed.all()
+    await db.commit()
+    return mails
+
+
+async def deliver_batch(db: AsyncSession, smtp: SMTPDelivery, batch_size: int) -> int:
+    """Send one batch over a shared SMTP connection and record the results, return the number
+    of claimed emails"""
+    mails = await claim_batch(db, batch_size)
+    for mail in mails:
+        try:
+            await smtp.send(render_message(mail))
+        except Exception as e:
+            logging.error(f"Error sending email {mail.mail_id}: {str(e)}")
+            values = {"last_error": str(e)}
+            if mail.attempts >= MAIL_MAX_ATTEMPTS:
+                values["status"] = MailStatus.failed.value
+            else:
+                values["next_attempt_at"] = datetime.now(timezone.utc) + retry_delay(mail.attempts)
+        else:
+            values = {"status": MailStatus.sent.value, "sent_at": func.now(), "last_error": None}
+        await db.execute(update(MailOutbox)
+                         .where(MailOutbox.mail_id == mail.mail_id)
+                         .values(**values)
+                         .execution_options(synchronize_session=False))
+        await db.commit()
+    return len(mails)
+
+
+async def deliver_outbox(session_factory, batch_size: int = MAIL_OUTBOX_BATCH_SIZE,
+                         poll_interval: float = MAIL_OUTBOX_POLL_INTERVAL) -> None:
+    """Deliver queued emails until cancelled, meant to run as a background task of every
+    worker. Emails committed by this process are picked up immediately, the poll interval
+    covers other processes and retries."""
+    smtp = SMTPDelivery()
+    try:
+        while True:
+            outbox_wakeup.clear()
+            try:
+                async with session_factory() as db:
+                    claimed = await deliver_batch(db, smtp, batch_size)
+            except Exception as e:
+                logging.error(f"Mail outbox delivery error: {str(e)}")
+                claimed = 0
+            if claimed == batch_size:
+                continue
+            await smtp.close()
+            try:
+                await asyncio.wait_for(outbox_wakeup.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await smtp.close()
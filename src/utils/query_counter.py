@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class QueryCounter:
+    """Collect SQL statements executed by the engine while active"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine.sync_engine
+        self.statements: list[str] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute", self)
+
+
+@contextmanager
+def assert_max_queries(engine: AsyncEngine, expected: int):
+    """Fail if the block executes more than expected statements, used to catch N+1 queries
+
+    Example:
+        with assert_max_queries(engine, 2):
+            client.get("/users/instructors")
+    """
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count > expected:
+        executed = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {expected} statements, {counter.count} were "
+                             f"executed:\n{executed}")
@@ -0,0 +1,192 @@
+"""Tests run against their own databases on the PostgreSQL server configured by DB_USER, DB_PASS,
+DB_HOST and DB_PORT: TEST_DB_NAME (default guidio_test) and TEST_DB_REPLICA_NAME (default
+guidio_test_replica). They are created and migrated on the first run and emptied after every
+test, the database in DB_NAME isn't touched. Tests needing the databases are skipped when the
+server isn't reachable.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+
+# Settings are read on import of the application modules, override them first
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "guidio_test")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("TOKEN_EXP_MINUTES", "30")
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["STORAGE_BACKEND"] = "local"
+# Empty counts as unset and keeps the value in .env from being loaded
+os.environ["DB_REPLICA_HOST"] = ""
+
+import asyncpg  # noqa: E402
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from auth.dependencies import verified_tokens  # noqa: E402
+from auth.service import create_auth_token  # noqa: E402
+from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME  # noqa: E402
+from core import media  # noqa: E402
+from core.cache import cache_backend, invalidation_handlers, invalidate_local  # noqa: E402
+from core.models import Base, User, UserDetail  # noqa: E402
+from core.service import count_cache  # noqa: E402
+from core.settings import AUTH_TOKEN, REPLICA_SESSION  # noqa: E402
+from database import SessionLocal, create_engine_from_config  # noqa: E402
+from guides import service as guides_service  # noqa: E402
+from guides.schemas import GuideCreateUpdateSchema  # noqa: E402
+from main import app  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPLICA_DB_NAME = os.environ.get("TEST_DB_REPLICA_NAME", "guidio_test_replica")
+# Professions are seeded by a migration and only read by the application
+KEPT_TABLES = ("profession",)
+
+
+def database_url(name: str, driver: str = "asyncpg") -> str:
+    return f"postgresql+{driver}://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{name}"
+
+
+async def create_database(name: str) -> None:
+    connection = await asyncpg.connect(user=DB_USER, password=DB_PASS, host=DB_HOST,
+                                       port=DB_PORT, database="postgres")
+    try:
+        exists = await connection.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", name)
+        if not exists:
+            await connection.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await connection.close()
+
+
+def migrate_database(name: str) -> None:
+    # In a separate process, migrations import the models under another module name
+    python_path = os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, "src")])
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT_DIR,
+                   env={**os.environ, "DB_NAME": name, "PYTHONPATH": python_path},
+                   check=True, capture_output=True)
+
+
+async def empty_database(session_factory) -> None:
+    tables = ", ".join(f'"{table.name}"' for table in Base.metadata.sorted_tables
+                       if table.name not in KEPT_TABLES)
+    async with session_factory() as db:
+        await db.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        await db.commit()
+
+
+def reset_caches() -> None:
+    for namespace in list(getattr(cache_backend, 'namespaces', ())) + list(invalidation_handlers):
+        invalidate_local(namespace)
+    count_cache.clear()
+    verified_tokens.clear()
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    # Connection pools of the application engines belong to the loop that opened them
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+async def test_databases():
+    """Create and migrate the test databases once per run"""
+    try:
+        for name in (DB_NAME, REPLICA_DB_NAME):
+            await create_database(name)
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"PostgreSQL test server isn't available: {e}")
+    for name in (DB_NAME, REPLICA_DB_NAME):
+        migrate_database(name)
+
+
+@pytest.fixture
+async def database(test_databases):
+    """Empty migrated test database, the application's SessionLocal is bound to it"""
+    reset_caches()
+    yield SessionLocal
+    await empty_database(SessionLocal)
+    reset_caches()
+
+
+@pytest.fixture
+async def db(database):
+    async with database() as session:
+        yield session
+
+
+@pytest.fixture(scope="session")
+async def replica_session_factory(test_databases):
+    engine = create_engine_from_config(database_url(REPLICA_DB_NAME))
+    yield sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False,
+                       info={REPLICA_SESSION: True})
+    await engine.dispose()
+
+
+@pytest.fixture
+async def replica(database, replica_session_factory):
+    """Second database standing in for a read replica, emptied after the test"""
+    yield replica_session_factory
+    await empty_database(replica_session_factory)
+
+
+@pytest.fixture
+async def client(database):
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def create_user(db):
+    """Create an active user with details, returns the user"""
+    counter = 0
+
+    async def create(first_name: str = "John", last_name: str = "Doe",
+                     is_instructor: bool = False, session: AsyncSession | None = None,
+                     user_id: int | None = None) -> User:
+        nonlocal counter
+        counter += 1
+        session = session or db
+        user = User(first_name=first_name, last_name=last_name,
+                    email=f"user{counter}@guidio.com", password="not-a-hash", is_active=True)
+        if user_id is not None:
+            user.user_id = user_id
+        session.add(user)
+        await session.flush()
+        session.add(UserDetail(user_id=user.user_id, is_instructor=is_instructor))
+        await session.commit()
+        return user
+
+    return create
+
+
+@pytest.fixture
+def log_in():
+    """Authenticate the client's following requests as the user"""
+    async def log_in(client: httpx.AsyncClient, user: User) -> None:
+        client.cookies.set(AUTH_TOKEN, await create_auth_token(user.user_id))
+
+    return log_in
+
+
+@pytest.fixture
+def publish_guide(db, create_user):
+    """Publish a guide of a new instructor, returns the guide"""
+    async def publish(title: str = "Guide"):
+        user = await create_user(is_instructor=True)
+        data = GuideCreateUpdateSchema(title=title, content="Content", note=None, published=True)
+        return await guides_service.save_guide(db, data, user.user_id)
+
+    return publish
+
+
+@pytest.fixture
+def media_store(tmp_path, monkeypatch):
+    """Uploads are stored under tmp_path instead of MEDIA_ROOT, returns the store directory"""
+    store = os.path.join(tmp_path, "store")
+    monkeypatch.setattr(media, "MEDIA_STORE_ROOT", store)
+    monkeypatch.setattr(media, "MEDIA_UPLOAD_DIR", os.path.join(store, "incoming"))
+    return store
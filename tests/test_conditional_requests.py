@@ -0,0 +1,93 @@
+from datetime import timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+
+import pytest
+
+from guides import service
+from guides.schemas import GuideCreateUpdateSchema
+
+
+@pytest.fixture
+async def guide(client, db, create_user, log_in):
+    """Published guide, the client is logged in as its author"""
+    user = await create_user(is_instructor=True)
+    await log_in(client, user)
+    data = GuideCreateUpdateSchema(title="Guide", content="Content", note=None, published=True)
+    return await service.save_guide(db, data, user.user_id)
+
+
+async def test_guide_has_validators(client, guide):
+    response = await client.get(f"/guides/guide/{guide.guide_id}")
+
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('"')
+    assert "last-modified" in response.headers
+    assert response.headers["cache-control"] == "private, no-cache"
+
+
+@pytest.mark.parametrize("weak", [False, True])
+async def test_guide_matching_if_none_match_is_not_modified(client, guide, weak):
+    etag = (await client.get(f"/guides/guide/{guide.guide_id}")).headers["etag"]
+
+    response = await client.get(f"/guides/guide/{guide.guide_id}",
+                                headers={"If-None-Match": f"W/{etag}" if weak else etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+async def test_updated_guide_doesnt_match_old_etag(client, guide):
+    etag = (await client.get(f"/guides/guide/{guide.guide_id}")).headers["etag"]
+
+    updated = await client.put(f"/guides/{guide.guide_id}",
+                               json={"title": "Updated", "content": "Content", "note": None,
+                                     "published": True})
+    assert updated.status_code == 201
+
+    response = await client.get(f"/guides/guide/{guide.guide_id}",
+                                headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Updated"
+    assert response.headers["etag"] != etag
+
+
+async def test_profile_not_modified_since_last_modified(client, create_user):
+    user = await create_user()
+    first = await client.get(f"/users/{user.user_id}")
+
+    response = await client.get(f"/users/{user.user_id}",
+                                headers={"If-Modified-Since": first.headers["last-modified"]})
+
+    assert response.status_code == 304
+
+
+async def test_profile_modified_since_earlier_date(client, create_user):
+    user = await create_user()
+    last_modified = parsedate_to_datetime(
+        (await client.get(f"/users/{user.user_id}")).headers["last-modified"])
+
+    since = format_datetime(last_modified - timedelta(seconds=1), usegmt=True)
+    response = await client.get(f"/users/{user.user_id}", headers={"If-Modified-Since": since})
+
+    assert response.status_code == 200
+
+
+async def test_if_none_match_takes_precedence_over_if_modified_since(client, create_user):
+    user = await create_user()
+    first = await client.get(f"/users/{user.user_id}")
+
+    response = await client.get(f"/users/{user.user_id}",
+                                headers={"If-None-Match": '"other"',
+                                         "If-Modified-Since": first.headers["last-modified"]})
+
+    assert response.status_code == 200
+
+
+async def test_feed_matching_if_none_match_is_not_modified(client, publish_guide):
+    await publish_guide()
+    etag = (await client.get("/guides")).headers["etag"]
+
+    response = await client.get("/guides", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
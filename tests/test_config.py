@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+from dotenv import dotenv_values
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DUMP_SETTINGS = """
+import json, config
+print(json.dumps({name: value for name, value in vars(config).items()
+                  if name.isupper() and isinstance(value, (str, int, float, bool))}))
+"""
+
+
+def load_settings(environment: dict) -> dict:
+    # Settings are read on import, a fresh interpreter reads them from the given environment
+    python_path = os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, "src")])
+    output = subprocess.run([sys.executable, "-c", DUMP_SETTINGS], cwd=ROOT_DIR,
+                            env={"PATH": os.environ.get("PATH", ""), "PYTHONPATH": python_path,
+                                 **environment},
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_env_example_placeholders_keep_defaults():
+    example = dotenv_values(os.path.join(ROOT_DIR, ".env.example"))
+    # Empty values keep a local .env from filling the settings in, settings without a default
+    # come out empty and aren't compared
+    unset = load_settings({name: "" for name in example})
+    defaults = {name: value for name, value in unset.items() if value != ""}
+
+    settings = load_settings(example)
+
+    assert defaults
+    assert {name: settings.get(name) for name in defaults} == defaults
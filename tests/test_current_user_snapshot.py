@@ -0,0 +1,50 @@
+import pytest
+from fastapi import HTTPException
+
+from auth.service import create_auth_token, get_current_user_snapshot
+from core.cache import cache_backend
+from users import service
+from users.constants import CURRENT_USER_CACHE_NAMESPACE
+from users.schemas import UserPasswordUpdateSchema
+
+
+@pytest.fixture
+async def user_with_snapshot(db, create_user):
+    """User whose snapshot is in the cache, returns the user and its token"""
+    user = await create_user()
+    token = await create_auth_token(user.user_id)
+    await get_current_user_snapshot(token, db)
+    assert await cache_backend.get(CURRENT_USER_CACHE_NAMESPACE, str(user.user_id)) is not None
+    return user, token
+
+
+async def test_cached_snapshot_doesnt_touch_the_database(db, user_with_snapshot, monkeypatch):
+    user, token = user_with_snapshot
+
+    async def execute(*args, **kwargs):
+        raise AssertionError("Snapshot was read from the database")
+
+    monkeypatch.setattr(db, "execute", execute)
+    snapshot = await get_current_user_snapshot(token, db)
+
+    assert snapshot.user_id == user.user_id
+
+
+async def test_password_update_invalidates_snapshot(db, user_with_snapshot):
+    user, _ = user_with_snapshot
+
+    await service.update_user_password(
+        db, UserPasswordUpdateSchema(current_password="MyPa$$123!", password="NewPa$$123!"), user)
+
+    assert await cache_backend.get(CURRENT_USER_CACHE_NAMESPACE, str(user.user_id)) is None
+
+
+async def test_deleted_user_snapshot_isnt_served(db, user_with_snapshot):
+    user, token = user_with_snapshot
+
+    await service.delete_user_profile(db, user.user_id)
+
+    assert await cache_backend.get(CURRENT_USER_CACHE_NAMESPACE, str(user.user_id)) is None
+    with pytest.raises(HTTPException) as error:
+        await get_current_user_snapshot(token, db)
+    assert error.value.status_code == 401
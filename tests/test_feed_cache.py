@@ -0,0 +1,42 @@
+from core.cache import MemoryCacheBackend
+from guides import service
+
+
+async def test_memory_backend_is_bounded_by_encoded_size():
+    backend = MemoryCacheBackend(max_bytes=8)
+    generation = await backend.generation("feed")
+
+    await backend.set("feed", "ascii", "abcd", generation, ttl=60)
+    await backend.set("feed", "accented", "éé", generation, ttl=60)
+    # 4 characters, 8 bytes
+    await backend.set("feed", "cyrillic", "ДДДД", generation, ttl=60)
+
+    assert await backend.get("feed", "ascii") is None
+    assert await backend.get("feed", "accented") is None
+    assert await backend.get("feed", "cyrillic") == "ДДДД"
+    assert backend.stats()["feed"]["size_bytes"] == 8
+
+
+async def test_second_feed_request_is_served_from_cache(client, publish_guide, monkeypatch):
+    await publish_guide("First")
+    first = await client.get("/guides")
+
+    async def get_list_of_guides(*args, **kwargs):
+        raise AssertionError("Feed was read from the database")
+
+    monkeypatch.setattr(service, "get_list_of_guides", get_list_of_guides)
+    second = await client.get("/guides")
+
+    assert second.status_code == 200
+    assert second.json() == first.json()
+
+
+async def test_feed_cache_is_invalidated_by_published_guide(client, publish_guide):
+    await publish_guide("First")
+    await client.get("/guides")
+
+    await publish_guide("Second")
+
+    response = await client.get("/guides")
+    assert [guide["title"] for guide in response.json()["guides"]] == ["Second", "First"]
+
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import select
+
+from core import service as core_service
+from core.models import Guide
+from core.service import count_cache, count_cached
+from guides import service
+from guides.constants import FEED_CACHE_NAMESPACE
+
+
+async def test_feed_count_follows_published_guides(client, publish_guide):
+    await publish_guide("First")
+    response = await client.get("/guides", params={"page_size": 1})
+    assert response.json()["pages"] == 1
+
+    await publish_guide("Second")
+
+    response = await client.get("/guides", params={"page": 2, "page_size": 1})
+    assert response.status_code == 200
+    assert response.json()["pages"] == 2
+    assert response.json()["guides"][0]["title"] == "First"
+
+
+async def test_feed_count_follows_deleted_guides(client, db, publish_guide):
+    first = await publish_guide("First")
+    await publish_guide("Second")
+    response = await client.get("/guides", params={"page_size": 1})
+    assert response.json()["pages"] == 2
+
+    await service.delete_guide(db, first)
+
+    response = await client.get("/guides", params={"page_size": 1})
+    assert response.json()["pages"] == 1
+    assert response.json()["hasNext"] is False
+
+
+async def test_page_past_the_end_of_feed_is_not_found(client, publish_guide):
+    await publish_guide()
+
+    response = await client.get("/guides", params={"page": 2})
+
+    assert response.status_code == 404
+
+
+async def test_count_isnt_stored_when_cache_is_cleared_during_count(db, monkeypatch):
+    count_exact = core_service.count_exact
+
+    async def count_and_clear(db, statement):
+        count = await count_exact(db, statement)
+        count_cache.clear()
+        return count
+
+    monkeypatch.setattr(core_service, "count_exact", count_and_clear)
+
+    assert await count_cached(db, select(Guide)) == 0
+    assert count_cache.stats()["entries"] == 0
+
+
+async def test_feed_count_from_replica_isnt_cached(replica):
+    async with replica() as replica_db:
+        assert await count_cached(replica_db, select(Guide), FEED_CACHE_NAMESPACE) == 0
+
+    assert count_cache.stats()["entries"] == 0
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, select, text, update
+
+from core import images
+from core.images import build_pending_variants, claim_pending_variants, variant_path
+from core.models import MediaFile
+
+PATH = "media/store/ab/cd/abcd.jpg"
+
+
+@pytest.fixture
+async def media_file(db):
+    db.add(MediaFile(path=PATH, sha256="abcd", content_type="image/jpeg", size=1, ref_count=1))
+    await db.commit()
+
+
+def built_variants(path: str) -> dict[str, str]:
+    return {"thumbnail.webp": variant_path(path, "thumbnail", "webp")}
+
+
+async def test_row_isnt_locked_while_variants_are_built(db, database, media_file, monkeypatch):
+    async def store_variants(path):
+        # A locked row would make NOWAIT fail, e.g. for the media garbage collector
+        async with database() as other:
+            await other.execute(select(MediaFile).where(MediaFile.path == path)
+                                .with_for_update(nowait=True))
+        return built_variants(path)
+
+    monkeypatch.setattr(images, "store_variants", store_variants)
+
+    assert await build_pending_variants(db) == 1
+
+    media = (await db.execute(select(MediaFile.variants, MediaFile.variants_claimed_until)
+                              .where(MediaFile.path == PATH))).one()
+    assert media.variants == built_variants(PATH)
+    assert media.variants_claimed_until is None
+
+
+async def test_claimed_file_is_skipped_until_the_lease_runs_out(db, database, media_file):
+    assert await claim_pending_variants(db, batch_size=10) == [PATH]
+
+    async with database() as other_worker:
+        assert await claim_pending_variants(other_worker, batch_size=10) == []
+        await db.execute(update(MediaFile)
+                         .values(variants_claimed_until=datetime.now(timezone.utc)
+                                 - timedelta(seconds=1)))
+        await db.commit()
+        assert await claim_pending_variants(other_worker, batch_size=10) == [PATH]
+
+
+async def test_variants_of_collected_file_are_deleted(db, database, media_file, monkeypatch):
+    deleted = []
+
+    async def store_variants(path):
+        async with database() as collector:
+            # Fail instead of waiting if the row is still locked
+            await collector.execute(text("SET LOCAL lock_timeout = '2s'"))
+            await collector.execute(delete(MediaFile).where(MediaFile.path == path))
+            await collector.commit()
+        return built_variants(path)
+
+    async def delete_file(key):
+        deleted.append(key)
+
+    monkeypatch.setattr(images, "store_variants", store_variants)
+    monkeypatch.setattr(images.storage, "delete", delete_file)
+
+    assert await build_pending_variants(db) == 1
+
+    assert deleted == list(built_variants(PATH).values())
+
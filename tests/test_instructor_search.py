@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import event
+
+from core.models import User
+from database import engine
+from utils.query_counter import assert_max_queries
+
+MATCHING_INSTRUCTORS = 25
+
+
+@pytest.fixture
+async def instructors(create_user):
+    for _ in range(MATCHING_INSTRUCTORS):
+        await create_user(last_name="Smith", is_instructor=True)
+    await create_user(last_name="Brown", is_instructor=True)
+    await create_user(last_name="Smith")
+
+
+@pytest.fixture
+def loaded_users():
+    """Ids of User objects loaded from the database while the fixture is active"""
+    user_ids = []
+
+    def on_load(user, context):
+        user_ids.append(user.user_id)
+
+    event.listen(User, "load", on_load)
+    yield user_ids
+    event.remove(User, "load", on_load)
+
+
+async def test_search_loads_only_the_page_in_one_statement(client, instructors, loaded_users):
+    with assert_max_queries(engine, 1):
+        response = await client.get("/users/instructors/search",
+                                    params={"search": "smith", "page": 2, "page_size": 10})
+
+    assert response.status_code == 200
+    assert response.json()["pages"] == 3
+    assert len(response.json()["users"]) == 10
+    assert len(loaded_users) == 10
+
+
+async def test_similarity_search_sets_threshold_and_loads_only_the_page(client, instructors,
+                                                                        loaded_users):
+    with assert_max_queries(engine, 2):
+        response = await client.get("/users/instructors/search",
+                                    params={"search": "john smith", "page_size": 10,
+                                            "mode": "similarity"})
+
+    assert response.status_code == 200
+    assert response.json()["pages"] == 3
+    assert len(loaded_users) == 10
+
+
+async def test_search_past_last_page_is_not_found(client, instructors):
+    response = await client.get("/users/instructors/search",
+                                params={"search": "smith", "page": 4, "page_size": 10})
+
+    assert response.status_code == 404
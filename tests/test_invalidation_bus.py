@@ -0,0 +1,109 @@
+import asyncio
+
+import asyncpg
+import pytest
+from sqlalchemy import func, select
+
+from core.cache import invalidation_handlers, listen_for_invalidations
+from core.settings import CACHE_INVALIDATION_CHANNEL
+from database import DIRECT_DATABASE_DSN as DSN
+
+
+@pytest.fixture
+def invalidated_keys(monkeypatch):
+    """Keys invalidated in the "test" namespace, None for the whole namespace"""
+    keys = []
+    monkeypatch.setitem(invalidation_handlers, "test", keys.append)
+    return keys
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Connections opened by the listener. The application engine connects with keyword
+    arguments, the listener with the DSN."""
+    opened = []
+    connect = asyncpg.connect
+
+    async def recording_connect(*args, **kwargs):
+        connection = await connect(*args, **kwargs)
+        if args:
+            opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(asyncpg, "connect", recording_connect)
+    return opened
+
+
+@pytest.fixture
+async def start_listener():
+    """Start listeners as background tasks, the ones still running are cancelled afterwards"""
+    listeners = []
+
+    def start(retry_interval: int = 0) -> asyncio.Task:
+        listeners.append(asyncio.create_task(listen_for_invalidations(DSN, retry_interval)))
+        return listeners[-1]
+
+    yield start
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+
+async def notify_until_received(database, invalidated_keys, key: str) -> None:
+    # The listener may not be listening yet, notifications before that are lost
+    for _ in range(50):
+        async with database() as db:
+            await db.execute(select(func.pg_notify(CACHE_INVALIDATION_CHANNEL, f"test:{key}")))
+            await db.commit()
+        await asyncio.sleep(0.1)
+        if key in invalidated_keys:
+            return
+    raise AssertionError(f"Invalidation of {key} wasn't received")
+
+
+async def test_listener_reconnects_after_interface_error(database, invalidated_keys,
+                                                         connections, start_listener,
+                                                         monkeypatch):
+    connect = asyncpg.connect
+
+    async def failing_once(*args, **kwargs):
+        if args:
+            monkeypatch.setattr(asyncpg, "connect", connect)
+            raise asyncpg.InterfaceError("connection was closed in the middle of operation")
+        return await connect(*args, **kwargs)
+
+    monkeypatch.setattr(asyncpg, "connect", failing_once)
+    start_listener()
+
+    await notify_until_received(database, invalidated_keys, "1")
+
+    # Values cached while disconnected were dropped
+    assert invalidated_keys[0] is None
+
+
+async def test_listener_survives_failing_reset(database, invalidated_keys, connections,
+                                               start_listener, monkeypatch):
+    def failing_handler(key):
+        invalidated_keys.append(key)
+        if key is None:
+            raise RuntimeError("Index reload failed")
+
+    monkeypatch.setitem(invalidation_handlers, "test", failing_handler)
+    start_listener()
+    await notify_until_received(database, invalidated_keys, "1")
+
+    await connections[0].close()
+
+    await notify_until_received(database, invalidated_keys, "2")
+
+
+async def test_cancelled_listener_closes_connection(database, invalidated_keys, connections,
+                                                    start_listener):
+    listener = start_listener()
+    await notify_until_received(database, invalidated_keys, "1")
+
+    listener.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+    assert connections[0].is_closed()
@@ -0,0 +1,118 @@
+import socket
+from email import message_from_bytes
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select
+
+from core.constants import MailStatus, ACTIVATE_ACCOUNT_SUBJECT, ACTIVATE_ACCOUNT_TEMPLATE
+from core.models import MailOutbox
+from utils.mail import outbox
+from utils.mail.outbox import SMTPDelivery, deliver_batch, enqueue_mail
+
+
+class RecordingHandler:
+    """SMTP server side, keeps received messages or answers with the given reply"""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+        self.reply = "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reply.startswith("250"):
+            self.messages.append(message_from_bytes(envelope.content))
+            self.peers.add(session.peer)
+        return self.reply
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    """SMTP server in a thread, the outbox delivers to it"""
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    for name, value in {"MAIL_SERVER": controller.hostname, "MAIL_PORT": controller.port,
+                        "MAIL_STARTTLS": False, "MAIL_SSL_TLS": False,
+                        "USE_CREDENTIALS": False, "SUPPRESS_SEND": 0}.items():
+        monkeypatch.setattr(outbox.conf, name, value)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+async def smtp(smtp_server):
+    delivery = SMTPDelivery()
+    yield delivery
+    await delivery.close()
+
+
+async def queue(db, recipient: str, dedup_key: str | None = None) -> None:
+    await enqueue_mail(db, recipient=recipient, subject=ACTIVATE_ACCOUNT_SUBJECT,
+                       body={"first_name": "John", "url": "http://test/verify",
+                             "expire_at": "2030-01-01 00:00:00"},
+                       template_name=ACTIVATE_ACCOUNT_TEMPLATE, dedup_key=dedup_key)
+
+
+async def test_registration_email_is_delivered_after_commit(client, db, smtp_server, smtp):
+    response = await client.post("/auth/register",
+                                 json={"email": "john@guidio.com", "firstName": "John",
+                                       "lastName": "Brown", "password": "examplePassword123!"})
+    assert response.status_code == 201
+
+    assert await deliver_batch(db, smtp, batch_size=10) == 1
+
+    [message] = smtp_server.messages
+    assert message["To"] == "john@guidio.com"
+    assert message["Subject"] == ACTIVATE_ACCOUNT_SUBJECT
+    mail = await db.scalar(select(MailOutbox))
+    assert mail.status == MailStatus.sent.value
+    assert mail.sent_at is not None
+
+
+async def test_batch_is_sent_over_one_connection(db, smtp_server, smtp):
+    for n in range(3):
+        await queue(db, f"user{n}@guidio.com")
+    await db.commit()
+
+    assert await deliver_batch(db, smtp, batch_size=10) == 3
+
+    assert len(smtp_server.messages) == 3
+    assert len(smtp_server.peers) == 1
+
+
+async def test_rolled_back_email_isnt_sent(db, smtp_server, smtp):
+    await queue(db, "john@guidio.com")
+    await db.rollback()
+
+    assert await deliver_batch(db, smtp, batch_size=10) == 0
+    assert smtp_server.messages == []
+
+
+async def test_pending_duplicate_is_dropped(db, smtp_server, smtp):
+    await queue(db, "john@guidio.com", dedup_key="activation:1")
+    await queue(db, "john@guidio.com", dedup_key="activation:1")
+    await db.commit()
+
+    assert await deliver_batch(db, smtp, batch_size=10) == 1
+
+
+async def test_rejected_email_is_retried_later(db, smtp_server, smtp):
+    smtp_server.reply = "451 Try again later"
+    await queue(db, "john@guidio.com")
+    await db.commit()
+
+    assert await deliver_batch(db, smtp, batch_size=10) == 1
+
+    mail = await db.scalar(select(MailOutbox))
+    assert mail.status == MailStatus.pending.value
+    assert mail.attempts == 1
+    assert "Try again later" in mail.last_error
+    # Not due before the retry delay
+    assert await deliver_batch(db, smtp, batch_size=10) == 0
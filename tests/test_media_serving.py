@@ -0,0 +1,146 @@
+import os
+
+import httpx
+import pytest
+
+from core import media_router
+from main import app
+
+VARIANT = "store/ab/cd/abcd_medium"
+
+
+@pytest.fixture
+async def client():
+    """Client of the application, media serving doesn't need the database"""
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def media_root(tmp_path, monkeypatch):
+    """Empty MEDIA_ROOT served by the media router"""
+    root = os.path.realpath(tmp_path)
+    monkeypatch.setattr(media_router, "MEDIA_ROOT_REAL", root)
+    monkeypatch.setattr(media_router, "MEDIA_STORE_REAL", os.path.join(root, "store"))
+    monkeypatch.setattr(media_router, "MEDIA_UPLOAD_REAL",
+                        os.path.join(root, "store", "incoming"))
+    return root
+
+
+def write(root: str, path: str, content: bytes) -> None:
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "wb") as file:
+        file.write(content)
+
+
+async def test_avif_variant_is_served_to_clients_accepting_it(client, media_root):
+    write(media_root, f"{VARIANT}.webp", b"webp")
+    write(media_root, f"{VARIANT}.avif", b"avif")
+
+    response = await client.get(f"/media/{VARIANT}.webp",
+                                headers={"Accept": "image/avif,image/webp,*/*;q=0.8"})
+
+    assert response.status_code == 200
+    assert response.content == b"avif"
+    assert response.headers["content-type"] == "image/avif"
+    assert response.headers["vary"] == "Accept"
+    webp = await client.get(f"/media/{VARIANT}.webp", headers={"Accept": "image/webp"})
+    assert webp.headers["etag"] != response.headers["etag"]
+
+
+@pytest.mark.parametrize("accept", ["image/webp,*/*", "image/avif;q=0,image/webp"])
+async def test_webp_variant_is_served_without_avif_in_accept(client, media_root, accept):
+    write(media_root, f"{VARIANT}.webp", b"webp")
+    write(media_root, f"{VARIANT}.avif", b"avif")
+
+    response = await client.get(f"/media/{VARIANT}.webp", headers={"Accept": accept})
+
+    assert response.content == b"webp"
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+
+
+async def test_webp_variant_is_served_until_avif_is_built(client, media_root):
+    write(media_root, f"{VARIANT}.webp", b"webp")
+
+    response = await client.get(f"/media/{VARIANT}.webp", headers={"Accept": "image/avif"})
+
+    assert response.content == b"webp"
+
+
+ORIGINAL = "store/ab/cd/abcd.jpg"
+CONTENT = b"0123456789"
+
+
+@pytest.mark.parametrize("range_header, content, content_range",
+                         [("bytes=2-5", b"2345", "bytes 2-5/10"),
+                          ("bytes=7-", b"789", "bytes 7-9/10"),
+                          ("bytes=8-100", b"89", "bytes 8-9/10"),
+                          ("bytes=-3", b"789", "bytes 7-9/10"),
+                          ("bytes=-100", CONTENT, "bytes 0-9/10")])
+async def test_range_is_served_as_partial_content(client, media_root, range_header, content,
+                                                  content_range):
+    write(media_root, ORIGINAL, CONTENT)
+
+    response = await client.get(f"/media/{ORIGINAL}", headers={"Range": range_header})
+
+    assert response.status_code == 206
+    assert response.content == content
+    assert response.headers["content-range"] == content_range
+    assert response.headers["content-length"] == str(len(content))
+
+
+@pytest.mark.parametrize("range_header", ["bytes=0-1,4-5", "bytes=a-b", "bytes=5-2", "items=0-1"],
+                         ids=["multi-range", "malformed", "reversed", "other unit"])
+async def test_unsupported_range_gets_whole_file(client, media_root, range_header):
+    write(media_root, ORIGINAL, CONTENT)
+
+    response = await client.get(f"/media/{ORIGINAL}", headers={"Range": range_header})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert "content-range" not in response.headers
+
+
+@pytest.mark.parametrize("range_header", ["bytes=10-", "bytes=-0"])
+async def test_range_outside_of_file_is_not_satisfiable(client, media_root, range_header):
+    write(media_root, ORIGINAL, CONTENT)
+
+    response = await client.get(f"/media/{ORIGINAL}", headers={"Range": range_header})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
+
+
+@pytest.mark.parametrize("validator", ["etag", "last-modified"])
+async def test_range_applies_if_range_matches(client, media_root, validator):
+    write(media_root, ORIGINAL, CONTENT)
+    current = (await client.get(f"/media/{ORIGINAL}")).headers[validator]
+
+    response = await client.get(f"/media/{ORIGINAL}",
+                                headers={"Range": "bytes=0-1", "If-Range": current})
+
+    assert response.status_code == 206
+    assert response.content == b"01"
+
+
+async def test_whole_file_is_sent_if_range_doesnt_match(client, media_root):
+    write(media_root, ORIGINAL, CONTENT)
+
+    response = await client.get(f"/media/{ORIGINAL}",
+                                headers={"Range": "bytes=0-1", "If-Range": '"stale"'})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+async def test_current_file_is_not_modified(client, media_root):
+    write(media_root, ORIGINAL, CONTENT)
+    etag = (await client.get(f"/media/{ORIGINAL}")).headers["etag"]
+
+    response = await client.get(f"/media/{ORIGINAL}",
+                                headers={"If-None-Match": etag, "Range": "bytes=0-1"})
+
+    assert response.status_code == 304
+    assert response.content == b""
@@ -0,0 +1,161 @@
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image
+from sqlalchemy import select
+
+from config import UPLOAD_MAX_BYTES
+from core import media
+from core.constants import BASE_DIR
+from core.media import collect_unreferenced_media
+from core.models import MediaFile
+
+
+def jpeg(color: str = "red") -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(output, "JPEG")
+    return output.getvalue()
+
+
+def left_behind(store: str) -> list[str]:
+    return [os.path.join(directory, name)
+            for directory, _, names in os.walk(store) for name in names]
+
+
+@pytest.fixture
+async def user(client, create_user, log_in):
+    user = await create_user()
+    await log_in(client, user)
+    return user
+
+
+async def test_avatar_is_stored_by_its_content(client, user, media_store):
+    response = await client.post("/users/avatar",
+                                 files={"file": ("avatar.png", jpeg(), "image/png")})
+
+    assert response.status_code == 201
+    avatar = (await client.get("/users/avatar")).json()["avatar"]
+    # The sniffed format wins over the client's filename and content type
+    assert avatar.endswith(".jpg")
+    assert left_behind(media_store) == [os.path.normpath(os.path.join(BASE_DIR, avatar))]
+
+
+@pytest.mark.parametrize("content", [b"<svg xmlns='http://www.w3.org/2000/svg'/>", b"",
+                                     b"GIF8"], ids=["svg", "empty", "truncated signature"])
+async def test_upload_which_isnt_an_image_is_rejected(client, user, media_store, content):
+    response = await client.post("/users/avatar",
+                                 files={"file": ("avatar.jpg", content, "image/jpeg")})
+
+    assert response.status_code == 415
+    assert (await client.get("/users/avatar")).status_code == 404
+    assert left_behind(media_store) == []
+
+
+async def test_upload_over_the_limit_is_rejected(client, user, media_store):
+    content = jpeg() + b"\0" * (UPLOAD_MAX_BYTES - len(jpeg()) + 1)
+
+    response = await client.post("/users/avatar",
+                                 files={"file": ("avatar.jpg", content, "image/jpeg")})
+
+    assert response.status_code == 413
+    assert (await client.get("/users/avatar")).status_code == 404
+    assert left_behind(media_store) == []
+
+
+async def test_upload_at_the_limit_is_accepted(client, user, media_store):
+    content = jpeg() + b"\0" * (UPLOAD_MAX_BYTES - len(jpeg()))
+
+    response = await client.post("/users/avatar",
+                                 files={"file": ("avatar.jpg", content, "image/jpeg")})
+
+    assert response.status_code == 201
+
+
+async def test_direct_upload_over_the_limit_is_refused_before_upload(client, user):
+    response = await client.post("/media/uploads",
+                                 json={"contentType": "image/jpeg", "size": UPLOAD_MAX_BYTES + 1,
+                                       "sha256": "0" * 64})
+
+    assert response.status_code == 413
+
+
+async def test_direct_upload_larger_than_announced_is_rejected(client, user, media_store):
+    content = jpeg()
+    upload = (await client.post("/media/uploads",
+                                json={"contentType": "image/jpeg", "size": len(content),
+                                      "sha256": hashlib.sha256(content).hexdigest()})).json()
+
+    # Streamed without a declared size, the limit is checked while the body is received
+    async def body():
+        yield content
+        yield b"\0"
+
+    response = await client.request(upload["method"], upload["url"], headers=upload["headers"],
+                                    content=body())
+
+    assert response.status_code == 413
+    assert left_behind(media_store) == []
+
+
+async def upload_avatar(client, log_in, user, content: bytes) -> str:
+    await log_in(client, user)
+    response = await client.post("/users/avatar",
+                                 files={"file": ("avatar.jpg", content, "image/jpeg")})
+    assert response.status_code == 201
+    return (await client.get("/users/avatar")).json()["avatar"]
+
+
+async def ref_count(db, path: str) -> int | None:
+    return await db.scalar(select(MediaFile.ref_count)
+                           .where(MediaFile.path == path)
+                           .execution_options(populate_existing=True))
+
+
+async def test_same_content_is_stored_once(client, db, create_user, log_in, media_store,
+                                           monkeypatch):
+    first = await upload_avatar(client, log_in, await create_user(), jpeg())
+
+    async def save_once(*args, **kwargs):
+        raise AssertionError("Stored content was saved again")
+
+    monkeypatch.setattr(media.storage, "save", save_once)
+    second = await upload_avatar(client, log_in, await create_user(), jpeg())
+
+    assert second == first
+    assert await ref_count(db, first) == 2
+    assert len(left_behind(media_store)) == 1
+
+
+async def test_file_is_collected_once_the_last_reference_is_released(client, db, create_user,
+                                                                     log_in, media_store):
+    first_user, second_user = await create_user(), await create_user()
+    path = await upload_avatar(client, log_in, first_user, jpeg())
+    await upload_avatar(client, log_in, second_user, jpeg())
+
+    await client.delete("/users/avatar")
+    assert await ref_count(db, path) == 1
+    assert await collect_unreferenced_media(db, grace_seconds=0) == 0
+
+    await log_in(client, first_user)
+    await client.delete("/users/avatar")
+    assert await ref_count(db, path) == 0
+    assert await collect_unreferenced_media(db, grace_seconds=0) == 1
+
+    assert await ref_count(db, path) is None
+    assert left_behind(media_store) == []
+
+
+async def test_released_file_is_kept_during_grace_period(client, db, create_user, log_in,
+                                                         media_store):
+    path = await upload_avatar(client, log_in, await create_user(), jpeg())
+    await client.delete("/users/avatar")
+
+    assert await collect_unreferenced_media(db, grace_seconds=3600) == 0
+
+    # Uploaded again in the meantime, the file is referenced again
+    assert await upload_avatar(client, log_in, await create_user(), jpeg()) == path
+    assert await ref_count(db, path) == 1
+    assert await collect_unreferenced_media(db, grace_seconds=0) == 0
+    assert len(left_behind(media_store)) == 1
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from auth.hashing import PasswordHashingPool
+
+JOB_SECONDS = 0.5
+
+
+@pytest.fixture
+async def pool():
+    pool = PasswordHashingPool(workers=1, max_queue=0)
+    await pool.start()
+    yield pool
+    pool.shutdown()
+
+
+async def test_cancelled_request_keeps_running_job_pending(pool):
+    request = asyncio.create_task(pool.run(time.sleep, JOB_SECONDS))
+    await asyncio.sleep(0.1)
+
+    request.cancel()
+    await asyncio.gather(request, return_exceptions=True)
+
+    # The process is still busy, another job has to be rejected
+    assert pool.pending == 1
+    with pytest.raises(HTTPException) as e:
+        await pool.run(time.sleep, 0)
+    assert e.value.status_code == 503
+
+
+async def test_job_is_done_once_the_process_finishes_it(pool):
+    request = asyncio.create_task(pool.run(time.sleep, JOB_SECONDS))
+    await asyncio.sleep(0.1)
+    request.cancel()
+
+    await asyncio.sleep(JOB_SECONDS + 0.2)
+
+    assert pool.pending == 0
+    assert pool.stats()["completed"] == 1
+    assert await pool.run(time.sleep, 0) is None
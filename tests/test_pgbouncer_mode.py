@@ -0,0 +1,37 @@
+import re
+
+import pytest
+from sqlalchemy import text
+
+import database
+from core.pool import PgBouncerConnection
+
+
+@pytest.fixture
+async def pgbouncer_engine(test_databases, monkeypatch):
+    """Engine created with DB_PGBOUNCER=True, connected to the test database directly"""
+    monkeypatch.setattr(database, "DB_PGBOUNCER", True)
+    engine = database.create_engine_from_config(database.SQLALCHEMY_DATABASE_URL)
+    yield engine
+    await engine.dispose()
+
+
+async def test_statements_arent_cached(pgbouncer_engine):
+    async with pgbouncer_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+        raw = await connection.get_raw_connection()
+
+        adapted = raw.dbapi_connection
+        assert isinstance(adapted._connection, PgBouncerConnection)
+        assert adapted._prepared_statement_cache is None
+        assert adapted._connection._stmt_cache.get_max_size() == 0
+
+
+async def test_statement_names_are_unique_across_processes(pgbouncer_engine):
+    async with pgbouncer_engine.connect() as connection:
+        names = (await connection.execute(text("SELECT name FROM pg_prepared_statements"))) \
+            .scalars().all()
+
+    # The statement listing them is prepared as well
+    assert names
+    assert all(re.fullmatch(r"__asyncpg_stmt_[0-9a-f]{32}__", name) for name in names)
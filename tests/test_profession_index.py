@@ -0,0 +1,55 @@
+import pytest
+
+from core.models import Profession
+from users.service import ProfessionIndex
+
+PROFESSIONS = ["Xylophone tuner", "Xylophonist", "Bass xylophonist", "Marimba/xylophone maker",
+               "Antixylophone restorer", "Zither maker"]
+
+
+@pytest.fixture
+async def index(db):
+    """Index of the seeded professions and PROFESSIONS, which aren't committed"""
+    db.add_all(Profession(name=name) for name in PROFESSIONS)
+    await db.flush()
+    index = ProfessionIndex(ttl=60)
+    await index.load(db)
+    return index
+
+
+def names(professions) -> list[str]:
+    return [profession.name for profession in professions]
+
+
+async def test_prefix_matches_come_before_word_and_other_matches(db, index):
+    professions = await index.search(db, "xylo")
+
+    assert names(professions) == ["Xylophone tuner", "Xylophonist", "Bass xylophonist",
+                                  "Marimba/xylophone maker", "Antixylophone restorer"]
+
+
+async def test_search_ignores_case_and_surrounding_whitespace(db, index):
+    assert names(await index.search(db, "  XYLOPHONIST ")) == ["Xylophonist", "Bass xylophonist"]
+
+
+async def test_search_stops_at_limit(db, index):
+    assert names(await index.search(db, "xylo", limit=1)) == ["Xylophone tuner"]
+    assert names(await index.search(db, "xylo", limit=3)) == ["Xylophone tuner", "Xylophonist",
+                                                              "Bass xylophonist"]
+
+
+async def test_profession_is_found_by_id(db, index):
+    profession = (await index.search(db, "zither"))[0]
+
+    assert await index.get(db, profession.profession_id) == profession
+    assert await index.get(db, 0) is None
+
+
+async def test_invalidated_index_is_reloaded(db, index):
+    db.add(Profession(name="Xylograph printer"))
+    await db.flush()
+    assert "Xylograph printer" not in names(await index.search(db, "xylograph"))
+
+    index.invalidate()
+
+    assert names(await index.search(db, "xylograph")) == ["Xylograph printer"]
@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.query_plans import seed_rows, explain_sequential_scans
+from database import engine
+
+# Enough rows for the planner to prefer the indexes and for the deep page offset
+SEEDED_GUIDES = 20000
+
+
+@pytest.fixture(scope="module")
+async def sequential_scans(test_databases):
+    """Plans of the feed statements over seeded rows, the seeding transaction is rolled back"""
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        try:
+            await seed_rows(connection, SEEDED_GUIDES)
+            return await explain_sequential_scans(connection)
+        finally:
+            await transaction.rollback()
+
+
+@pytest.mark.parametrize("statement", ["published feed, first page", "published feed, deep page",
+                                       "author feed", "own guides"])
+async def test_feed_statement_doesnt_scan_sequentially(sequential_scans, statement):
+    assert sequential_scans[statement] == []
@@ -0,0 +1,82 @@
+import time
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from core import dependencies
+from core.middleware import ReadYourWritesMiddleware
+from core.models import User
+from core.settings import READ_PRIMARY_COOKIE
+from main import app
+
+
+@pytest.fixture
+async def routed_client(database, replica, monkeypatch):
+    """Client of the application with the replica database as read replica"""
+    monkeypatch.setattr(dependencies, "ReplicaSessionLocal", replica)
+    async with httpx.AsyncClient(app=ReadYourWritesMiddleware(app),
+                                 base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def user(db, replica, create_user):
+    """Same user on both databases, the first name tells which one a response came from"""
+    user = await create_user(first_name="Primary")
+    async with replica() as replica_db:
+        await create_user(first_name="Replica", session=replica_db, user_id=user.user_id)
+    return user
+
+
+def profile_update(first_name: str) -> dict:
+    return {"email": "john@guidio.com", "firstName": first_name, "lastName": "Doe",
+            "userDetails": {"linkedin": "", "github": "", "website": "", "bio": None,
+                            "professionId": None}}
+
+
+async def test_read_only_endpoint_reads_from_replica(routed_client, user):
+    response = await routed_client.get(f"/users/{user.user_id}")
+
+    assert response.status_code == 200
+    assert response.json()["firstName"] == "Replica"
+
+
+async def test_write_goes_to_primary_and_pins_client_to_it(routed_client, user, replica, db,
+                                                           log_in):
+    await log_in(routed_client, user)
+
+    response = await routed_client.put(f"/users/{user.user_id}", json=profile_update("Updated"))
+
+    assert response.status_code == 200
+    assert int(response.cookies[READ_PRIMARY_COOKIE]) > time.time()
+    async with replica() as replica_db:
+        assert await replica_db.scalar(select(User.first_name)) == "Replica"
+    # The client reads its own write although the replica hasn't caught up
+    response = await routed_client.get(f"/users/{user.user_id}")
+    assert response.json()["firstName"] == "Updated"
+
+
+async def test_failed_write_doesnt_pin_client(routed_client, user):
+    response = await routed_client.put(f"/users/{user.user_id}", json=profile_update("Updated"))
+
+    assert response.status_code == 401
+    assert READ_PRIMARY_COOKIE not in response.cookies
+
+
+async def test_expired_pin_reads_from_replica(routed_client, user):
+    routed_client.cookies.set(READ_PRIMARY_COOKIE, str(int(time.time()) - 1))
+
+    response = await routed_client.get(f"/users/{user.user_id}")
+
+    assert response.json()["firstName"] == "Replica"
+
+
+async def test_replica_read_isnt_cached(routed_client, user):
+    await routed_client.get(f"/users/{user.user_id}")
+    routed_client.cookies.set(READ_PRIMARY_COOKIE, str(int(time.time()) + 60))
+
+    # A lagging replica would otherwise outlive the invalidation sent by the primary
+    response = await routed_client.get(f"/users/{user.user_id}")
+
+    assert response.json()["firstName"] == "Primary"
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+
+import fakeredis
+import pytest
+
+from auth import service as auth_service
+from core import cache, router as core_router, service as core_service
+from core.cache import RedisCacheBackend, invalidation_tasks
+from guides import service as guides_service
+from guides.constants import FEED_CACHE_NAMESPACE
+from guides.schemas import GuideCreateUpdateSchema
+from users import service as users_service
+
+# Modules holding their own reference to the configured backend
+BACKEND_MODULES = (cache, core_router, core_service, auth_service, guides_service, users_service)
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """In-memory Redis server, every backend created while the fixture is active connects to it"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr("redis.asyncio.from_url",
+                        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs))
+    return server
+
+
+@pytest.fixture
+def worker_backends(redis_server):
+    """Backends of two workers sharing the Redis server"""
+    return RedisCacheBackend("redis://cache"), RedisCacheBackend("redis://cache")
+
+
+@pytest.fixture
+def redis_backend(worker_backends, monkeypatch):
+    """Application configured with CACHE_BACKEND=redis"""
+    backend = worker_backends[0]
+    for module in BACKEND_MODULES:
+        monkeypatch.setattr(module, "cache_backend", backend)
+    return backend
+
+
+async def test_invalidation_is_seen_by_other_workers(worker_backends):
+    first, second = worker_backends
+    generation = await second.generation(FEED_CACHE_NAMESPACE)
+    await second.set(FEED_CACHE_NAMESPACE, "page", "cached", generation, ttl=60)
+
+    await first.invalidate(FEED_CACHE_NAMESPACE)
+
+    assert await second.get(FEED_CACHE_NAMESPACE, "page") is None
+    assert await second.generation(FEED_CACHE_NAMESPACE) == generation + 1
+
+
+async def test_key_invalidation_keeps_other_keys(worker_backends):
+    first, second = worker_backends
+    generation = await first.generation("guide")
+    await first.set("guide", "1", "first", generation, ttl=60)
+    await first.set("guide", "2", "second", generation, ttl=60)
+
+    await second.invalidate("guide", "1")
+
+    assert await first.get("guide", "1") is None
+    assert await first.get("guide", "2") == "second"
+
+
+async def test_value_loaded_before_invalidation_isnt_stored(worker_backends):
+    first, second = worker_backends
+    generation = await first.generation(FEED_CACHE_NAMESPACE)
+    await second.invalidate(FEED_CACHE_NAMESPACE)
+
+    await first.set(FEED_CACHE_NAMESPACE, "page", "stale", generation, ttl=60)
+
+    assert await first.get(FEED_CACHE_NAMESPACE, "page") is None
+
+
+async def test_committed_change_invalidates_shared_feed(client, db, create_user, redis_backend):
+    user = await create_user(is_instructor=True)
+    data = GuideCreateUpdateSchema(title="First", content="Content", note=None, published=True)
+    await guides_service.save_guide(db, data, user.user_id)
+    response = await client.get("/guides")
+    assert [guide["title"] for guide in response.json()["guides"]] == ["First"]
+
+    data = GuideCreateUpdateSchema(title="Second", content="Content", note=None, published=True)
+    await guides_service.save_guide(db, data, user.user_id)
+    # Shared invalidations run as tasks started by the commit
+    await asyncio.gather(*invalidation_tasks)
+
+    response = await client.get("/guides")
+    assert [guide["title"] for guide in response.json()["guides"]] == ["Second", "First"]
+    assert redis_backend.hits == 0
+
+
+async def test_write_response_waits_for_shared_invalidation(client, create_user, log_in,
+                                                            redis_backend, monkeypatch):
+    await log_in(client, await create_user(is_instructor=True))
+    guide = {"title": "First", "content": "Content", "note": None, "published": True}
+    await client.post("/guides", json=guide)
+    assert len((await client.get("/guides")).json()["guides"]) == 1
+    invalidate = redis_backend.invalidate
+
+    async def slow_invalidate(namespace, key=None):
+        await asyncio.sleep(0.1)
+        await invalidate(namespace, key)
+
+    monkeypatch.setattr(redis_backend, "invalidate", slow_invalidate)
+
+    response = await client.post("/guides", json={**guide, "title": "Second"})
+
+    assert response.status_code == 201
+    assert len((await client.get("/guides")).json()["guides"]) == 2
+
+
+async def test_failed_shared_invalidation_is_logged(client, create_user, log_in, redis_backend,
+                                                    monkeypatch, caplog):
+    await log_in(client, await create_user(is_instructor=True))
+
+    async def failing_invalidate(namespace, key=None):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(redis_backend, "invalidate", failing_invalidate)
+
+    with caplog.at_level(logging.ERROR):
+        response = await client.post("/guides", json={"title": "First", "content": "Content",
+                                                      "note": None, "published": True})
+
+    assert response.status_code == 201
+    assert "Shared cache invalidation failed: Redis is down" in caplog.text
+
+
+def test_incomplete_backend_fails_on_creation():
+    class NoInvalidation(cache.CacheBackend):
+        async def get(self, namespace, key):
+            return None
+
+        async def generation(self, namespace):
+            return 0
+
+        async def set(self, namespace, key, value, generation, ttl):
+            pass
+
+    with pytest.raises(TypeError):
+        NoInvalidation()
@@ -0,0 +1,140 @@
+import hashlib
+import io
+import socket
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from moto.server import ThreadedMotoServer
+from PIL import Image
+
+from core import images, media, media_router
+from core.schemas import DirectUploadCreateSchema
+from core.storage import S3Storage, LocalStorage, StorageBackend, IMMUTABLE_CACHE_CONTROL
+
+BUCKET = "media"
+# Modules holding their own reference to the configured storage
+STORAGE_MODULES = (images, media, media_router)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def jpeg(color: str = "red") -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(output, "JPEG")
+    return output.getvalue()
+
+
+def upload_request(content: bytes) -> dict:
+    return {"contentType": "image/jpeg", "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest()}
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    """S3 server in a thread standing in for MinIO or AWS"""
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_storage(s3_server, monkeypatch):
+    """Application configured with STORAGE_BACKEND=s3, the bucket is emptied after the test"""
+    storage = S3Storage(BUCKET, s3_server, "us-east-1", "test", "test", None)
+    storage.client.create_bucket(Bucket=BUCKET)
+    for module in STORAGE_MODULES:
+        monkeypatch.setattr(module, "storage", storage)
+    yield storage
+    for item in storage.client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+        storage.client.delete_object(Bucket=BUCKET, Key=item["Key"])
+
+
+@pytest.fixture
+def no_downloads(s3_storage, monkeypatch):
+    """Uploads are checked without their bytes passing through the api"""
+    def download_file(*args, **kwargs):
+        raise AssertionError("Upload was downloaded by the api")
+
+    monkeypatch.setattr(s3_storage.client, "download_file", download_file)
+
+
+def stored_keys(storage: S3Storage) -> list[str]:
+    return [item["Key"] for item in
+            storage.client.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+
+
+async def test_signed_upload_is_moved_into_store(client, create_user, log_in, s3_storage,
+                                                 no_downloads):
+    await log_in(client, await create_user())
+    content = jpeg()
+
+    response = await client.post("/media/uploads", json=upload_request(content))
+    assert response.status_code == 201
+    upload = response.json()
+    assert upload["uploadRequired"]
+    # Straight to the storage, the bytes don't pass through the api
+    response = httpx.request(upload["method"], upload["url"], headers=upload["headers"],
+                             content=content)
+    assert response.status_code == 200
+
+    response = await client.put("/users/avatar/upload",
+                                json={"uploadToken": upload["uploadToken"]})
+    assert response.status_code == 200
+
+    key = media.store_key(hashlib.sha256(content).hexdigest(), "jpg")
+    assert stored_keys(s3_storage) == [key]
+    head = s3_storage.client.head_object(Bucket=BUCKET, Key=key)
+    assert head["ContentLength"] == len(content)
+    assert head["ContentType"] == "image/jpeg"
+    assert head["CacheControl"] == IMMUTABLE_CACHE_CONTROL
+
+
+async def test_stored_content_isnt_uploaded_again(client, create_user, log_in, s3_storage):
+    await log_in(client, await create_user())
+    content = jpeg()
+    upload = (await client.post("/media/uploads", json=upload_request(content))).json()
+    httpx.request(upload["method"], upload["url"], headers=upload["headers"], content=content)
+    await client.put("/users/avatar/upload", json={"uploadToken": upload["uploadToken"]})
+
+    upload = (await client.post("/media/uploads", json=upload_request(content))).json()
+
+    assert not upload["uploadRequired"]
+    response = await client.put("/users/avatar/upload",
+                                json={"uploadToken": upload["uploadToken"]})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("uploaded, checksum", [(jpeg("blue"), "SHA256"),
+                                                (jpeg() + b"\0", "SHA256"),
+                                                (jpeg(), None)],
+                         ids=["other content", "other size", "no checksum"])
+async def test_upload_not_matching_the_token_is_rejected(db, create_user, s3_storage,
+                                                         no_downloads, uploaded, checksum):
+    # Put without the signed request, the storage kept whatever checksum came with it
+    user = await create_user()
+    content = jpeg()
+    upload = await media.create_direct_upload(
+        db, DirectUploadCreateSchema(**upload_request(content)), user.user_id)
+    upload_key = media.read_upload_token(upload.upload_token)["upload_key"]
+    s3_storage.client.put_object(Bucket=BUCKET, Key=upload_key, Body=uploaded,
+                                 **({"ChecksumAlgorithm": checksum} if checksum else {}))
+    with pytest.raises(HTTPException) as error:
+        await media.confirm_direct_upload(db, upload.upload_token, user.user_id)
+
+    assert error.value.status_code == 400
+    assert stored_keys(s3_storage) == []
+
+
+def test_incomplete_storage_fails_on_creation():
+    class NoUploads(LocalStorage):
+        create_upload = StorageBackend.create_upload
+
+    with pytest.raises(TypeError):
+        NoUploads()
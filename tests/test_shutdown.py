@@ -0,0 +1,43 @@
+import asyncio
+
+import main
+
+
+class Recorder:
+    """Stands in for the engines and process pools, records when they are closed"""
+
+    def __init__(self, name: str, events: list[str]):
+        self.name = name
+        self.events = events
+
+    def shutdown(self) -> None:
+        self.events.append(f"{self.name} shut down")
+
+    async def dispose(self) -> None:
+        self.events.append(f"{self.name} disposed")
+
+
+async def test_background_tasks_stop_before_engines_and_pools_close(monkeypatch):
+    events = []
+    for name in ("engine", "replica_engine", "password_hashing_pool", "image_variant_pool"):
+        monkeypatch.setattr(main, name, Recorder(name, events))
+    started = asyncio.Event()
+
+    async def worker():
+        started.set()
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            events.append("worker cancelled")
+            raise
+
+    task = main.start_background_task(worker())
+    await started.wait()
+
+    await main.dispose_engine()
+
+    assert task.cancelled()
+    assert events == ["worker cancelled", "password_hashing_pool shut down",
+                      "image_variant_pool shut down", "engine disposed",
+                      "replica_engine disposed"]
+    assert main.background_tasks == []
@@ -0,0 +1,45 @@
+import hashlib
+
+import pytest
+
+from auth.dependencies import get_token_user_id, verified_tokens
+from auth.service import create_auth_token
+from core.cache import LRUCache
+
+
+def test_cache_keeps_max_entries_evicting_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    cache.get("first")
+
+    cache.set("third", 3)
+
+    assert cache.get("first") == 1
+    assert cache.get("second") is None
+    assert cache.get("third") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entry_without_ttl_is_kept_and_entry_with_ttl_expires():
+    cache = LRUCache(max_entries=10)
+    cache.set("kept", 1)
+    cache.set("expired", 2, ttl=-1)
+
+    assert cache.get("kept") == 1
+    assert cache.get("expired") is None
+
+
+def test_cache_needs_a_bound():
+    with pytest.raises(ValueError):
+        LRUCache(ttl=60)
+
+
+async def test_verified_token_is_cached():
+    verified_tokens.clear()
+    token = await create_auth_token(42)
+
+    assert await get_token_user_id(token) == 42
+
+    key = hashlib.sha256(token.encode()).digest()
+    assert verified_tokens.get(key) == 42
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import event, select
+
+from core.models import Guide
+from database import engine
+from guides import service as guides_service
+from guides.schemas import GuideCreateUpdateSchema
+
+
+@pytest.fixture
+def commits():
+    """Number of transactions committed on the application engine while the fixture is active"""
+    counter = []
+
+    def on_commit(connection):
+        counter.append(connection)
+
+    event.listen(engine.sync_engine, "commit", on_commit)
+    yield counter
+    event.remove(engine.sync_engine, "commit", on_commit)
+
+
+async def test_profile_update_is_one_transaction(client, create_user, log_in, commits):
+    user = await create_user(is_instructor=True)
+    await log_in(client, user)
+    commits.clear()
+
+    response = await client.put(f"/users/{user.user_id}",
+                                json={"email": "john@guidio.com", "firstName": "Updated",
+                                      "lastName": "Doe",
+                                      "userDetails": {"linkedin": "", "github": "",
+                                                      "website": "", "bio": "Bio",
+                                                      "professionId": None}})
+
+    assert response.status_code == 200
+    assert response.json()["userDetails"]["bio"] == "Bio"
+    assert len(commits) == 1
+
+
+async def test_guide_deletion_is_one_transaction(client, db, create_user, log_in, commits):
+    user = await create_user(is_instructor=True)
+    data = GuideCreateUpdateSchema(title="Guide", content="Content", note=None, published=True)
+    guide = await guides_service.save_guide(db, data, user.user_id)
+    await log_in(client, user)
+    commits.clear()
+
+    response = await client.delete(f"/guides/{guide.guide_id}")
+
+    assert response.is_success
+    assert len(commits) == 1
+    assert await db.scalar(select(Guide.guide_id)) is None
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import select, update
+
+from core.models import Profession, UserDetail
+from database import engine
+from utils.query_counter import assert_max_queries
+
+INSTRUCTORS = 20
+
+
+@pytest.fixture
+async def instructors(db, create_user):
+    """Instructors with a profession, every relationship UserReadSchema serializes is set"""
+    users = [await create_user(is_instructor=True) for _ in range(INSTRUCTORS)]
+    profession_id = await db.scalar(select(Profession.profession_id).limit(1))
+    await db.execute(update(UserDetail).values(profession_id=profession_id))
+    await db.commit()
+    return users
+
+
+async def test_instructors_page_is_loaded_in_one_statement(client, instructors):
+    with assert_max_queries(engine, 1):
+        response = await client.get("/users/instructors")
+
+    assert response.status_code == 200
+    users = response.json()["users"]
+    assert len(users) == INSTRUCTORS
+    assert all(user["userDetails"]["profession"] for user in users)
+
+
+async def test_user_profile_loads_details_with_the_user(client, instructors):
+    user_id = instructors[0].user_id
+
+    # Version check, then the user with details and profession
+    with assert_max_queries(engine, 2):
+        response = await client.get(f"/users/{user_id}")
+
+    assert response.status_code == 200
+    assert response.json()["userDetails"]["profession"]
+
+
+async def test_current_user_loads_details_with_the_user(client, instructors, log_in):
+    await log_in(client, instructors[0])
+
+    with assert_max_queries(engine, 1):
+        response = await client.get("/auth/token")
+
+    assert response.status_code == 200
+    assert response.json()["userDetails"]["profession"]